@@ -0,0 +1,97 @@
+"""
+Benchmarks for pyshipwire.  Each bench_* module can be run on its
+own, eg:
+
+    python -m benchmarks.bench_transport
+"""
+import math
+import threading
+import time
+
+
+def measure(func, iterations):
+    """
+    Calls 'func' the given number of times and returns a list of the
+    individual call durations in seconds.
+    """
+    timings = []
+    for i in range(iterations):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return timings
+
+
+def summarize(label, timings):
+    """
+    Prints the mean and median of a list of timings, in milliseconds.
+    """
+    ordered = sorted(timings)
+    mean = sum(ordered) / len(ordered)
+    median = ordered[len(ordered) // 2]
+    print("{0:<32} mean {1:8.3f} ms   median {2:8.3f} ms".format(
+        label, mean * 1000, median * 1000))
+
+
+def percentile(ordered, percent):
+    """
+    Returns the given percentile of a sorted list, by nearest rank.
+    """
+    rank = int(math.ceil(percent / 100.0 * len(ordered)))
+    return ordered[min(len(ordered), max(rank, 1)) - 1]
+
+
+def load(func, iterations, concurrency=1):
+    """
+    Calls 'func' the given number of times from 'concurrency' threads,
+    and returns a (timings, errors, elapsed) tuple: the duration of
+    each successful call, the number of calls which raised or returned
+    False, and the wall clock time taken, all in seconds.
+    """
+    timings = []
+    errors = [0]
+    remaining = [iterations]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            start = time.time()
+            try:
+                ok = func() is not False
+            except Exception:
+                ok = False
+            elapsed = time.time() - start
+            with lock:
+                if ok:
+                    timings.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    start = time.time()
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return timings, errors[0], time.time() - start
+
+
+def report(label, timings, errors, elapsed):
+    """
+    Prints the throughput and p50/p95/p99 latency of a load() run, in
+    calls per second and milliseconds.
+    """
+    calls = len(timings) + errors
+    line = "{0:<32} {1:8.1f} calls/s".format(label, calls / elapsed)
+    if timings:
+        ordered = sorted(timings)
+        line += "   p50 {0:8.3f}   p95 {1:8.3f}   p99 {2:8.3f} ms".format(
+            *[percentile(ordered, percent) * 1000
+              for percent in (50, 95, 99)])
+    if errors:
+        line += "   errors {0}".format(errors)
+    print(line)
@@ -0,0 +1,132 @@
+"""
+End to end benchmark of ShipwireAPI against a local stub server which
+emulates InventoryServices.php, RateServices.php and
+FulfillmentServices.php (see stub_server.emulated_responses), so that
+the whole path of building, sending, parsing and caching is measured
+without touching Shipwire's servers.
+
+Reports throughput and p50/p95/p99 latency for inventory lookups (cold,
+from a warm cache and for large sku lists), order splitting, shipping
+quotes and order placement.  The stub's latency, reply size and error
+rate can be set from the command line, eg:
+
+    python -m benchmarks.bench_api --latency 0.02 --error-rate 0.01
+
+Failed calls are counted as errors and left out of the latencies.
+"""
+import argparse
+import random
+import threading
+
+from benchmarks import load, report
+from shipwire.shipwire_api import *
+from benchmarks.stub_server import StubServer, emulated_responses
+
+
+ADDRESS = AddressInfo("Some Body", "12345 S Someplace Rd", "", "Duster", "IN",
+                      "United States", "47999", "123-4567", "")
+
+
+def ok(results):
+    """
+    Returns False if any of place_order's results failed.
+    """
+    return all([result.ok for result in results.values()])
+
+
+def scenarios(api, catalog, args):
+    """
+    Returns a list of (label, func, iterations) tuples to load() with.
+    """
+    rand = random.Random(args.seed)
+    lock = threading.Lock()
+
+    def sample(count):
+        with lock:
+            return rand.sample(catalog, min(count, len(catalog)))
+
+    def cart(count):
+        with lock:
+            return CartItems(dict([(sku, rand.randint(1, 3)) for sku in
+                                   rand.sample(catalog, count)]))
+
+    def cold_lookup():
+        api.inventory_lookup(sample(args.skus))
+
+    warm_skus = sample(args.skus)
+    def warm_lookup():
+        api.inventory_lookup(warm_skus, estimate_ok=True)
+
+    def large_lookup():
+        api.inventory_lookup(sample(args.large_skus))
+
+    def splitting():
+        api.optimal_order_splitting(ADDRESS, cart(args.cart_size))
+
+    split_cart = SplitCart()
+    split_cart.add_cart("CHI", cart(args.cart_size))
+    split_cart.add_cart("UK", cart(args.cart_size))
+    methods = {"CHI" : "GD", "UK" : "INTL"}
+
+    def quotes():
+        return not api.get_shipping_options(ADDRESS, split_cart).errors
+
+    def place_order():
+        return ok(api.place_order(ADDRESS, split_cart, methods))
+
+    large = max(1, args.iterations // 10)
+    return [
+        ("inventory_lookup cold", cold_lookup, args.iterations),
+        ("inventory_lookup warm", warm_lookup, args.iterations),
+        ("inventory_lookup {0} skus".format(args.large_skus), large_lookup,
+         large),
+        ("optimal_order_splitting", splitting, args.iterations),
+        ("get_shipping_options", quotes, args.iterations),
+        ("place_order", place_order, args.iterations),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="calls in flight at once")
+    parser.add_argument("--latency", type=float, default=0.005,
+                        help="stub reply delay, in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests answered with a 503")
+    parser.add_argument("--padding", type=int, default=0,
+                        help="extra bytes added to each reply")
+    parser.add_argument("--catalog", type=int, default=5000,
+                        help="number of skus in the emulated catalog")
+    parser.add_argument("--skus", type=int, default=10,
+                        help="skus per inventory lookup")
+    parser.add_argument("--large-skus", type=int, default=2000,
+                        help="skus per large inventory lookup")
+    parser.add_argument("--cart-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    catalog = ["sku_{0:06d}".format(i) for i in range(args.catalog)]
+    responses = emulated_responses(args.catalog, args.padding)
+    with StubServer(responses, latency=args.latency,
+                    error_rate=args.error_rate, seed=args.seed) as server:
+        with ShipwireAPI("bench", "bench", "test",
+                         endpoint=server.url) as api:
+            # every quote should reach the stub:
+            api.cache_quotes = False
+            for label, func, iterations in scenarios(api, catalog, args):
+                if label.endswith("warm"):
+                    func() # prime the cache
+                timings, errors, elapsed = load(
+                    func, iterations, args.concurrency)
+                report(label, timings, errors, elapsed)
+            stats = api.transport.stats
+        print("stub requests: {0}, errors injected: {1}, retries: {2}, "
+              "short circuited: {3}".format(
+                  server.stats["requests"], server.stats["errors"],
+                  stats["retries"], stats["short_circuited"]))
+
+
+if __name__ == "__main__":
+    main()
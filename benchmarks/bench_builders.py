@@ -0,0 +1,82 @@
+"""
+Compares the request builders in shipwire.builders against the
+str.format templates they replaced, for a 1,000 line cart and an
+inventory request for 10,000 skus.
+"""
+from benchmarks import measure, summarize
+from shipwire.builders import *
+from shipwire.common import *
+
+
+CART_LINES = 1000
+INVENTORY_SKUS = 10000
+CREDENTIALS = ("nobody@donotreply.pleasedonotregisterthistld", "123456",
+               "Production")
+
+
+def legacy_items_xml(sku_list):
+    template = """
+<Item num="{0}">
+  <Code>{1}</Code>
+  <Quantity>{2}</Quantity>
+</Item>
+    """.strip()
+    items = {}
+    for sku in sku_list:
+        if not items.has_key(sku):
+            items[sku] = 1
+        else:
+            items[sku] += 1
+    xml = ""
+    counter = 0
+    for sku, quantity in items.items():
+        xml += template.format(counter, sku, quantity) + "\n"
+        counter += 1
+    return xml
+
+
+def legacy_inventory_request(warehouse, sku_list):
+    product_template = "<ProductCode>{0}</ProductCode>"
+    req_template = """
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE InventoryUpdateResponse SYSTEM "http://www.shipwire.com/exec/download/InventoryUpdateResponse.dtd">
+<InventoryUpdate>
+    <Username>{0}</Username>
+    <Password>{1}</Password>
+    <Server>{2}</Server>
+    <Warehouse>{3}</Warehouse>
+    {4}
+    <IncludeEmpty/>
+</InventoryUpdate>
+    """.strip()
+    product_lines = "\n".join(
+        [product_template.format(sku) for sku in sku_list])
+    return req_template.format(
+        CREDENTIALS[0], CREDENTIALS[1], CREDENTIALS[2], warehouse,
+        product_lines)
+
+
+def main():
+    # the old carts were lists with one entry per unit
+    sku_list = []
+    items = {}
+    for i in range(CART_LINES):
+        sku = "sku_{0:05d}".format(i)
+        items[sku] = i % 5 + 1
+        sku_list.extend([sku] * items[sku])
+    skus = ["sku_{0:05d}".format(i) for i in range(INVENTORY_SKUS)]
+
+    print("{0} line cart ({1} units)".format(CART_LINES, len(sku_list)))
+    summarize("legacy CartItems.to_xml",
+              measure(lambda: legacy_items_xml(sku_list), 50))
+    summarize("builders.items_xml", measure(lambda: items_xml(items), 50))
+
+    print("inventory request for {0} skus".format(INVENTORY_SKUS))
+    summarize("legacy gen_req",
+              measure(lambda: legacy_inventory_request("CHI", skus), 50))
+    summarize("builders.inventory_request",
+              measure(lambda: inventory_request(CREDENTIALS, "CHI", skus), 50))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Compares the indexed country lookups in shipwire.common against the
+linear scans they replaced, over a large list of addresses.
+"""
+import random
+
+from benchmarks import measure, summarize
+from shipwire.common import *
+
+
+ADDRESSES = 5000
+
+
+def legacy_iso_for_country(country):
+    for line in COUNTRIES:
+        normalized_line = [i.upper() for i in line]
+        normalized_target = country.upper().replace("_", " ")
+        if normalized_line.count(normalized_target):
+            return line[-1]
+    return None
+
+
+def legacy_country_for_warehouse(warehouse_code):
+    for country_name, country_set in WAREHOUSES.items():
+        if country_set.has_key(warehouse_code):
+            return legacy_iso_for_country(country_name)
+    return None
+
+
+def legacy_is_domestic(shipping_address, warehouse_code):
+    shipping_country = legacy_iso_for_country(shipping_address.country)
+    warehouse_country = legacy_country_for_warehouse(warehouse_code)
+    if shipping_country is not None and warehouse_country is not None:
+        return shipping_country == warehouse_country
+    return False
+
+
+LEGACY_EU_ISO_CODES = tuple([legacy_iso_for_country(n) for n in EU_COUNTRIES])
+
+
+def legacy_is_eu(country):
+    return legacy_iso_for_country(country) in LEGACY_EU_ISO_CODES
+
+
+def main():
+    rand = random.Random(0)
+    spellings = []
+    for line in COUNTRIES:
+        for alias in line:
+            spellings += [alias, alias.lower(), alias.replace(" ", "_")]
+    addresses = [
+        AddressInfo("", "", "", "", "", rand.choice(spellings), "", "", "")
+        for i in range(ADDRESSES)]
+    print("{0} addresses".format(ADDRESSES))
+
+    for label, domestic, eu in [
+            ("linear scan", legacy_is_domestic, legacy_is_eu),
+            ("indexed", is_domestic, is_eu)]:
+        def run():
+            for addr in addresses:
+                for warehouse in WAREHOUSE_CODES:
+                    domestic(addr, warehouse)
+                eu(addr.country)
+        summarize(label, measure(run, 1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Compares parsing.iter_inventory against the StringIO + etree.parse +
+xpath parsing it replaced, on a synthetic InventoryUpdateResponse
+listing 50,000 products.  Each parser runs in its own process, so that
+its peak memory can be measured.
+"""
+from StringIO import StringIO
+import multiprocessing
+import resource
+import time
+
+from lxml import etree
+
+from shipwire.common import *
+from shipwire.parsing import iter_inventory
+
+
+PRODUCTS = 50000
+
+
+def synthetic_reply(products):
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<InventoryUpdateResponse>',
+        '  <Status>0</Status>',
+    ]
+    for i in range(products):
+        lines.append(
+            '  <Product code="sku_{0:06d}" quantity="{1}" pending="0" '
+            'good="{1}" backordered="0" reserved="0" shipping="0" '
+            'shipped="18" shippedLastWeek="0" orderedLastWeek="0"/>'.format(
+                i, i % 17))
+    lines.append('  <TotalProducts>{0}</TotalProducts>'.format(products))
+    lines.append('</InventoryUpdateResponse>')
+    return "\n".join(lines)
+
+
+def legacy_parse(raw):
+    fileob = StringIO(str(raw))
+    root = etree.parse(fileob).xpath("/InventoryUpdateResponse")[0]
+    items = []
+    for entry in root.xpath("Product"):
+        items.append(Inventory(entry.attrib["code"],
+                               int(entry.attrib["quantity"])))
+    return items
+
+
+def streaming_parse(raw):
+    # read the reply in network-sized pieces, and keep a running total
+    # rather than the products, as a catalog sync would
+    pieces = (raw[i:i+16384] for i in range(0, len(raw), 16384))
+    total = 0
+    for inv in iter_inventory(pieces):
+        total += inv.quantity
+    return total
+
+
+def streaming_list(raw):
+    pieces = (raw[i:i+16384] for i in range(0, len(raw), 16384))
+    return list(iter_inventory(pieces))
+
+
+def run(parse, raw, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    parse(raw)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, after - before))
+
+
+def main():
+    raw = synthetic_reply(PRODUCTS)
+    print("{0} products, {1:.1f} MB reply".format(
+        PRODUCTS, len(raw) / 1024.0 / 1024))
+    for label, parse in [("StringIO + etree.parse", legacy_parse),
+                         ("iter_inventory to a list", streaming_list),
+                         ("iter_inventory", streaming_parse)]:
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=run, args=(parse, raw, results))
+        worker.start()
+        elapsed, growth = results.get()
+        worker.join()
+        print("{0:<26} {1:8.1f} ms   peak memory +{2:6.1f} MB".format(
+            label, elapsed * 1000, growth / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Compares splitting.split_order against the greedy recursive cart_split
+it replaced, over generated carts and stock levels.
+"""
+import random
+import time
+
+from shipwire.splitting import *
+from shipwire.stock import StockMatrix
+
+
+CART_SIZES = (1, 10, 50, 200, 500)
+CARTS_PER_SIZE = 20
+BATCH_CARTS = 1000
+BATCH_CATALOG = 2000
+DOMESTIC = ("CHI", "LAX", "PHL", "DAL")
+INTERNATIONAL = ("TOR", "VAN", "UK", "FRA", "SYD", "HKG")
+
+
+def legacy_cart_split(stock, sku_req):
+    splits = {}
+    versions = {}
+    for warehouse in stock.keys():
+        versions[warehouse] = {}
+        for sku, quant in sku_req.items():
+            try:
+                if stock[warehouse][sku] >= quant:
+                    versions[warehouse][sku] = quant
+            except KeyError:
+                pass
+    best_wh = None
+    best_ct = 0
+    for wh_code, data in versions.items():
+        count = len(data.keys())
+        if count > best_ct:
+            best_wh = wh_code
+            best_ct = count
+    if not best_wh:
+        return {}, sku_req
+    splits[best_wh] = versions[best_wh]
+    new_req = {}
+    for sku in sku_req.keys():
+        if not versions[best_wh].has_key(sku):
+            new_req[sku] = sku_req[sku]
+    new_stock = {}
+    for code in stock.keys():
+        if code != best_wh:
+            new_stock[code] = stock[code]
+    if len(new_req.keys()) > 0 and len(new_stock.keys()) > 0:
+        new_split, new_remainder = legacy_cart_split(new_stock, new_req)
+        splits.update(new_split)
+        return splits, new_remainder
+    return splits, new_req
+
+
+def legacy_split_order(demand, stock, domestic):
+    local = dict([(k, v) for k, v in stock.items() if k in domestic])
+    intl = dict([(k, v) for k, v in stock.items() if k not in domestic])
+    results, remainder = {}, dict(demand)
+    if local:
+        results, remainder = legacy_cart_split(local, remainder)
+    if remainder and intl:
+        intl_results, remainder = legacy_cart_split(intl, remainder)
+        results.update(intl_results)
+    return results, remainder
+
+
+def generate(rand, size):
+    """
+    Returns a random cart of 'size' skus, and stock levels for it in
+    which each warehouse carries most of the skus, though not always
+    in the quantity wanted.
+    """
+    demand = {}
+    for i in range(size):
+        demand["sku_{0:04d}".format(i)] = rand.choice([1, 1, 1, 2, 3, 5, 20])
+    stock = {}
+    for warehouse in DOMESTIC + INTERNATIONAL:
+        stock[warehouse] = {}
+        for sku, qty in demand.items():
+            if rand.random() < 0.7:
+                stock[warehouse][sku] = rand.randint(0, qty * 4)
+    return demand, stock
+
+
+def main():
+    rand = random.Random(0)
+    print("{0} warehouses, {1} carts per size".format(
+        len(DOMESTIC + INTERNATIONAL), CARTS_PER_SIZE))
+    print("{0:>5} {1:<8} {2:>10} {3:>10} {4:>10} {5:>10}".format(
+        "skus", "solver", "mean ms", "shipments", "score", "unshipped"))
+    for size in CART_SIZES:
+        carts = [generate(rand, size) for i in range(CARTS_PER_SIZE)]
+        for label, solve in [("greedy", legacy_split_order),
+                             ("optimal", split_order)]:
+            elapsed = 0
+            shipments = 0
+            score = 0
+            unshipped = 0
+            for demand, stock in carts:
+                start = time.time()
+                split, remainder = solve(demand, stock, DOMESTIC)
+                elapsed += time.time() - start
+                shipments += len(split)
+                score += split_cost(split, DOMESTIC)
+                unshipped += sum(remainder.values())
+            print("{0:>5} {1:<8} {2:>10.3f} {3:>10.1f} {4:>10.1f} {5:>10.1f}".format(
+                size, label, elapsed * 1000 / len(carts),
+                float(shipments) / len(carts), float(score) / len(carts),
+                float(unshipped) / len(carts)))
+
+    # a batch of small carts drawing from one shared snapshot, as
+    # batch_order_splitting does:
+    catalog, stock = generate(rand, BATCH_CATALOG)
+    stock = StockMatrix.from_stock(stock)
+    carts = []
+    for i in range(BATCH_CARTS):
+        skus = rand.sample(sorted(catalog.keys()), rand.randint(1, 20))
+        carts.append(dict([(sku, rand.randint(1, 3)) for sku in skus]))
+    start = time.time()
+    for demand in carts:
+        split, remainder = split_order(demand, stock, DOMESTIC)
+        stock.take(split)
+    print("batch of {0} carts: {1:.3f} ms per cart".format(
+        BATCH_CARTS, (time.time() - start) * 1000 / BATCH_CARTS))
+
+
+if __name__ == "__main__":
+    main()
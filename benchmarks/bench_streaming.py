@@ -0,0 +1,72 @@
+"""
+Compares the peak memory and time of a catalog-sized inventory call
+made with post_and_fetch, which holds the whole request and reply in
+memory, against post_and_stream, which sends the request as it is built
+and parses the reply as it arrives.  The call asks for 50,000 skus from
+a local stub server, which answers with a product line for each.  Each
+variant runs in its own process, so that its peak memory can be
+measured.
+"""
+import multiprocessing
+import resource
+import time
+
+from benchmarks.bench_parsing import synthetic_reply
+from shipwire.builders import inventory_request, iter_inventory_request
+from shipwire.parsing import iter_inventory
+from shipwire.shipwire_api import ShipwireAPI
+from benchmarks.stub_server import StubServer
+
+
+PRODUCTS = 50000
+CREDENTIALS = ("bench", "bench", "test")
+
+
+def fetched(api, skus):
+    request = inventory_request(CREDENTIALS, "CHI", skus)
+    reply = api.post_and_fetch(request, "InventoryServices.php")
+    total = 0
+    for inv in iter_inventory(reply):
+        total += inv.quantity
+    return total
+
+
+def streamed(api, skus):
+    request = iter_inventory_request(CREDENTIALS, "CHI", skus)
+    reply = api.post_and_stream(request, "InventoryServices.php")
+    total = 0
+    for inv in iter_inventory(reply):
+        total += inv.quantity
+    return total
+
+
+def run(call, url, results):
+    skus = ["sku_{0:06d}".format(i) for i in range(PRODUCTS)]
+    with ShipwireAPI("bench", "bench", "test", endpoint=url) as api:
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.time()
+        call(api, skus)
+        elapsed = time.time() - start
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, after - before))
+
+
+def main():
+    reply = synthetic_reply(PRODUCTS)
+    print("{0} skus, {1:.1f} MB reply".format(
+        PRODUCTS, len(reply) / 1024.0 / 1024))
+    with StubServer({"InventoryServices.php" : reply}) as server:
+        for label, call in [("post_and_fetch", fetched),
+                            ("post_and_stream", streamed)]:
+            results = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=run, args=(call, server.url, results))
+            worker.start()
+            elapsed, growth = results.get()
+            worker.join()
+            print("{0:<26} {1:8.1f} ms   peak memory +{2:6.1f} MB".format(
+                label, elapsed * 1000, growth / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Compares per-call latency of a fresh connection per request (the old
+module-level requests.post behavior) against ShipwireAPI's pooled
+keep-alive transport, using a local stub server.
+
+Note that the stub speaks plain http, so the savings shown here are
+only the TCP handshake and session setup; against the real servers
+each fresh connection also pays for a TLS handshake.
+"""
+import requests
+
+from benchmarks import measure, summarize
+from shipwire.shipwire_api import ShipwireAPI
+from benchmarks.stub_server import StubServer
+
+
+ITERATIONS = 500
+RESPONSE = "<RateResponse><Status>OK</Status></RateResponse>"
+
+
+def main():
+    with StubServer({"RateServices.php" : RESPONSE}) as server:
+        uri = server.url + "RateServices.php"
+        headers = {'content-type': 'application/xml'}
+
+        def unpooled():
+            requests.post(uri, data="<RateRequest/>", headers=headers).text
+
+        api = ShipwireAPI("bench", "bench", "test", endpoint=server.url)
+        def pooled():
+            api.post_and_fetch("<RateRequest/>", "RateServices.php")
+
+        summarize("requests.post per call", measure(unpooled, ITERATIONS))
+        with api:
+            summarize("pooled HTTPTransport", measure(pooled, ITERATIONS))
+        print("connections opened: {0}".format(server.stats["connections"]))
+
+
+if __name__ == "__main__":
+    main()
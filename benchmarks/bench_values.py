@@ -0,0 +1,65 @@
+"""
+Compares the memory taken by a 100,000 row inventory snapshot, in the
+form returned by inventory_lookup, when its rows are the old dict
+backed Inventory objects and when they are the slotted Inventory
+tuples.  Each variant is built in its own process, so that its peak
+memory can be measured.
+"""
+import multiprocessing
+import resource
+import time
+
+from shipwire.common import *
+
+
+ROWS = 100000
+
+
+class LegacyInventory(object):
+    def __init__(self):
+        self.code = None # sku?
+        self.quantity = 0
+
+
+def legacy_row(sku, quantity):
+    inv = LegacyInventory()
+    inv.code = sku
+    inv.quantity = quantity
+    return inv
+
+
+def build(make_row):
+    # a full catalog snapshot: every sku at every warehouse
+    skus = ["sku_{0:06d}".format(i)
+            for i in range(ROWS // len(WAREHOUSE_CODES))]
+    snapshot = {}
+    for sku in skus:
+        snapshot[sku] = dict([(warehouse, make_row(sku, i % 17))
+                              for i, warehouse in enumerate(WAREHOUSE_CODES)])
+    return snapshot
+
+
+def run(make_row, results):
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    snapshot = build(make_row)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results.put((elapsed, after - before))
+
+
+def main():
+    print("{0} inventory rows".format(ROWS))
+    for label, make_row in [("dict backed Inventory", legacy_row),
+                            ("slotted Inventory", Inventory)]:
+        results = multiprocessing.Queue()
+        worker = multiprocessing.Process(target=run, args=(make_row, results))
+        worker.start()
+        elapsed, growth = results.get()
+        worker.join()
+        print("{0:<26} {1:8.1f} ms   peak memory +{2:6.1f} MB".format(
+            label, elapsed * 1000, growth / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
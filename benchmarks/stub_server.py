@@ -0,0 +1,259 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import errno
+import itertools
+import random
+import re
+import socket
+import sys
+import threading
+import time
+import zlib
+
+
+DEFAULT_RESPONSE = """
+<?xml version="1.0" encoding="utf-8"?>
+<RateResponse>
+  <Status>Error</Status>
+  <ErrorMessage>Stub server has no response for this endpoint</ErrorMessage>
+</RateResponse>
+""".strip()
+
+# Errors raised in handler threads when a client hangs up mid request,
+# which benchmarks and tests do routinely.
+DISCONNECT_ERRORS = (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """
+    Answers every POST with the canned response registered for the
+    requested path, after sleeping for the server's configured
+    latency.  Connections are kept alive so that clients can be
+    checked for connection reuse.
+    """
+    protocol_version = "HTTP/1.1"
+    # buffer the response so that headers and body leave in one
+    # segment, otherwise Nagle's algorithm stalls keep-alive clients.
+    wbufsize = -1
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count("connections")
+
+    def read_body(self):
+        """
+        Reads the request body, whether it was sent with a
+        content-length or with chunked transfer encoding.
+        """
+        encoding = self.headers.getheader("transfer-encoding", "")
+        if encoding.lower() != "chunked":
+            length = int(self.headers.getheader("content-length", 0))
+            return self.rfile.read(length)
+        chunks = []
+        while True:
+            size = int(self.rfile.readline().split(";", 1)[0], 16)
+            if size == 0:
+                break
+            chunks.append(self.rfile.read(size))
+            self.rfile.readline()
+        # skip any trailers, up to the closing blank line
+        while self.rfile.readline().strip():
+            pass
+        self.server.count("chunked")
+        return "".join(chunks)
+
+    def do_POST(self):
+        body = self.read_body()
+        self.server.count("requests")
+        api_uri_part = self.path.rsplit("/", 1)[-1]
+
+        latency = self.server.latency
+        if callable(latency):
+            latency = latency(api_uri_part)
+        if latency:
+            time.sleep(latency)
+
+        status = 200
+        if self.server.inject_error():
+            status, response = 503, "Service Unavailable"
+        else:
+            response = self.server.responses.get(api_uri_part, DEFAULT_RESPONSE)
+            if callable(response):
+                response = response(api_uri_part, body)
+            if type(response) == tuple:
+                status, response = response
+        if type(response) == unicode:
+            response = response.encode("utf-8")
+        if status != 200:
+            self.server.count("errors")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for the Shipwire servers, used by tests and
+    benchmarks.  The argument 'responses' maps api uri parts, eg.
+    "RateServices.php", to either a response string or a callable
+    taking (api_uri_part, request_body) and returning one.  A callable
+    may also return a tuple of (http_status, response).
+
+    Faults can be injected for testing: 'latency' is a delay in
+    seconds before each response, or a callable taking the api uri
+    part and returning one, and 'error_rate' is the fraction of
+    requests, picked at random, that are answered with a 503 error.
+
+    Use as a context manager, or call start() and stop().
+    """
+    daemon_threads = True
+
+    def __init__(self, responses=None, latency=0.0, port=0, error_rate=0.0,
+                 seed=None):
+        HTTPServer.__init__(self, ("127.0.0.1", port), StubRequestHandler)
+        self.responses = responses or {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {"connections" : 0, "requests" : 0, "chunked" : 0,
+                      "errors" : 0}
+        self.__random = random.Random(seed)
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__stopped = False
+
+    @property
+    def url(self):
+        """
+        Base url for the stub, suitable for ShipwireAPI's 'endpoint'
+        argument.
+        """
+        return "http://127.0.0.1:{0}/exec/".format(self.server_address[1])
+
+    def count(self, stat):
+        with self.__lock:
+            self.stats[stat] += 1
+
+    def inject_error(self):
+        """
+        Returns True if the current request should fail, going by
+        'error_rate'.
+        """
+        if not self.error_rate:
+            return False
+        with self.__lock:
+            return self.__random.random() < self.error_rate
+
+    def handle_error(self, request, client_address):
+        """
+        Stays quiet about clients disconnecting and about anything
+        raised by keep-alive handlers once the server has been stopped
+        or the interpreter is exiting, and reports other errors as
+        usual.
+        """
+        # module globals are cleared while the interpreter exits
+        if self.__stopped or sys is None:
+            return
+        error = sys.exc_info()[1]
+        if isinstance(error, socket.error) and \
+                error.errno in DISCONNECT_ERRORS:
+            return
+        HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.__stopped = True
+        self.shutdown()
+        self.server_close()
+        self.__thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+        return False
+
+
+# Base cost of one unit for each shipping code, used by the emulator:
+EMULATED_RATES = {
+    "GD" : 4.5,
+    "2D" : 9.0,
+    "1D" : 18.0,
+    "E-INTL" : 12.0,
+    "INTL" : 16.0,
+    "PL-INTL" : 24.0,
+    "PM-INTL" : 36.0,
+}
+
+
+def emulated_responses(catalog_size=1000, padding=0):
+    """
+    Returns a 'responses' dict for StubServer which emulates the three
+    Shipwire endpoints, answering each request from its contents:
+
+      InventoryServices.php lists a quantity for each product code
+          asked for, or for a catalog of 'catalog_size' skus named
+          "sku_000000" onwards if none were.  Quantities are derived
+          from the sku and warehouse, so they are the same every time.
+      RateServices.php quotes every shipping code, priced by the
+          number of units in the cart.
+      FulfillmentServices.php accepts every order.
+
+    Each reply is padded with a comment of 'padding' bytes, to emulate
+    larger payloads.
+    """
+    tail = "<!--{0}-->".format("x" * padding) if padding else ""
+    orders = itertools.count(1)
+
+    def inventory(api_uri_part, body):
+        warehouse = re.search("<Warehouse>(.*?)</Warehouse>", body).group(1)
+        codes = re.findall("<ProductCode>(.*?)</ProductCode>", body)
+        if not codes:
+            codes = ["sku_{0:06d}".format(i) for i in range(catalog_size)]
+        lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+                 "<InventoryUpdateResponse>", "<Status>0</Status>"]
+        for code in codes:
+            quantity = (zlib.crc32(warehouse + code) & 0xffffffff) % 20
+            lines.append('<Product code="{0}" quantity="{1}" good="{1}" '
+                         'pending="0" backordered="0" reserved="0"/>'.format(
+                             code, quantity))
+        lines.append("<TotalProducts>{0}</TotalProducts>".format(len(codes)))
+        lines.append("</InventoryUpdateResponse>")
+        return "\n".join(lines) + tail
+
+    def rates(api_uri_part, body):
+        units = sum([int(quantity) for quantity in
+                     re.findall(r"<Quantity>(\d+)</Quantity>", body)])
+        quotes = "".join([
+            '<Quote method="{0}"><Cost currency="USD">{1:.2f}</Cost>'
+            '</Quote>'.format(code, rate * max(units, 1))
+            for code, rate in sorted(EMULATED_RATES.items())])
+        return '<?xml version="1.0" encoding="utf-8"?>\n<RateResponse>' \
+            '<Status>OK</Status><Order sequence="1"><Quotes>{0}</Quotes>' \
+            '</Order></RateResponse>{1}'.format(quotes, tail)
+
+    def fulfillment(api_uri_part, body):
+        order_id = re.search('<Order id="(.*?)">', body).group(1)
+        number = next(orders)
+        return '<?xml version="1.0" encoding="utf-8"?>\n' \
+            '<SubmitOrderResponse><Status>0</Status><OrderInformation>' \
+            '<Order number="{0}-{1}" id="stub-{1}" status="accepted"/>' \
+            '</OrderInformation></SubmitOrderResponse>{2}'.format(
+                order_id, number, tail)
+
+    return {
+        "InventoryServices.php" : inventory,
+        "RateServices.php" : rates,
+        "FulfillmentServices.php" : fulfillment,
+    }
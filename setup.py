@@ -15,4 +15,5 @@ setup(name="pyshipwire",
           "requests",
           "lxml", 
           "BeautifulSoup",
+          "numpy",
         ])
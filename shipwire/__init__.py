@@ -1,4 +1,5 @@
 
 
-from shipwire.test_api import LoremIpsumAPI
+from shipwire.test_api import LoremIpsumAPI, AsyncLoremIpsumAPI
 from shipwire.shipwire_api import ShipwireAPI
+from shipwire.async_api import AsyncShipwireAPI
@@ -0,0 +1,118 @@
+from shipwire.common import *
+from shipwire.executor import IDLE_TIMEOUT, WorkerPool
+from shipwire.shipwire_api import ShipwireAPI
+
+
+class AsyncShipwireBaseAPI(object):
+    """
+    Non-blocking counterpart to ShipwireBaseAPI.
+
+    Every public method mirrors the method of the same name on the
+    wrapped API, but returns a Future immediately instead of blocking
+    the caller.  Calls are run on a bounded WorkerPool, which may be
+    shared between several instances.
+
+    Waiting on a Future with a timeout never interrupts the call
+    itself; a call that has not started yet can be dropped with
+    Future.cancel().  Keep in mind that an order placement which
+    timed out may still go through.
+    """
+
+    api_class = ShipwireBaseAPI
+
+    def __init__(self, account_email, password, server, pool=None,
+                 max_workers=10, **kargs):
+        """
+        Arguments 'account_email', 'password' and 'server' are passed
+        to the wrapped API class, along with any extra keyword
+        arguments.  Argument 'pool' is an optional WorkerPool to run
+        calls on; if it is omitted, one with 'max_workers' threads is
+        created and owned by this instance.
+        """
+        self.api = self.api_class(account_email, password, server, **kargs)
+        self.__owns_pool = pool is None
+        if pool is None:
+            pool = WorkerPool(max_workers, name="shipwire-async",
+                              idle_timeout=IDLE_TIMEOUT)
+        self.pool = pool
+
+    def close(self):
+        """
+        Shuts down the worker pool (if owned), waiting for running
+        calls, and closes the wrapped API.
+        """
+        if self.__owns_pool:
+            self.pool.shutdown()
+        self.api.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def get_availability(self, sku, estimate_ok=True):
+        """
+        Future for a tuple of the countries in which 'sku' is in stock.
+        """
+        return self.pool.submit(self.api.get_availability, sku, estimate_ok)
+
+    def inventory_lookup(self, sku_list, estimate_ok=False):
+        """
+        Future for {"sku" : {"warehouse" : <Inventory>}}.
+        """
+        return self.pool.submit(
+            self.api.inventory_lookup, sku_list, estimate_ok)
+
+    def optimal_order_splitting(self, shipping_address, cart):
+        """
+        Future for (<SplitCart>, remainder).
+        """
+        return self.pool.submit(
+            self.api.optimal_order_splitting, shipping_address, cart)
+
+    def cost_order_splitting(self, shipping_address, cart,
+                             service_level="standard", max_candidates=50):
+        """
+        Future for a CostedSplit.
+        """
+        return self.pool.submit(
+            self.api.cost_order_splitting, shipping_address, cart,
+            service_level, max_candidates)
+
+    def batch_order_splitting(self, orders, key=None, estimate_ok=False):
+        """
+        Future for a list of (<SplitCart>, remainder) tuples.
+        """
+        return self.pool.submit(
+            self.api.batch_order_splitting, orders, key, estimate_ok)
+
+    def get_shipping_options(self, shipping_address, split_cart,
+                             timeout=None, max_concurrency=None):
+        """
+        Future for a ShippingOptions dict, in the form of
+        {"warehouse" : {"shipping_code" : <Quote>}}.
+        """
+        return self.pool.submit(
+            self.api.get_shipping_options, shipping_address, split_cart,
+            timeout, max_concurrency)
+
+    def place_order(self, shipping_address, split_cart, shipping_methods,
+                    order_id=None, timeout=None):
+        """
+        Future for {"warehouse" : <OrderResult>}.
+        """
+        return self.pool.submit(
+            self.api.place_order, shipping_address, split_cart,
+            shipping_methods, order_id, timeout)
+
+
+class AsyncShipwireAPI(AsyncShipwireBaseAPI):
+    """
+    Non-blocking counterpart to ShipwireAPI.  All calls made through
+    one instance share the wrapped API's keep-alive connection pool;
+    pass a 'transport' keyword argument to share it more widely.
+    """
+
+    api_class = ShipwireAPI
@@ -0,0 +1,274 @@
+"""
+Builders for the XML requests sent to Shipwire's API.
+
+Each request template is compiled once, when this module is imported,
+into its literal pieces and the names of the fields between them.
+Rendering a request is then a single join, with every field value
+escaped on the way in, so that eg. an "&" in a name or a "<" in a sku
+can't corrupt the request.  Requests are rendered as utf-8 byte
+strings, ready for the transport.
+"""
+import re
+from string import Formatter
+from xml.sax.saxutils import escape
+
+
+# Extra entities for values which end up in quoted attributes:
+ATTRIBUTE_ENTITIES = {'"' : "&quot;"}
+
+# Most values need no escaping at all, and this is the cheap way to
+# find that out:
+NEEDS_ESCAPING = re.compile(r'[&<>"]')
+
+
+def xml_text(value):
+    """
+    Returns 'value' as escaped, utf-8 encoded xml text.  Byte strings
+    are assumed to be utf-8 already, and None is rendered as nothing.
+    Raises ValueError for values holding NUL, which xml can't carry.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    elif not isinstance(value, str):
+        value = str(value)
+    if "\0" in value:
+        raise ValueError("NUL can't appear in xml: {0!r}".format(value))
+    return _escape(value)
+
+
+def _escape(value):
+    if NEEDS_ESCAPING.search(value) is None:
+        return value
+    return escape(value, ATTRIBUTE_ENTITIES)
+
+
+def _escape_joined(values):
+    """
+    Escapes a list of strings in one go, and returns them joined by
+    "\0", which can't appear in xml and so can't be part of a value;
+    values holding it raise ValueError, as they do in xml_text.  This
+    is much quicker than escaping long lists value by value.  Lists
+    mixing unicode with non-ascii byte strings, or holding non-strings,
+    can't be joined as they are, and are escaped one value at a time
+    instead.
+    """
+    try:
+        joined = "\0".join(values)
+    except (TypeError, UnicodeError):
+        return "\0".join([xml_text(value) for value in values])
+    if values and joined.count("\0") != len(values) - 1:
+        raise ValueError("NUL can't appear in xml: {0!r}".format(
+            [value for value in values if "\0" in value]))
+    if isinstance(joined, unicode):
+        joined = joined.encode("utf-8")
+    return _escape(joined)
+
+
+class Template(object):
+    """
+    A request template in str.format syntax, compiled once into the
+    literal text between its fields.  Fields named in 'raw' are
+    inserted as they are, and must already be xml byte strings; all
+    the others are escaped with xml_text.
+    """
+
+    def __init__(self, text, raw=()):
+        self.literals = []
+        self.fields = []
+        for literal, field, spec, conversion in Formatter().parse(text):
+            self.literals.append(literal)
+            if field is not None:
+                self.fields.append((field, field in raw))
+        if len(self.literals) == len(self.fields):
+            self.literals.append("")
+
+    def parts(self, values):
+        """
+        Returns the rendered template as a list of pieces.
+        """
+        literals = self.literals
+        pieces = []
+        for i, (field, is_raw) in enumerate(self.fields):
+            pieces.append(literals[i])
+            value = values[field]
+            pieces.append(value if is_raw else xml_text(value))
+        pieces.append(literals[-1])
+        return pieces
+
+    def render(self, **values):
+        return "".join(self.parts(values))
+
+
+ADDRESS = Template("""
+<AddressInfo type="{mode}">
+  <Name><Full>{name}</Full></Name>
+  <Address1>{addr1}</Address1>
+  <Address2>{addr2}</Address2>
+  <City>{city}</City>
+  <State>{state}</State>
+  <Country>{country}</Country>
+  <Zip>{zipcode}</Zip>
+  <Phone>{phone}</Phone>
+  <Email>{email}</Email>
+</AddressInfo>
+""".lstrip())
+
+ITEM = Template("""
+<Item num="{num}">
+  <Code>{sku}</Code>
+  <Quantity>{quantity}</Quantity>
+</Item>
+""".lstrip())
+
+ORDER_REQUEST = Template("""
+<!DOCTYPE OrderList SYSTEM "http://www.shipwire.com/exec/download/OrderList.dtd">
+<OrderList>
+ <Username>{username}</Username>
+ <Password>{password}</Password>
+ <Server>{server}</Server>
+ <Order id="{order_id}">
+   <Warehouse>{warehouse}</Warehouse>
+   <SameDay>NOT REQUESTED</SameDay>
+   {address}
+   <Shipping>{shipping}</Shipping>
+   {items}
+ </Order>
+</OrderList>
+""".strip(), raw=("address", "items"))
+
+RATE_REQUEST = Template("""
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE RateRequest SYSTEM "http://www.shipwire.com/exec/download/RateRequest.dtd">
+<RateRequest>
+ <Username>{username}</Username>
+ <Password>{password}</Password>
+ <Server>{server}</Server>
+ <Order id="{order_id}">{address}{items}</Order>
+</RateRequest>
+""".strip(), raw=("address", "items"))
+
+INVENTORY_REQUEST_HEAD = Template("""
+<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE InventoryUpdateResponse SYSTEM "http://www.shipwire.com/exec/download/InventoryUpdateResponse.dtd">
+<InventoryUpdate>
+    <Username>{username}</Username>
+    <Password>{password}</Password>
+    <Server>{server}</Server>
+    <Warehouse>{warehouse}</Warehouse>
+""".lstrip())
+
+PRODUCT_CODE = "    <ProductCode>%s</ProductCode>\n"
+PRODUCT_CODE_BREAK = "</ProductCode>\n    <ProductCode>"
+
+INVENTORY_REQUEST_TAIL = """
+    <IncludeEmpty/>
+</InventoryUpdate>""".lstrip("\n")
+
+
+def address_xml(address, mode="ship"):
+    """
+    Renders an AddressInfo as an <AddressInfo> element.
+    """
+    return ADDRESS.render(
+        mode=mode,
+        name=address.name,
+        addr1=address.addr1,
+        addr2=address.addr2,
+        city=address.city,
+        state=address.state,
+        country=address.country,
+        zipcode=address.zipcode,
+        phone=address.phone,
+        email=address.email)
+
+
+def items_xml(items):
+    """
+    Renders a dict of {"sku" : quantity} as a run of <Item> elements.
+    """
+    # carts can be long, so ITEM's pieces are joined here directly
+    # rather than going through render() for every line
+    if not items:
+        return ""
+    skus, quantities = zip(*items.items())
+    start, code, quantity_tag, end = ITEM.literals
+    pieces = []
+    for num, sku in enumerate(_escape_joined(skus).split("\0")):
+        pieces.extend((start, str(num), code, sku, quantity_tag,
+                       str(quantities[num]), end))
+    return "".join(pieces)
+
+
+def order_request(credentials, order_id, warehouse, address, shipping, items):
+    """
+    Renders an OrderList request for one warehouse's cart.
+    'credentials' is a tuple of (username, password, server), and
+    'items' a dict of {"sku" : quantity}.
+    """
+    username, password, server = credentials
+    return ORDER_REQUEST.render(
+        username=username,
+        password=password,
+        server=server,
+        order_id=order_id,
+        warehouse=warehouse,
+        address=address_xml(address),
+        shipping=shipping,
+        items=items_xml(items))
+
+
+def rate_request(credentials, address, items, order_id=0):
+    """
+    Renders a RateRequest for one warehouse's cart.  Arguments are as
+    for order_request.
+    """
+    username, password, server = credentials
+    return RATE_REQUEST.render(
+        username=username,
+        password=password,
+        server=server,
+        order_id=order_id,
+        address=address_xml(address),
+        items=items_xml(items))
+
+
+def _product_codes(sku_list):
+    """
+    Renders a list of skus as <ProductCode> lines.
+    """
+    if not sku_list:
+        return ""
+    return PRODUCT_CODE % _escape_joined(sku_list).replace(
+        "\0", PRODUCT_CODE_BREAK)
+
+
+def iter_inventory_request(credentials, warehouse, sku_list, batch=1000):
+    """
+    Yields an InventoryUpdate request for the given skus in pieces of
+    up to 'batch' skus, so that long sku lists never have to be held
+    in memory as a single string.  An empty sku list asks for the
+    whole catalog.
+    """
+    username, password, server = credentials
+    yield INVENTORY_REQUEST_HEAD.render(
+        username=username, password=password, server=server,
+        warehouse=warehouse)
+    sku_list = list(sku_list)
+    for i in range(0, len(sku_list), batch):
+        yield _product_codes(sku_list[i:i+batch])
+    yield INVENTORY_REQUEST_TAIL
+
+
+def inventory_request(credentials, warehouse, sku_list):
+    """
+    Renders an InventoryUpdate request for the given skus.
+    """
+    username, password, server = credentials
+    return "".join((
+        INVENTORY_REQUEST_HEAD.render(
+            username=username, password=password, server=server,
+            warehouse=warehouse),
+        _product_codes(sku_list),
+        INVENTORY_REQUEST_TAIL))
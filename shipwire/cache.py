@@ -0,0 +1,296 @@
+from collections import OrderedDict
+import cPickle as pickle
+import json
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_TTL = 60*5 # seconds
+DEFAULT_MAX_ENTRIES = 10000
+
+
+class BaseCache(object):
+    """
+    Interface for the caches used by ShipwireBaseAPI.
+
+    Entries expire 'ttl' seconds after they were set, unless they were
+    given a ttl of their own when set.  Expired entries
+    are dropped when they are next read, or by sweep(), which can be
+    run periodically in the background with start_sweeper().  When
+    'max_entries' is set, the least recently used entries are evicted
+    to make room for new ones.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.__sweeper = None
+        self.__stop = threading.Event()
+
+    def get(self, key):
+        """
+        Returns the value cached for 'key', or None if it is missing or
+        expired.
+        """
+        raise NotImplementedError("Cache lookup.")
+
+    def peek(self, key, max_stale=None):
+        """
+        Returns a (value, expired) tuple for 'key' even if the entry has
+        expired, or None if it is missing.  Expired entries are left in
+        place.  If 'max_stale' is given, entries which expired more than
+        that many seconds ago are treated as missing.
+        """
+        raise NotImplementedError("Cache lookup.")
+
+    def set(self, key, value, ttl=None):
+        """
+        Caches 'value' under 'key', stamped with the current time.  If
+        'ttl' is given, it overrides the cache's ttl for this entry.
+        """
+        raise NotImplementedError("Cache update.")
+
+    def set_many(self, entries):
+        """
+        Caches a list of (key, value, ttl) tuples at once, as set()
+        does for each of them.
+        """
+        for key, value, ttl in entries:
+            self.set(key, value, ttl)
+
+    def delete(self, key):
+        raise NotImplementedError("Cache removal.")
+
+    def clear(self):
+        raise NotImplementedError("Cache removal.")
+
+    def sweep(self):
+        """
+        Removes every expired entry, and returns how many there were.
+        """
+        raise NotImplementedError("Cache sweep.")
+
+    def __len__(self):
+        raise NotImplementedError("Cache size.")
+
+    def too_stale(self, stamp, ttl=None, max_stale=None, now=None):
+        if max_stale is None:
+            return False
+        if ttl is None:
+            ttl = self.ttl
+        return self.expired(stamp, ttl + max_stale, now)
+
+    def expired(self, stamp, ttl=None, now=None):
+        if now is None:
+            now = time.time()
+        if ttl is None:
+            ttl = self.ttl
+        return now - stamp > ttl
+
+    def start_sweeper(self, interval=60):
+        """
+        Starts a daemon thread which calls sweep() every 'interval'
+        seconds until close() is called.
+        """
+        def run():
+            while not self.__stop.wait(interval):
+                self.sweep()
+        self.__sweeper = threading.Thread(target=run, name="shipwire-sweeper")
+        self.__sweeper.daemon = True
+        self.__sweeper.start()
+
+    def close(self):
+        """
+        Stops the background sweeper, if one is running.
+        """
+        self.__stop.set()
+        if self.__sweeper is not None:
+            self.__sweeper.join()
+            self.__sweeper = None
+
+
+class MemoryCache(BaseCache):
+    """
+    In-process LRU cache.  Safe to share between threads, but each
+    process has its own copy.
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        BaseCache.__init__(self, ttl, max_entries)
+        self.__entries = OrderedDict() # key : (stamp, value, ttl)
+        self.__lock = threading.Lock()
+
+    def get(self, key):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is None or self.expired(entry[0], entry[2]):
+                return None
+            # re-inserting moves the key to the most recently used end
+            self.__entries[key] = entry
+            return entry[1]
+
+    def peek(self, key, max_stale=None):
+        with self.__lock:
+            entry = self.__entries.pop(key, None)
+            if entry is None:
+                return None
+            self.__entries[key] = entry
+            if self.too_stale(entry[0], entry[2], max_stale):
+                return None
+            return entry[1], self.expired(entry[0], entry[2])
+
+    def set(self, key, value, ttl=None):
+        with self.__lock:
+            self.__entries.pop(key, None)
+            self.__entries[key] = (time.time(), value, ttl)
+            if self.max_entries is not None:
+                while len(self.__entries) > self.max_entries:
+                    self.__entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.__lock:
+            self.__entries.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__entries.clear()
+
+    def sweep(self):
+        now = time.time()
+        with self.__lock:
+            stale = [key for key, entry in self.__entries.items()
+                     if self.expired(entry[0], entry[2], now)]
+            for key in stale:
+                del self.__entries[key]
+        return len(stale)
+
+    def __len__(self):
+        return len(self.__entries)
+
+
+class SqliteCache(BaseCache):
+    """
+    Cache stored in a sqlite database file, so that it can be shared
+    by every process on a host, eg. all of the workers of a web
+    server.  Keys must be json serializable, and values picklable.
+
+    Rather than on every write, the size of the cache is checked once
+    every hundredth of 'max_entries' writes, so it may briefly go over
+    'max_entries' by that much.  Expired entries are evicted first,
+    then the least recently used ones.
+    """
+
+    def __init__(self, path, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES):
+        BaseCache.__init__(self, ttl, max_entries)
+        self.path = path
+        self.__local = threading.local()
+        self.__writes = 0 # since the size was last checked
+        self.__lock = threading.Lock()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                value BLOB,
+                stamp REAL,
+                ttl REAL,
+                used REAL
+            )""")
+        db.execute("CREATE INDEX IF NOT EXISTS cache_used ON cache (used)")
+
+    def _db(self):
+        """
+        Returns this thread's connection to the database.
+        """
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.__local.db = db
+        return db
+
+    def get(self, key):
+        key = json.dumps(key)
+        db = self._db()
+        row = db.execute(
+            "SELECT value, stamp, ttl FROM cache WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.expired(row[1], row[2], now):
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        db.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+        return pickle.loads(str(row[0]))
+
+    def peek(self, key, max_stale=None):
+        key = json.dumps(key)
+        db = self._db()
+        row = db.execute(
+            "SELECT value, stamp, ttl FROM cache WHERE key = ?",
+            (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.too_stale(row[1], row[2], max_stale, now):
+            return None
+        db.execute("UPDATE cache SET used = ? WHERE key = ?", (now, key))
+        return pickle.loads(str(row[0])), self.expired(row[1], row[2], now)
+
+    def set(self, key, value, ttl=None):
+        self.set_many([(key, value, ttl)])
+
+    def set_many(self, entries):
+        now = time.time()
+        rows = [(json.dumps(key),
+                 sqlite3.Binary(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+                 now, ttl, now) for key, value, ttl in entries]
+        if not rows:
+            return
+        db = self._db()
+        db.execute("BEGIN")
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, stamp, ttl, used) "
+                "VALUES (?, ?, ?, ?, ?)", rows)
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        self._evict(len(rows))
+
+    def _evict(self, writes):
+        """
+        Trims the cache to max_entries once enough writes have been
+        made since it was last checked.
+        """
+        if self.max_entries is None:
+            return
+        with self.__lock:
+            self.__writes += writes
+            if self.__writes < max(1, self.max_entries // 100):
+                return
+            self.__writes = 0
+        excess = len(self) - self.max_entries
+        if excess > 0:
+            excess -= self.sweep()
+        if excess > 0:
+            self._db().execute(
+                "DELETE FROM cache WHERE key IN ("
+                "SELECT key FROM cache ORDER BY used LIMIT ?)", (excess,))
+
+    def delete(self, key):
+        self._db().execute("DELETE FROM cache WHERE key = ?", (json.dumps(key),))
+
+    def clear(self):
+        self._db().execute("DELETE FROM cache")
+
+    def sweep(self):
+        cursor = self._db().execute(
+            "DELETE FROM cache WHERE stamp + COALESCE(ttl, ?) < ?",
+            (self.ttl, time.time()))
+        return cursor.rowcount
+
+    def __len__(self):
+        return self._db().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
@@ -2,7 +2,21 @@
 import os
 import time
 import csv
+import logging
 import itertools
+import threading
+import uuid
+from collections import OrderedDict, namedtuple
+
+from shipwire.builders import address_xml, items_xml
+from shipwire.cache import DEFAULT_MAX_ENTRIES, MemoryCache
+from shipwire.executor import IDLE_TIMEOUT, Future, WorkerPool
+from shipwire.instrumentation import NO_INSTRUMENTATION
+from shipwire.stock import StockMatrix
+from shipwire.splitting import INTL_SHIPMENT_WEIGHT, MAX_SEARCH_NODES, \
+    candidate_splits, split_order
+
+log = logging.getLogger(__name__)
 
 WAREHOUSES = {
     "United States" : {
@@ -22,6 +36,10 @@ WAREHOUSES = {
 # the following line extracts the warehouse codes from the above dict,
 # eg: ('CHI', 'LAX', 'PHL', 'TOR', 'VAN', 'UK')
 WAREHOUSE_CODES =  tuple(itertools.chain(*[i.keys() for i in WAREHOUSES.values()]))
+
+# inventory is cached per (sku, warehouse), so the default inventory
+# cache has room for DEFAULT_MAX_ENTRIES skus in every warehouse:
+INVENTORY_CACHE_ENTRIES = DEFAULT_MAX_ENTRIES * len(WAREHOUSE_CODES)
     
 # FIXME:
 # missing are warehouse codes for Hong Kong (China), Rio de Janeiro
@@ -45,6 +63,14 @@ SHIPPING = {
 LOCAL_SHIPPING = ("GD", "2D", "1D")
 INTL_SHIPPING = ("E-INTL", "INTL", "PL-INTL", "PM-INTL")
 
+# The (domestic, international) shipping codes for each service level:
+SERVICE_LEVELS = {
+    "economy" : ("GD", "E-INTL"),
+    "standard" : ("GD", "INTL"),
+    "priority" : ("2D", "PL-INTL"),
+    "express" : ("1D", "PM-INTL"),
+}
+
 
 
 countries_path = os.path.join(os.path.split(__file__)[0], "countries.csv")
@@ -54,18 +80,41 @@ del countries_path
 del countries_file
 
 
+def _normalize_country(country):
+    """
+    Normalizes a country name or iso code for lookups in COUNTRY_INDEX.
+    """
+    return country.upper().replace("_", " ")
+
+
+# Every accepted spelling of a country (common name, 2 and 3 letter iso
+# codes), normalized, mapped to its 3 letter iso code.  Where the same
+# spelling appears on several lines, the first one wins.
+COUNTRY_INDEX = {}
+for line in COUNTRIES:
+    for alias in line:
+        COUNTRY_INDEX.setdefault(_normalize_country(alias), line[-1])
+del line
+del alias
+
+
 def iso_for_country(country):
     """
     Determines the 3 letter iso code for a given country name which may
     be formatted as either an iso code (2 or 3 letters) or the common
     name.
     """
-    for line in COUNTRIES:
-        normalized_line = [i.upper() for i in line]
-        normalized_target = country.upper().replace("_", " ")
-        if normalized_line.count(normalized_target):
-            return line[-1]
-    return None
+    return COUNTRY_INDEX.get(_normalize_country(country))
+
+
+# 3 letter iso country code for each warehouse code.
+WAREHOUSE_COUNTRIES = {}
+for country_name, country_set in WAREHOUSES.items():
+    for warehouse_code in country_set.keys():
+        WAREHOUSE_COUNTRIES[warehouse_code] = iso_for_country(country_name)
+del country_name
+del country_set
+del warehouse_code
 
 
 def country_for_warehouse(warehouse_code):
@@ -73,10 +122,7 @@ def country_for_warehouse(warehouse_code):
     Returns the 3 letter iso country code for which a given warehouse
     is located.
     """
-    for country_name, country_set in WAREHOUSES.items():
-        if country_set.has_key(warehouse_code):
-            return iso_for_country(country_name)
-    return None
+    return WAREHOUSE_COUNTRIES.get(warehouse_code)
 
 
 def is_domestic(shipping_address, warehouse_code):
@@ -123,122 +169,140 @@ EU_COUNTRIES = (
     "Sweden",
     "United Kingdom",
 )
-EU_ISO_CODES = tuple([iso_for_country(n) for n in EU_COUNTRIES])
+EU_ISO_CODES = frozenset([iso_for_country(n) for n in EU_COUNTRIES])
 
 
 def is_eu(country):
     """
     Returns True if the country is a member of the European Union.
     """
-    if iso_for_country(country) in EU_ISO_CODES:
-        return True
-    else:
-        return False
+    return iso_for_country(country) in EU_ISO_CODES
 
 
-class AddressInfo(object):
+class AddressInfo(namedtuple("AddressInfo", "name addr1 addr2 city state "
+                                           "country zipcode phone email")):
     """
-    Represents a shipping address.
+    Represents a shipping address.  Addresses are immutable tuples; use
+    _replace to derive a changed copy.
     """
-    def __init__(self, name, addr1, addr2, city, state, country, zipcode, phone, email):
-        self.name = name
-        self.addr1 = addr1
-        self.addr2 = addr2
-        self.city = city
-        self.state = state
-        self.country = country
-        self.zipcode = zipcode
-        self.phone = phone
-        self.email = email
+    __slots__ = ()
 
     def to_xml(self, mode="ship"):
         """
-        Returns the xml representation of the cart, as used by the Shipwire
-        API.
+        Returns the xml representation of the address, as used by the
+        Shipwire API.
         """
-        template = """
-<AddressInfo type="{0}">
-  <Name><Full>{1}</Full></Name>
-  <Address1>{2}</Address1>
-  <Address2>{3}</Address2>
-  <City>{4}</City>
-  <State>{5}</State>
-  <Country>{6}</Country>
-  <Zip>{7}</Zip>
-  <Phone>{8}</Phone>
-  <Email>{9}</Email>
-</AddressInfo>
-        """.strip()
-        return template.format(
-            mode,
-            self.name,
-            self.addr1,
-            self.addr2,
-            self.city,
-            self.state,
-            self.country,
-            self.zipcode,
-            self.phone,
-            self.email,
-        ) + "\n"
-            
+        return address_xml(self, mode)
+
 
-class Inventory(object):
+class Inventory(namedtuple("Inventory", "code quantity")):
     """
-    Represents inventory information.
+    Represents inventory information: the 'quantity' of sku 'code' in
+    stock at a warehouse.  Inventory is an immutable tuple, and a
+    full-catalog lookup makes one per sku per warehouse, so it carries
+    no per-instance dict.
     """
-    def __init__(self):
-        self.code = None # sku?
-        self.quantity = 0
+    __slots__ = ()
+
+    def __new__(cls, code=None, quantity=0):
+        return super(Inventory, cls).__new__(cls, code, quantity)
+
+
+class Quote(namedtuple("Quote", "name cost currency code")):
+    """
+    One shipping option for a cart: the human readable 'name' of the
+    service, its 'cost', the 'currency' of the cost and the shipping
+    'code'.  Quotes are still the (name, cost) pairs they have always
+    been when unpacked or iterated, so __iter__ stops after the cost;
+    use the attributes, or indexing, for the rest.
+    """
+    __slots__ = ()
+
+    def __new__(cls, name, cost, currency="USD", code=None):
+        return super(Quote, cls).__new__(cls, name, cost, currency, code)
+
+    def __iter__(self):
+        return iter((self.name, self.cost))
+
+    def __reduce__(self):
+        # the default for tuples would iterate, and drop the last two
+        return (Quote, self[:])
+
+    def _asdict(self):
+        return OrderedDict(zip(self._fields, self[:]))
+
+    def _replace(self, **kargs):
+        fields = self._asdict()
+        fields.update(kargs)
+        return Quote(**fields)
 
 
 class CartItems(object):
     """
-    Class storing shopping cart information.
+    Class storing shopping cart information.  The cart is kept as a
+    dict of quantities in the 'items' attribute, in the form of
+    {"sku" : quantity}.
     """
+    __slots__ = ("items",)
+
     def __init__(self, sku_list=None):
-        if sku_list is not None:
-            self.sku_list = sku_list
-        else:
-            self.sku_list = []
+        """
+        Argument 'sku_list' may be a list of skus, in which a sku
+        appears once for each unit ordered, or a dict of quantities
+        like the 'items' attribute.
+        """
+        self.items = {}
+        if isinstance(sku_list, dict):
+            for sku, quantity in sku_list.items():
+                self.add_item(sku, quantity)
+        elif sku_list is not None:
+            for sku in sku_list:
+                self.add_item(sku, 1)
+
+    @property
+    def sku_list(self):
+        """
+        The cart expanded into a list in which each sku appears once
+        per unit ordered.  Only for compatibility; use 'items' instead.
+        """
+        sku_list = []
+        for sku, quantity in self.items.items():
+            sku_list.extend([sku] * quantity)
+        return sku_list
+
+    @property
+    def total_quantity(self):
+        """The number of units in the cart."""
+        return sum(self.items.values())
+
+    def quantity(self, sku):
+        """The quantity of a given SKU in the cart."""
+        return self.items.get(sku, 0)
 
     def add_item(self, sku, quantity):
         """Add some quantity of SKUs to the cart."""
-        for i in range(quantity):
-            self.sku_list.append(sku)
+        if quantity > 0:
+            self.items[sku] = self.items.get(sku, 0) + quantity
 
     def remove_item(self, sku, quantity):
         """Remove some quantity of SKUs from the cart."""
-        for i in range(quantity):
-            if self.sku_list.count(sku):
-                self.sku_list.pop(self.sku_list.index(sku))
+        remaining = self.items.get(sku, 0) - quantity
+        if remaining > 0:
+            self.items[sku] = remaining
+        else:
+            self.items.pop(sku, None)
 
     def to_xml(self):
         """XML representation of the cart used by the shipwire API."""
-        template = """
-<Item num="{0}">
-  <Code>{1}</Code>
-  <Quantity>{2}</Quantity>
-</Item>
-        """.strip()
-        items = {}
-        for sku in self.sku_list:
-            if not items.has_key(sku):
-                items[sku] = 1
-            else:
-                items[sku] += 1
-        xml = ""
-        counter = 0
-        for sku, quantity in items.items():
-            xml += template.format(counter, sku, quantity) + "\n"
-            counter += 1
-        return xml
+        return items_xml(self.items)
 
 
 class SplitCart(object):
     """
     Class representing an order split.
     """
+    __slots__ = ("order_split",)
+
     def __init__(self):
         self.order_split = {}
 
@@ -248,46 +312,257 @@ class SplitCart(object):
         self.order_split[warehouse] = cart
 
 
+# Cached in place of an Inventory when a warehouse doesn't list a sku.
+# False survives pickling as the same object, which matters for caches
+# shared between processes.
+NOT_LISTED = False
+
+
+class PartialInventoryError(Exception):
+    """
+    Raised by inventory lookups when some warehouses failed to answer.
+    'report' holds the inventory from the warehouses that did, in the
+    form of { "warehouse" : [<Inventory>, ...] }, and 'errors' maps
+    the codes of the warehouses that didn't to their exceptions.
+    """
+    def __init__(self, report, errors):
+        Exception.__init__(
+            self, "Inventory lookup failed for warehouses: {0}".format(
+                ", ".join(sorted(errors.keys()))))
+        self.report = report
+        self.errors = errors
+
+
+class OrderResult(object):
+    """
+    The outcome of placing one warehouse's share of a split order.
+    'order_id' is the id the order was submitted with, while
+    'order_number' and 'transaction_id' are assigned by Shipwire.
+    'latency' is in seconds, and 'error' is the exception raised if
+    the order could not be placed.
+    """
+    def __init__(self, warehouse, order_id, status=None, order_number=None,
+                 transaction_id=None, latency=None, error=None):
+        self.warehouse = warehouse
+        self.order_id = order_id
+        self.status = status
+        self.order_number = order_number
+        self.transaction_id = transaction_id
+        self.latency = latency
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class CostedSplit(object):
+    """
+    The cheapest split found by cost_order_splitting.  'split_cart' and
+    'remainder' are as returned by optimal_order_splitting, 'methods'
+    maps each warehouse to its shipping code, and 'costs' maps it to
+    the quoted cost of its shipment.  'quote_calls' is the number of
+    quotes that were looked up, from the quote cache or the backend.
+    """
+    def __init__(self, split_cart, remainder, methods, costs, quote_calls):
+        self.split_cart = split_cart
+        self.remainder = remainder
+        self.methods = methods
+        self.costs = costs
+        self.quote_calls = quote_calls
+
+    @property
+    def total(self):
+        return sum(self.costs.values())
+
+
+def quote_signature(warehouse, address, items):
+    """
+    Returns the key under which the quotes for shipping 'items', a dict
+    of {"sku" : quantity}, from 'warehouse' to 'address' are cached.
+    Only the parts of the address that rates depend on are used: the
+    country, the state and the postcode, normalized so that different
+    spellings of the same destination share a key.
+    """
+    country = address.country or ""
+    country = iso_for_country(country) or _normalize_country(country)
+    state = (address.state or "").strip().upper()
+    zipcode = "".join((address.zipcode or "").upper().split())
+    if country == "USA":
+        # ZIP+4 codes are priced like the ZIP they belong to
+        zipcode = zipcode[:5]
+    return warehouse, country, state, zipcode, tuple(sorted(items.items()))
+
+
+class ShippingOptions(dict):
+    """
+    Shipping quotes for a split cart, keyed by warehouse code.
+    Warehouses which couldn't be quoted are absent, and the exception
+    for each of them is kept in the 'errors' dict instead.
+    """
+    def __init__(self, quotes=None, errors=None):
+        dict.__init__(self, quotes or {})
+        self.errors = errors or {}
+
+
 class ShipwireBaseAPI(object):
     """
     Base class for to be used for ShipwireAPI and TestAPI.
     """
     
-    def __init__(self, account_email, password, server):
+    def __init__(self, account_email, password, server, pool=None,
+                 cache=None, quote_cache=None):
         """
         Arguments 'account_email' and 'password' correspond to the
         shipwire account.  Argument 'server' must be one of
         "production", or "test".  Both correspond to Shipwire's actual
         API.
+
+        Argument 'pool' is an optional WorkerPool used for concurrent
+        requests, which may be shared between several API instances.
+        If it is omitted, a pool is started on first use and owned by
+        this instance; its threads exit after IDLE_TIMEOUT seconds
+        without work, or when close() is called.
+
+        Argument 'cache' is an optional cache.BaseCache instance for
+        inventory info, eg. a SqliteCache shared by several processes.
+        Entries are kept per sku and warehouse, so its max_entries
+        should allow for len(WAREHOUSE_CODES) of them per sku.  If it
+        is omitted, an in-process MemoryCache with room for
+        INVENTORY_CACHE_ENTRIES entries is used.  The API never starts
+        a cache's background sweeper, so expired entries are only
+        dropped when they are read again or evicted; callers sharing a
+        long-lived cache should call its start_sweeper() once, eg. in
+        one process per host, and close() it when done.
+
+        Argument 'quote_cache' is likewise an optional cache for
+        shipping quotes, keyed by quote_signature.  Its ttl and
+        max_entries bound how long and how many quotes are kept.  If it
+        is omitted, an in-process MemoryCache is used.  Set the
+        'cache_quotes' attribute to False to always ask the backend.
+
+        Cache lookups are reported to the 'instrumentation' attribute,
+        an instrumentation.Instrumentation instance which by default
+        ignores them.  Calls to the backend are reported to it by the
+        backends which make them, ie. ShipwireAPI; the fake
+        LoremIpsumAPI reports none.
+
+        The 'stats' attribute counts the lookups which shared another's
+        request to the backend ('coalesced'), the lookups which were
+        served at least one expired cache entry ('stale_served'; a
+        lookup counts once however many SKUs were stale), the
+        background refreshes which succeeded ('refreshed') or failed
+        ('refresh_failed'), and the shipping quotes found in or missing
+        from the quote cache ('quote_hits', 'quote_misses').
         """
-        self.cache = {}
-        self.cache_expire = 60*5 # seconds
+        self.__owns_cache = cache is None
+        if cache is None:
+            cache = MemoryCache(max_entries=INVENTORY_CACHE_ENTRIES)
+        self.cache = cache
+        self.__owns_quote_cache = quote_cache is None
+        if quote_cache is None:
+            quote_cache = MemoryCache()
+        self.quote_cache = quote_cache
+        self.cache_quotes = True
+        self.instrumentation = NO_INSTRUMENTATION
+        self.negative_cache_expire = 60 # seconds
+        self.stale_while_revalidate = False
+        self.max_stale = 60*60 # seconds
+        self.inventory_store = None
+        self.quote_timeout = None # seconds
+        self.quote_concurrency = None
+        self.inventory_progress = None
+        self.intl_shipment_weight = INTL_SHIPMENT_WEIGHT
+        self.split_search_nodes = MAX_SEARCH_NODES
+        self.stats = {
+            "coalesced" : 0,
+            "stale_served" : 0,
+            "refreshed" : 0,
+            "refresh_failed" : 0,
+            "quote_hits" : 0,
+            "quote_misses" : 0,
+        }
+        self.__in_flight = {} # { ("sku", "warehouse") : <Future> }
+        self.__flight_lock = threading.Lock()
+        self.__refresh_pool = None
+        self.__pool = pool
+        self.__owns_pool = pool is None
+        self.__pool_lock = threading.Lock()
+
+    @property
+    def cache_expire(self):
+        """
+        How long, in seconds, cached inventory info stays valid.
+        """
+        return self.cache.ttl
 
-    def _get_cached(self, product_sku):
+    @cache_expire.setter
+    def cache_expire(self, seconds):
+        self.cache.ttl = seconds
+
+    @property
+    def pool(self):
         """
-        If the inventory info for a given product sku is present and the
-        cache stamp isn't too old, return it.  If the cache stamp is
-        too old, remove it from cache and return None.  If the item is
-        not present at all, return none.
+        The WorkerPool used to run requests concurrently.
         """
-        if self.cache.has_key(product_sku):
-            entry = self.cache[product_sku]
-            if time.time() - entry["stamp"] > self.cache_expire:
-                self.cache.pop(product_sku)
-                return None
-            else:
-                return entry["data"]
-        else:
-            return None
+        with self.__pool_lock:
+            if self.__pool is None:
+                self.__pool = WorkerPool(len(WAREHOUSE_CODES), name="shipwire",
+                                         idle_timeout=IDLE_TIMEOUT)
+            return self.__pool
+
+    def close(self):
+        """
+        Shuts down the worker pools and the cache's background sweeper,
+        if this instance owns them.  Requests that are already running
+        are allowed to finish.
+        """
+        with self.__pool_lock:
+            if self.__owns_pool and self.__pool is not None:
+                self.__pool.shutdown()
+                self.__pool = None
+        with self.__flight_lock:
+            refresh_pool, self.__refresh_pool = self.__refresh_pool, None
+        if refresh_pool is not None:
+            refresh_pool.shutdown()
+        if self.__owns_cache:
+            self.cache.close()
+        if self.__owns_quote_cache:
+            self.quote_cache.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def _get_cached(self, product_sku, warehouse):
+        """
+        If the inventory info for a given product sku and warehouse is
+        present and the cache stamp isn't too old, return it.  If the
+        cache stamp is too old, remove it from cache and return None.
+        If the item is not present at all, return none.
+
+        NOT_LISTED is returned if the warehouse is known not to list
+        the sku at all.
+        """
+        return self.cache.get((product_sku, warehouse))
         
-    def _set_cached(self, product_sku, value):
+    def _set_cached(self, entries):
         """
-        Cache inventory info for a given sku.
+        Cache inventory info, given as a dict in the form of
+        {("sku", "warehouse") : <Inventory> or NOT_LISTED}, in one
+        write.  Negative entries (NOT_LISTED) expire after
+        negative_cache_expire seconds rather than cache_expire.
         """
-        self.cache[product_sku] = {
-            "stamp" : time.time(),
-            "data" : value,
-            }
+        batch = []
+        for key, value in entries.items():
+            ttl = None
+            if value is NOT_LISTED:
+                ttl = self.negative_cache_expire
+            batch.append((key, value, ttl))
+        self.cache.set_many(batch)
 
     #------------------------------------------------------------------
     # API-inspecific methods:
@@ -297,7 +572,7 @@ class ShipwireBaseAPI(object):
         Returns a list of which countries for which the given sku is in
         stock.
         """
-        query = self.inventory_lookup([sku], estimate_ok)[sku]
+        query = self.inventory_lookup([sku], estimate_ok).get(sku, {})
         available = []
         for warehouse, inventory in query.items():
             if inventory.quantity > 0:
@@ -313,10 +588,33 @@ class ShipwireBaseAPI(object):
         Results are a dictionary in the format of:
 
         {"sku" : {"warehouse" : <Inventory>}}
+
+        SKUs which no warehouse lists are left out of the results.
+
+        If 'estimate_ok' is True, cached inventory info is used where
+        available.  Entries are cached per warehouse, so only the
+        warehouses missing from the cache are asked.  The fact that a
+        warehouse doesn't list a SKU is cached as well, for
+        negative_cache_expire seconds.  When the stale_while_revalidate
+        attribute is set, expired cache entries are returned
+        immediately too, and refreshed in the background, unless they
+        expired more than max_stale seconds ago.  Entries missing from
+        the cache are then read from the inventory_store attribute, if
+        it is set to a sync.InventoryStore kept up to date by a
+        sync.InventorySync.
+
+        Concurrent lookups that miss the cache for the same SKUs share
+        a single request to the backend rather than each making their
+        own.
+
+        If some warehouses fail to answer, PartialInventoryError is
+        raised, after caching the answers from the others.
         """
 
         results = {} # {"sku" : {"warehouse" : <Inventory>}}
+        found = {} # {("sku", "warehouse") : <Inventory> or NOT_LISTED}
         missing = []
+        stale = []
             
         if type(sku_list) in [str, unicode]:
             sku_list = [sku_list]
@@ -324,192 +622,417 @@ class ShipwireBaseAPI(object):
         # remove non-unique items:
         sku_list = list(set(sku_list))
 
-        if estimate_ok:
-            for sku in sku_list:
-                entry = self._get_cached(sku)
-                if entry:
-                    results[sku] = entry
+        for sku in sku_list:
+            for warehouse in WAREHOUSE_CODES:
+                entry = None
+                if estimate_ok and self.stale_while_revalidate:
+                    peeked = self.cache.peek((sku, warehouse),
+                                             self.max_stale)
+                    if peeked:
+                        entry, expired = peeked
+                        if expired:
+                            stale.append((sku, warehouse))
+                elif estimate_ok:
+                    entry = self._get_cached(sku, warehouse)
+                if entry is None:
+                    missing.append((sku, warehouse))
                 else:
-                    missing.append(sku)
-        else:
-            missing = sku_list
+                    found[(sku, warehouse)] = entry
+
+        if estimate_ok:
+            self.instrumentation.on_cache("inventory", len(found), len(missing))
+
+        if stale:
+            self._count("stale_served")
+            self._refresh_in_background(stale)
+
+        if missing and estimate_ok and self.inventory_store is not None:
+            stored = self.inventory_store.lookup(missing)
+            found.update(stored)
+            missing = [key for key in missing if not stored.has_key(key)]
 
         if missing:
-            new_items = self._inventory_lookup(missing)
-            found = {}
-            for warehouse, inv_list in new_items.items():
-                for entry in inv_list:
-                    sku = entry.code
-                    if not found.has_key(sku):
-                        found[sku] = {}
-                    found[sku][warehouse] = entry
-                    
-            for sku, data in found.items():
-                results[sku] = data
-                self._set_cached(sku, data)
+            found.update(self._coalesced_lookup(missing))
 
+        for (sku, warehouse), entry in found.items():
+            if entry is not NOT_LISTED:
+                if not results.has_key(sku):
+                    results[sku] = {}
+                results[sku][warehouse] = entry
         return results
 
+    def _coalesced_lookup(self, keys):
+        """
+        Fetches inventory info for the given (sku, warehouse) pairs
+        from the backend and caches it.  Pairs which another thread is
+        already fetching are not requested again; their results are
+        taken from that thread's request instead.
+
+        Returns {("sku", "warehouse") : <Inventory> or NOT_LISTED}.
+        Raises PartialInventoryError if any of the pairs couldn't be
+        fetched.
+        """
+        in_flight = {} # { ("sku", "warehouse") : <Future> }
+        mine = []
+        with self.__flight_lock:
+            for key in keys:
+                if self.__in_flight.has_key(key):
+                    in_flight[key] = self.__in_flight[key]
+                else:
+                    mine.append(key)
+            if mine:
+                flight = Future()
+                for key in mine:
+                    self.__in_flight[key] = flight
+        if in_flight:
+            self._count("coalesced")
+
+        found = {}
+        errors = {}
+        if mine:
+            try:
+                self._fetch_inventory(mine, found, errors)
+            except BaseException as error:
+                flight.set_exception(error)
+                raise
+            else:
+                flight.set_result((found, errors))
+            finally:
+                with self.__flight_lock:
+                    for key in mine:
+                        if self.__in_flight.get(key) is flight:
+                            del self.__in_flight[key]
+
+        for key, other in in_flight.items():
+            other_found, other_errors = other.result()
+            if other_found.has_key(key):
+                found[key] = other_found[key]
+            elif other_errors.has_key(key[1]):
+                errors[key[1]] = other_errors[key[1]]
+
+        if errors:
+            report = {}
+            for (sku, warehouse), entry in found.items():
+                if entry is not NOT_LISTED:
+                    if not report.has_key(warehouse):
+                        report[warehouse] = []
+                    report[warehouse].append(entry)
+            raise PartialInventoryError(report, errors)
+        return found
+
+    def _fetch_inventory(self, keys, found, errors):
+        """
+        Requests the given (sku, warehouse) pairs from the backend,
+        caching the answers into 'found' and recording the exceptions
+        for warehouses that failed into 'errors'.
+        """
+        # group the skus by the set of warehouses they're needed from,
+        # which is usually the same for all of them:
+        wanted = {} # { "sku" : ["warehouse", ...] }
+        for sku, warehouse in keys:
+            if not wanted.has_key(sku):
+                wanted[sku] = []
+            wanted[sku].append(warehouse)
+        groups = {} # { ("warehouse", ...) : ["sku", ...] }
+        for sku, warehouses in wanted.items():
+            warehouses = tuple(sorted(warehouses))
+            if not groups.has_key(warehouses):
+                groups[warehouses] = []
+            groups[warehouses].append(sku)
+
+        for warehouses, sku_list in groups.items():
+            try:
+                report = self._inventory_lookup(sku_list, warehouses)
+            except PartialInventoryError as partial:
+                report = partial.report
+                errors.update(partial.errors)
+            fetched = {}
+            for warehouse, inv_list in report.items():
+                listed = {}
+                for entry in inv_list:
+                    listed[entry.code] = entry
+                for sku in sku_list:
+                    fetched[(sku, warehouse)] = listed.get(sku, NOT_LISTED)
+            found.update(fetched)
+            self._set_cached(fetched)
+
+    def _refresh_in_background(self, keys):
+        """
+        Schedules a cache refresh for the given (sku, warehouse) pairs,
+        skipping any which are already being fetched.
+        """
+        with self.__flight_lock:
+            keys = [key for key in keys
+                    if not self.__in_flight.has_key(key)]
+            if not keys:
+                return
+            if self.__refresh_pool is None:
+                self.__refresh_pool = WorkerPool(
+                    1, name="shipwire-refresh", idle_timeout=IDLE_TIMEOUT)
+            refresh_pool = self.__refresh_pool
+
+        def refresh():
+            try:
+                self._coalesced_lookup(keys)
+            except Exception:
+                log.exception("Background inventory refresh failed.")
+                self._count("refresh_failed")
+            else:
+                self._count("refreshed")
+        refresh_pool.submit(refresh)
+
+    def _count(self, stat):
+        with self.__flight_lock:
+            self.stats[stat] += 1
+
+    def _cached_quotes(self, ship_address, warehouse, cart):
+        """
+        Returns the shipping quotes for a cart like
+        _get_single_cart_quotes, but from quote_cache if the same cart
+        was recently quoted from the same warehouse to the same
+        destination.  Hits and misses are counted in 'stats'.
+        """
+        if not self.cache_quotes:
+            return self._get_single_cart_quotes(ship_address, warehouse, cart)
+        key = quote_signature(warehouse, ship_address, cart.items)
+        options = self.quote_cache.get(key)
+        if options is not None:
+            self._count("quote_hits")
+            self.instrumentation.on_cache("quote", 1, 0)
+            return dict(options)
+        self._count("quote_misses")
+        self.instrumentation.on_cache("quote", 0, 1)
+        options = self._get_single_cart_quotes(ship_address, warehouse, cart)
+        if options:
+            self.quote_cache.set(key, dict(options))
+        return options
+
 
     def optimal_order_splitting(self, shipping_address, cart):
         """
         Returns a SplitCart object which contains the most practical split
         for situations when the order cannot be fulfilled from just
-        one location, and a list of SKUs that couldn't be shipped.
+        one location, and a dict of the SKU quantities that couldn't be
+        shipped.
 
         Shipwire does this to an extent in their backend, but it is
         proprietary, and does not assume domestic shipping is better
         than not splitting the order.
+
+        The split ships as much of the cart as the warehouses have in
+        stock, in as few shipments as possible, where an international
+        shipment counts as intl_shipment_weight domestic ones.  A SKU's
+        quantity is split between warehouses when no single one has
+        enough.  See splitting.split_order.
         """
+        stock, domestic = self._split_stock(shipping_address, cart)
+        results, remainder = split_order(
+            cart.items, stock, domestic, self.intl_shipment_weight,
+            self.split_search_nodes)
 
-        def cart_split(stock, sku_req):
-            """
-            Determines recusively which warehouses can fulfill most of the
-            sku_req.
-            """
-
-            splits = {} # { "warehouse" : { "sku" : quantity } }
-            versions = {} # { "warehouse" : { "sku" : quantity } }
-            remainder = {} # { "sku" : quantity }
-
-            # for each warehouse, determine which subset of product
-            # can be served by it:
-            for warehouse in stock.keys():
-                versions[warehouse] = {}
-                for sku, quant in sku_req.items():
-                    try:
-                        if stock[warehouse][sku] >= quant:
-                            versions[warehouse][sku] = quant
-                    except KeyError:
-                        pass
-
-            # From the possible versions, determine which warehouse
-            # caught the most product in the order:
-            best_wh = None
-            best_ct = 0
-            for wh_code, data in versions.items():
-                count = len(data.keys())
-                if count > best_ct:
-                    best_wh = wh_code
-                    best_ct = count
-            if not best_wh:
-                # no sku:quantity in the req could be neatly served by
-                # any of the warehouses.
-                return {}, sku_req
-            else:
-                # add the best warehouse to the order split, update
-                # the remainder stocking info, and recurse on the
-                # remaining warehouses.
-                splits[best_wh] = versions[best_wh]
-                new_req = {}
-                for sku in sku_req.keys():
-                    if not versions[best_wh].has_key(sku):
-                        new_req[sku] = sku_req[sku]
-                new_stock = {}
-                for code in stock.keys():
-                    if code != best_wh:
-                        new_stock[code] = stock[code]
-
-                if len(new_req.keys()) > 0 and len(new_stock.keys()) > 0:
-                    new_split, new_remainder = cart_split(new_stock, new_req)
-                    for key, val in new_split.items():
-                        splits[key] = val
-                    return splits, new_remainder
+        split_cart = SplitCart()
+        for warehouse, items in results.items():
+            split_cart.add_cart(warehouse, CartItems(items))
+        return split_cart, remainder
 
-                else:
-                    return splits, new_req
-
-        def add_regional_data(stock, warehouse, inventory):
-            """
-            Used for splitting inventory_lookup into regional stocking
-            information.
-            """
-            if not stock.has_key(warehouse):
-                stock[warehouse] = {}
-            stock[warehouse][inventory.code] = inventory.quantity
-
-        # generate regional stocking info based on shipping address:
-        domestic = {}
-        intl = {}
-        query = self.inventory_lookup(cart.sku_list, estimate_ok=False)
-        for sku, data in query.items():
-            for warehouse, inventory in data.items():
-                if inventory.quantity > 0:
-                    if is_domestic(shipping_address, warehouse):
-                        add_regional_data(domestic, warehouse, inventory)
-                    else:
-                        add_regional_data(intl, warehouse, inventory)
-
-        # traveling salesman setup
-        results = {}
-        remainder = {}
-        for sku in cart.sku_list:
-            if remainder.has_key(sku):
-                remainder[sku] += 1
+    def cost_order_splitting(self, shipping_address, cart,
+                             service_level="standard", max_candidates=50):
+        """
+        Like optimal_order_splitting, but picks the split whose
+        shipments cost the least in total at the given service level,
+        which is one of the keys of SERVICE_LEVELS.  Each warehouse is
+        quoted for the matching domestic or international shipping
+        code.
+
+        Up to 'max_candidates' alternative splits are priced, in the
+        order of the score optimal_order_splitting uses.  Quotes are
+        memoized per warehouse and sub-cart, and go through
+        quote_cache, and a candidate is dropped as soon as its running
+        total exceeds the cheapest one so far, so the backend is asked
+        as little as possible.
+
+        Returns a CostedSplit.  Raises ValueError if none of the
+        candidates could be quoted at the service level.
+        """
+        domestic_code, intl_code = SERVICE_LEVELS[service_level]
+        stock, domestic = self._split_stock(shipping_address, cart)
+        candidates = candidate_splits(
+            cart.items, stock, domestic, self.intl_shipment_weight,
+            max_candidates, self.split_search_nodes)
+
+        quotes = {} # { ("warehouse", (("sku", quantity), ...)) : cost }
+        calls = [0]
+        def signature(warehouse, items):
+            return warehouse, tuple(sorted(items.items()))
+
+        def price(warehouse, items):
+            key = signature(warehouse, items)
+            if not quotes.has_key(key):
+                calls[0] += 1
+                options = self._cached_quotes(
+                    shipping_address, warehouse, CartItems(items))
+                code = domestic_code if warehouse in domestic else intl_code
+                quotes[key] = options[code][1] if options.has_key(code) \
+                    else None
+            return quotes[key]
+
+        best = None
+        best_total = None
+        for split, remainder in candidates:
+            # warehouses that were already quoted go first, as they are
+            # free to check against the best total:
+            order = sorted(split.keys(), key=lambda code:
+                           not quotes.has_key(signature(code, split[code])))
+            costs = {}
+            total = 0
+            for warehouse in order:
+                cost = price(warehouse, split[warehouse])
+                if cost is None:
+                    break
+                costs[warehouse] = cost
+                total += cost
+                if best_total is not None and total >= best_total:
+                    break
             else:
-                remainder[sku] = 1
-
-        if domestic:
-            # The portion of the cart that can be shipped entirely
-            # from the domestic set is returned into 'results' (dict
-            # warehouse:[sku...]) or such.  Returned "remainder"
-            # contains everything else.
-            results, remainder = cart_split(domestic, remainder)
-
-        if remainder and intl:
-            # The portion of the cart that can be shipped entirely
-            # from international warehouses is returned into
-            # 'intl_results', if necessary.  Returned "remainder" is
-            # everything that couldn't be shipped.
-            intl_results, remainder = cart_split(intl, remainder)
-
-            for warehouse, sku_list in intl_results.items():
-                if results.has_key(warehouse):
-                    results[warehouse] += intl_results[warehouse]
-                else:
-                    results[warehouse] = intl_results[warehouse]
-
-        # FIXME:
-        # 
-        # Handling for quantities that can't be served by an
-        # individual warehouse but can be either partially or fully
-        # servered by several.
-        #
+                best = split, remainder, costs
+                best_total = total
 
+        if best is None:
+            raise ValueError(
+                "No split could be quoted at {0} service.".format(service_level))
+        split, remainder, costs = best
         split_cart = SplitCart()
-        for warehouse, sku_list in results.items():
-            split_cart.add_cart(warehouse, CartItems(sku_list))
-        return split_cart, remainder
+        methods = {}
+        for warehouse, items in split.items():
+            split_cart.add_cart(warehouse, CartItems(items))
+            methods[warehouse] = \
+                domestic_code if warehouse in domestic else intl_code
+        return CostedSplit(split_cart, remainder, methods, costs, calls[0])
+
+    def batch_order_splitting(self, orders, key=None, estimate_ok=False):
+        """
+        Splits many carts at once, eg. when releasing held orders.
+        Argument 'orders' is a list of (shipping_address, cart) tuples.
+
+        Inventory is looked up once, for all of the carts' skus
+        together, and the carts are split one after another against
+        that snapshot, each taking its stock out of it so that later
+        carts can't be promised the same units.  Carts are served in
+        the order given, or sorted by 'key', which is called with each
+        (shipping_address, cart) tuple like the key argument of
+        sorted().
+
+        Returns a list of (<SplitCart>, remainder) tuples, as returned
+        by optimal_order_splitting, in the same order as 'orders'.
+        """
+        skus = set()
+        for shipping_address, cart in orders:
+            skus.update(cart.items.keys())
+        stock = self._stock_snapshot(list(skus), estimate_ok)
+
+        order = range(len(orders))
+        if key is not None:
+            order.sort(key=lambda i: key(orders[i]))
+
+        results = [None] * len(orders)
+        for i in order:
+            shipping_address, cart = orders[i]
+            domestic = [code for code in stock.warehouses
+                        if is_domestic(shipping_address, code)]
+            split, remainder = split_order(
+                cart.items, stock, domestic, self.intl_shipment_weight,
+                self.split_search_nodes)
+            stock.take(split)
+            split_cart = SplitCart()
+            for warehouse, items in split.items():
+                split_cart.add_cart(warehouse, CartItems(items))
+            results[i] = (split_cart, remainder)
+        return results
+
+    def _split_stock(self, shipping_address, cart):
+        """
+        Looks up the stock of the cart's skus, and returns it in the
+        form of {"warehouse" : {"sku" : quantity}}, along with a list
+        of the warehouses which are domestic to 'shipping_address'.
+        A single cart is split on its own columns of the stock, so
+        unlike batch_order_splitting, no StockMatrix is built.
+        """
+        stock = {}
+        query = self.inventory_lookup(cart.items.keys())
+        for sku, data in query.items():
+            for code, inventory in data.items():
+                if not stock.has_key(code):
+                    stock[code] = {}
+                stock[code][sku] = inventory.quantity
+        domestic = [code for code in stock.keys()
+                    if is_domestic(shipping_address, code)]
+        return stock, domestic
+
+    def _stock_snapshot(self, sku_list, estimate_ok=False):
+        """
+        Looks up the stock of the given skus, and returns it as a
+        StockMatrix.
+        """
+        query = self.inventory_lookup(sku_list, estimate_ok)
+        return StockMatrix.from_inventory(query)
 
-    def get_shipping_options(self, shipping_address, split_cart):
+    def get_shipping_options(self, shipping_address, split_cart,
+                             timeout=None, max_concurrency=None):
         """
         The parameter 'cart' is an instance of the SplitCart class.
         
-        Returns a dictionary in which the keys are warehouse codes,
-        and the values are the shipping quotes for the carts
-        corresponding to that warehouse.
+        Returns a ShippingOptions dictionary in which the keys are
+        warehouse codes, and the values are the shipping quotes for
+        the carts corresponding to that warehouse, in the form of
+        {"shipping_code" : <Quote>}.
+
+        Quotes for a warehouse's cart come from quote_cache when the
+        same cart was recently quoted to the same destination, see
+        quote_signature.  Warehouses are quoted concurrently, with at most
+        'max_concurrency' requests in flight, and only the quotes that
+        arrive within 'timeout' seconds are returned.  Warehouses that
+        failed or ran out of time are left out, and their exceptions
+        are reported in the 'errors' attribute of the result.  Both
+        default to the instance's quote_concurrency and quote_timeout
+        attributes.
 
         Use the "optimal_order_splitting" method to generate
         'split_cart'.
         """
         assert type(shipping_address) == AddressInfo
         assert type(split_cart) == SplitCart
-
-        split_options = {}
-        for warehouse, cart in split_cart.order_split.items():
-            split_options[warehouse] = self._get_single_cart_quotes(
-                shipping_address, warehouse, cart)
-        return split_options
+        if timeout is None:
+            timeout = self.quote_timeout
+        if max_concurrency is None:
+            max_concurrency = self.quote_concurrency
+
+        def quote(warehouse):
+            cart = split_cart.order_split[warehouse]
+            return self._cached_quotes(shipping_address, warehouse, cart)
+
+        quotes, errors = self.pool.settle(
+            quote, split_cart.order_split.keys(), timeout, max_concurrency)
+        return ShippingOptions(quotes, errors)
         
-    def place_order(self, shipping_address, split_cart, shipping_methods):
+    def place_order(self, shipping_address, split_cart, shipping_methods,
+                    order_id=None, timeout=None):
         """
         The parameter 'cart' is an instance of the SplitCart class.
 
         The parameter 'shipping_methods' is a dict who's keys are
         warehouse codes and who's values are shipping codes.
 
-        Raises an error if any of the orders failed to place, so be
-        sure to catch for that.
+        The orders for each warehouse are submitted concurrently.
+        Each is given the id "<order_id>-<warehouse>", so that it can
+        be correlated with the split it came from; if 'order_id' is
+        omitted, a random one is generated.
+
+        Returns a dict who's keys are warehouse codes and who's values
+        are OrderResult instances.  A failed order doesn't stop the
+        others from being placed, so be sure to check each result's
+        'ok' attribute.  Orders that haven't been confirmed within
+        'timeout' seconds are reported with an executor.Timeout error,
+        though they may still go through.
 
         Use the "optimal_order_splitting" method to generate
         'split_cart'.
@@ -520,26 +1043,52 @@ class ShipwireBaseAPI(object):
         for warehouse, shipping in shipping_methods.items():
             assert warehouse in WAREHOUSE_CODES
             assert shipping in SHIPPING.keys()
+        if order_id is None:
+            order_id = uuid.uuid4().hex[:12]
 
-        api_results = []
-
-        for warehouse, cart in split_cart.order_split.items():
+        def submit(warehouse):
+            cart = split_cart.order_split[warehouse]
             method = shipping_methods[warehouse]
-            api_results.append(
-                self._place_single_cart_order(
-                    shipping_address, warehouse, cart, method))
-        return api_results
+            result = OrderResult(warehouse, "{0}-{1}".format(order_id, warehouse))
+            start = time.time()
+            try:
+                status, order_number, transaction_id = \
+                    self._place_single_cart_order(
+                        result.order_id, shipping_address, warehouse, cart,
+                        method)
+            except Exception as error:
+                result.error = error
+            else:
+                result.status = status
+                result.order_number = order_number
+                result.transaction_id = transaction_id
+            result.latency = time.time() - start
+            return result
+
+        results, errors = self.pool.settle(
+            submit, split_cart.order_split.keys(), timeout)
+        for warehouse, error in errors.items():
+            results[warehouse] = OrderResult(
+                warehouse, "{0}-{1}".format(order_id, warehouse), error=error)
+        return results
 
     #------------------------------------------------------------------
     # Backend-specific methods:
 
-    def _inventory_lookup(self, sku_list):
+    def _inventory_lookup(self, sku_list, warehouses=None, progress=None):
         """
         Returns inventory data for the given list of skus.  This may imply
         multiple api calls to shipwire's api for each warehouse.  This
         can probably be threaded, but that is outside of the scope of
         the common api class.
 
+        Argument 'warehouses' limits the lookup to the given warehouse
+        codes; by default, all of WAREHOUSE_CODES are asked.  If
+        'sku_list' is None, the whole catalog is returned.  Argument
+        'progress' (by default, the inventory_progress attribute) is an
+        optional function, which is called with the number of requests
+        finished so far and the total, each time one of them finishes.
+
         This function should return a dict where each key is a
         warehouse code, and the value is a list of Inventory object
         instances.
@@ -547,12 +1096,15 @@ class ShipwireBaseAPI(object):
         Like so:
         { "warehouse" : [<Inventory>, ...] }
 
+        If some of the warehouses fail to answer, raise
+        PartialInventoryError with the results from the others.
         """
         raise NotImplementedError("Inventory lookup backend..")
 
     def _get_single_cart_quotes(self, ship_address, warehouse, cart):
         """
-        Returns the shipping quotes for a given cart of items and warehouse.
+        Returns the shipping quotes for a given cart of items and
+        warehouse, in the form of {"shipping_code" : <Quote>}.
         """
         raise NotImplementedError("Shipping quotes backend.")
 
@@ -0,0 +1,403 @@
+from Queue import Empty, Queue
+import logging
+import sys
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+IDLE_TIMEOUT = 10.0 # seconds
+
+PENDING = "pending"
+RUNNING = "running"
+FINISHED = "finished"
+CANCELLED = "cancelled"
+
+
+class Timeout(Exception):
+    """
+    Raised when a Future's result is not ready in time.  The
+    underlying call is left running; waiting again later is safe.
+    """
+    pass
+
+
+class Cancelled(Exception):
+    """
+    Raised when asking for the result of a cancelled Future.
+    """
+    pass
+
+
+class Future(object):
+    """
+    The eventual result of a call submitted to a WorkerPool.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._state = PENDING
+        self._result = None
+        self._exception = None
+        self.traceback = None
+        self._callbacks = []
+
+    def cancel(self):
+        """
+        Cancels the call if it has not started yet.  Returns True if
+        the call will not run.
+        """
+        with self._condition:
+            if self._state == RUNNING or self._state == FINISHED:
+                return False
+            if self._state == PENDING:
+                self._state = CANCELLED
+                self._condition.notify_all()
+        self._run_callbacks()
+        return True
+
+    def cancelled(self):
+        return self._state == CANCELLED
+
+    def running(self):
+        return self._state == RUNNING
+
+    def done(self):
+        return self._state in (FINISHED, CANCELLED)
+
+    def result(self, timeout=None):
+        """
+        Blocks until the call finishes and returns its value, or
+        re-raises the exception it raised.  Raises Timeout if the call
+        hasn't finished within 'timeout' seconds.
+        """
+        self._wait(timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Blocks like result(), but returns the exception raised by the
+        call (or None) instead of raising it.
+        """
+        self._wait(timeout)
+        return self._exception
+
+    def add_done_callback(self, func):
+        """
+        Arranges for func(future) to be called once the future is
+        finished or cancelled.  If that has already happened, func is
+        called immediately.
+        """
+        with self._condition:
+            if not self.done():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def _wait(self, timeout):
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        with self._condition:
+            while not self.done():
+                if deadline is None:
+                    self._condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            if self._state == CANCELLED:
+                raise Cancelled()
+            if self._state != FINISHED:
+                raise Timeout()
+
+    def set_running(self):
+        """
+        Marks the future as running.  Returns False if it was
+        cancelled, in which case the call must be skipped.
+        """
+        with self._condition:
+            if self._state == CANCELLED:
+                return False
+            self._state = RUNNING
+            return True
+
+    def set_result(self, result):
+        with self._condition:
+            self._result = result
+            self._state = FINISHED
+            self._condition.notify_all()
+        self._run_callbacks()
+
+    def set_exception(self, exception, traceback=None):
+        with self._condition:
+            self._exception = exception
+            self.traceback = traceback
+            self._state = FINISHED
+            self._condition.notify_all()
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        with self._condition:
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            try:
+                func(self)
+            except Exception:
+                log.exception("Exception in future callback.")
+
+
+class WorkerPool(object):
+    """
+    A fixed-size pool of long-lived worker threads.  Workers are
+    started lazily as work is submitted, up to 'max_workers'.  If
+    'idle_timeout' is set, workers which have had nothing to do for
+    that many seconds exit, and are started again when more work
+    arrives, so a pool which is never shut down doesn't keep its
+    threads forever.
+    """
+
+    def __init__(self, max_workers, name="shipwire", idle_timeout=None):
+        assert max_workers > 0
+        self.max_workers = max_workers
+        self.name = name
+        self.idle_timeout = idle_timeout
+        self._queue = Queue()
+        self._workers = []
+        self._started = 0
+        self._lock = threading.Lock()
+        self._shutdown = False
+        self._queued = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._failed = 0
+
+    def submit(self, func, *args, **kargs):
+        """
+        Schedules func(*args, **kargs) to be run by a worker and returns
+        a Future for its result.
+        """
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit to a pool after shutdown.")
+            self._queue.put((future, func, args, kargs))
+            self._queued += 1
+            if len(self._workers) < self.max_workers:
+                self._start_worker()
+        return future
+
+    def shutdown(self, wait=True, cancel_pending=False):
+        """
+        Stops accepting new work.  Work already queued is still run,
+        unless 'cancel_pending' is True, in which case queued calls
+        are cancelled.  If 'wait' is True, blocks until every worker
+        has exited.
+        """
+        pending = []
+        with self._lock:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            if cancel_pending:
+                while not self._queue.empty():
+                    pending.append(self._queue.get()[0])
+                    self._queued -= 1
+            workers = list(self._workers)
+            for worker in workers:
+                self._queue.put(None)
+        for future in pending:
+            future.cancel()
+        if wait:
+            for worker in workers:
+                if worker is not threading.current_thread():
+                    worker.join()
+
+    def in_worker(self):
+        """
+        Returns True if called from one of this pool's worker threads.
+        """
+        return threading.current_thread() in self._workers
+
+    def map(self, func, items, timeout=None):
+        """
+        Calls func(item) for each item concurrently, and returns the
+        results in order.  The first exception raised by any call is
+        re-raised here.  If the calls don't all finish within
+        'timeout' seconds, the ones that haven't started are cancelled
+        and Timeout is raised.
+
+        When called from one of the pool's own workers, the calls are
+        made serially in the calling thread instead, since waiting on
+        the pool from inside it could deadlock.
+        """
+        if self.in_worker():
+            return [func(item) for item in items]
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        futures = [self.submit(func, item) for item in items]
+        try:
+            results = []
+            for future in futures:
+                remaining = None
+                if deadline is not None:
+                    remaining = max(0, deadline - time.time())
+                results.append(future.result(remaining))
+            return results
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def settle(self, func, items, timeout=None, limit=None):
+        """
+        Calls func(item) for each item concurrently, like map, but
+        never raises.  Returns a tuple of two dicts keyed by item: the
+        results of the calls that succeeded, and the exceptions raised
+        by those that didn't.
+
+        At most 'limit' of the calls are in flight at once.  Calls
+        that haven't finished within 'timeout' seconds are reported
+        with a Timeout error, and those that haven't started yet are
+        cancelled.  Items must be hashable.
+        """
+        items = list(items)
+        results = {}
+        errors = {}
+        if self.in_worker():
+            for item in items:
+                try:
+                    results[item] = func(item)
+                except Exception as error:
+                    errors[item] = error
+            return results, errors
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        waiting = list(reversed(items))
+        futures = {}
+        condition = threading.Condition()
+        state = {"finished" : 0, "closed" : False}
+
+        def on_done(future):
+            with condition:
+                state["finished"] += 1
+                condition.notify_all()
+            launch()
+
+        def launch():
+            with condition:
+                if state["closed"] or not waiting:
+                    return
+                item = waiting.pop()
+                try:
+                    future = futures[item] = self.submit(func, item)
+                except RuntimeError as error:
+                    # the pool was shut down underneath us
+                    future = futures[item] = Future()
+                    future.set_exception(error)
+            future.add_done_callback(on_done)
+
+        for i in range(min(limit or len(items), len(items))):
+            launch()
+
+        with condition:
+            while state["finished"] < len(items):
+                if deadline is None:
+                    condition.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    condition.wait(remaining)
+            state["closed"] = True
+            launched = dict(futures)
+
+        for item in items:
+            future = launched.get(item)
+            if future is None or not future.done():
+                if future is not None:
+                    future.cancel()
+                errors[item] = Timeout()
+            elif future.cancelled():
+                errors[item] = Cancelled()
+            elif future.exception() is not None:
+                errors[item] = future.exception()
+            else:
+                results[item] = future.result()
+        return results, errors
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool's metrics: the number of
+        workers, calls waiting in the queue, calls in flight, and
+        calls completed or failed so far.
+        """
+        with self._lock:
+            return {
+                "workers" : len(self._workers),
+                "queue_depth" : self._queued,
+                "in_flight" : self._in_flight,
+                "completed" : self._completed,
+                "failed" : self._failed,
+            }
+
+    def _start_worker(self):
+        name = "{0}-worker-{1}".format(self.name, self._started)
+        self._started += 1
+        worker = threading.Thread(target=self._work, name=name)
+        worker.daemon = True
+        self._workers.append(worker)
+        worker.start()
+
+    def _work(self):
+        while True:
+            try:
+                task = self._queue.get(timeout=self.idle_timeout)
+            except Empty:
+                with self._lock:
+                    # work submitted since the timeout is still ours
+                    if self._queued > 0:
+                        continue
+                    self._workers.remove(threading.current_thread())
+                return
+            if task is None:
+                return
+            future, func, args, kargs = task
+            with self._lock:
+                self._queued -= 1
+            if not future.set_running():
+                continue
+            with self._lock:
+                self._in_flight += 1
+            try:
+                result = func(*args, **kargs)
+            except BaseException:
+                exc_type, exc_value, exc_tb = sys.exc_info()
+                self._finish(failed=True)
+                future.set_exception(exc_value, exc_tb)
+            else:
+                self._finish(failed=False)
+                future.set_result(result)
+
+    def _finish(self, failed):
+        with self._lock:
+            self._in_flight -= 1
+            if failed:
+                self._failed += 1
+            else:
+                self._completed += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
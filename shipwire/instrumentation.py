@@ -0,0 +1,291 @@
+"""
+Instrumentation hooks for the Shipwire API classes.
+
+Every call to Shipwire's backend is described by a CallEvent, handed to
+the on_call method of the API's 'instrumentation' attribute, and every
+cache lookup is reported to its on_cache method.  The default,
+Instrumentation, ignores them; HistogramCollector keeps Prometheus
+style histograms and counters in memory, and can render them in
+Prometheus' text format for scraping.
+"""
+from bisect import bisect_left
+import threading
+import time
+
+
+class CallEvent(object):
+    """
+    Describes one call to Shipwire's API: the 'endpoint' (api uri
+    part) and 'warehouse' it was for, the size of the request and reply
+    in bytes, the time spent building the request, waiting for the
+    rate limiter, on the network and parsing the reply, in seconds, how
+    many times the transport retried it, and the exception it failed
+    with, if any.
+    """
+    __slots__ = ("endpoint", "warehouse", "request_bytes", "response_bytes",
+                 "serialize_time", "throttle_time", "network_time",
+                 "parse_time", "total_time", "retries", "error")
+
+    def __init__(self, endpoint, warehouse=None):
+        self.endpoint = endpoint
+        self.warehouse = warehouse
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.serialize_time = 0.0
+        self.throttle_time = 0.0
+        self.network_time = 0.0
+        self.parse_time = 0.0
+        self.total_time = 0.0
+        self.retries = 0
+        self.error = None
+
+    def meter_request(self, body):
+        """
+        Counts the bytes of a request body.  Iterable bodies are
+        wrapped, so that they are counted as they are sent, and the
+        time spent producing them then counts as serialization rather
+        than network time.
+        """
+        if isinstance(body, basestring):
+            self.request_bytes += len(body)
+            return body
+        return self._metered(body, request=True)
+
+    def meter_response(self, reply):
+        """
+        Counts the bytes of a reply, which may be a string or an
+        iterator of chunks.  Time spent waiting for chunks counts as
+        network time.
+        """
+        if isinstance(reply, basestring):
+            self.response_bytes += len(reply)
+            return reply
+        return self._metered(reply, request=False)
+
+    def _metered(self, source, request):
+        source = iter(source)
+        while True:
+            start = time.time()
+            try:
+                piece = next(source)
+            except StopIteration:
+                self._add_time(time.time() - start, request)
+                return
+            self._add_time(time.time() - start, request)
+            if request:
+                self.request_bytes += len(piece)
+            else:
+                self.response_bytes += len(piece)
+            yield piece
+
+    def _add_time(self, elapsed, request):
+        if request:
+            # the body is produced while it is being posted, which is
+            # otherwise timed as network time
+            self.serialize_time += elapsed
+            self.network_time -= elapsed
+        else:
+            self.network_time += elapsed
+
+    def throttled(self, elapsed):
+        """
+        Records time spent waiting for the rate limiter, which happens
+        while the request is being posted and would otherwise be timed
+        as network time.
+        """
+        self.throttle_time += elapsed
+        self.network_time -= elapsed
+
+    def finish(self, total_time):
+        """
+        Records the call's total duration; whatever wasn't spent on
+        serialization, throttling or the network was spent parsing.
+        """
+        self.total_time = total_time
+        self.parse_time = max(
+            0.0, total_time - self.serialize_time - self.throttle_time -
+            self.network_time)
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class Instrumentation(object):
+    """
+    Receives instrumentation events from an API instance.  This base
+    class ignores them all; override the methods to collect them.
+    Methods may be called from several threads at once.
+    """
+
+    def on_call(self, event):
+        """
+        Called with a CallEvent when a call to the backend finishes,
+        whether it succeeded or not.
+        """
+        pass
+
+    def on_cache(self, cache, hits, misses):
+        """
+        Called after entries were looked up in one of the API's caches,
+        "inventory" or "quote", with how many were found and missing.
+        """
+        pass
+
+
+# Shared default for API instances:
+NO_INSTRUMENTATION = Instrumentation()
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304,
+                16777216)
+
+
+class Histogram(object):
+    """
+    A Prometheus style histogram: counts of observations falling at or
+    under each of the 'buckets' upper bounds, plus their sum and count.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # the last is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """
+        Returns a list of (upper_bound, count) pairs, with counts
+        including every smaller bucket, ending with ("+Inf", count).
+        """
+        total = 0
+        pairs = []
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+
+class HistogramCollector(Instrumentation):
+    """
+    Collects CallEvents into in-memory histograms and counters, named
+    and labelled after Prometheus conventions:
+
+      shipwire_call_duration_seconds{endpoint, warehouse, phase}
+          histogram, with phase one of serialize, throttle, network,
+          parse, total
+      shipwire_call_size_bytes{endpoint, warehouse, direction}
+          histogram, with direction one of request, response
+      shipwire_calls_total{endpoint, outcome}
+      shipwire_call_retries_total{endpoint}
+      shipwire_cache_lookups_total{cache, result}
+
+    Use render() to export them in Prometheus' text format.
+    """
+
+    PHASES = ("serialize", "throttle", "network", "parse", "total")
+
+    def __init__(self, latency_buckets=LATENCY_BUCKETS,
+                 size_buckets=SIZE_BUCKETS):
+        self.latency_buckets = latency_buckets
+        self.size_buckets = size_buckets
+        self.histograms = {} # (name, labels) : <Histogram>
+        self.counters = {} # (name, labels) : count
+        self.__lock = threading.Lock()
+
+    def on_call(self, event):
+        where = (("endpoint", event.endpoint),
+                 ("warehouse", event.warehouse or ""))
+        times = (event.serialize_time, event.throttle_time,
+                 event.network_time, event.parse_time, event.total_time)
+        with self.__lock:
+            for phase, seconds in zip(self.PHASES, times):
+                self._observe("shipwire_call_duration_seconds",
+                              where + (("phase", phase),), seconds,
+                              self.latency_buckets)
+            self._observe("shipwire_call_size_bytes",
+                          where + (("direction", "request"),),
+                          event.request_bytes, self.size_buckets)
+            self._observe("shipwire_call_size_bytes",
+                          where + (("direction", "response"),),
+                          event.response_bytes, self.size_buckets)
+            outcome = "ok" if event.ok else "error"
+            self._increment("shipwire_calls_total",
+                            (("endpoint", event.endpoint),
+                             ("outcome", outcome)))
+            self._increment("shipwire_call_retries_total",
+                            (("endpoint", event.endpoint),), event.retries)
+
+    def on_cache(self, cache, hits, misses):
+        with self.__lock:
+            self._increment("shipwire_cache_lookups_total",
+                            (("cache", cache), ("result", "hit")), hits)
+            self._increment("shipwire_cache_lookups_total",
+                            (("cache", cache), ("result", "miss")), misses)
+
+    def histogram(self, name, **labels):
+        """
+        Returns the histogram with the given name and labels, or None.
+        """
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def counter(self, name, **labels):
+        """
+        Returns the value of the counter with the given name and labels.
+        """
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def render(self):
+        """
+        Returns every metric in Prometheus' text exposition format.
+        """
+        lines = []
+        with self.__lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        last = None
+        for (name, labels), histogram in histograms:
+            if name != last:
+                lines.append("# TYPE {0} histogram".format(name))
+                last = name
+            for bound, count in histogram.cumulative():
+                lines.append("{0}_bucket{1} {2}".format(
+                    name, _labels(labels + (("le", bound),)), count))
+            lines.append("{0}_sum{1} {2!r}".format(
+                name, _labels(labels), histogram.sum))
+            lines.append("{0}_count{1} {2}".format(
+                name, _labels(labels), histogram.count))
+        for (name, labels), count in counters:
+            if name != last:
+                lines.append("# TYPE {0} counter".format(name))
+                last = name
+            lines.append("{0}{1} {2}".format(name, _labels(labels), count))
+        return "\n".join(lines) + "\n"
+
+    def _observe(self, name, labels, value, buckets):
+        key = (name, tuple(sorted(labels)))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(buckets)
+        histogram.observe(value)
+
+    def _increment(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels)))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+
+def _labels(labels):
+    """
+    Renders label pairs as a Prometheus label set.
+    """
+    return "{" + ",".join([
+        '{0}="{1}"'.format(key, str(value).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n"))
+        for key, value in labels]) + "}"
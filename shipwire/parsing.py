@@ -0,0 +1,113 @@
+"""
+Parsers for the replies of Shipwire's XML API.
+
+Inventory replies can list thousands of products per warehouse, so
+they are parsed incrementally: iter_inventory feeds the reply to a
+pull parser a piece at a time, yields each product as soon as its
+element closes, and drops the elements it has read, so that memory use
+stays flat however long the reply is.
+"""
+from lxml import etree
+
+from shipwire.common import *
+
+
+def _chunks(source):
+    """
+    Yields a reply as byte strings.  'source' may be a byte string, a
+    unicode string, a file-like object, or an iterable of byte strings.
+    """
+    if isinstance(source, unicode):
+        yield source.encode("utf-8")
+    elif isinstance(source, str):
+        yield source
+    elif hasattr(source, "read"):
+        while True:
+            chunk = source.read(64 * 1024)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        for chunk in source:
+            yield chunk
+
+
+def _parser_for(source, **kargs):
+    """
+    Returns a pull parser suited to 'source'.  Unicode replies have
+    been encoded to utf-8, whatever their xml declaration says.
+    """
+    if isinstance(source, unicode):
+        kargs["encoding"] = "utf-8"
+    return etree.XMLPullParser(**kargs)
+
+
+def iter_inventory(source):
+    """
+    Yields an Inventory for each <Product> of an InventoryUpdateResponse,
+    as it is parsed.  See _chunks for the kinds of 'source' accepted.
+
+    Raises etree.XMLSyntaxError if the reply is malformed, and
+    ValueError if it isn't an InventoryUpdateResponse; either may come
+    after some products have already been yielded.
+    """
+    parser = _parser_for(source, events=("end",), tag="Product")
+    for chunk in _chunks(source):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            yield _inventory(element)
+    root = parser.close()
+    for event, element in parser.read_events():
+        yield _inventory(element)
+    if root.tag != "InventoryUpdateResponse":
+        raise ValueError("Unexpected reply: <{0}>".format(root.tag))
+
+
+def _inventory(element):
+    """
+    Reads an Inventory from a <Product> element, then clears the
+    element and any siblings before it, as they won't be needed again.
+    """
+    inv = Inventory(element.attrib["code"], int(element.attrib["quantity"]))
+    element.clear()
+    while element.getprevious() is not None:
+        del element.getparent()[0]
+    return inv
+
+
+def parse_document(source):
+    """
+    Parses a whole reply, and returns its root element.
+    """
+    parser = _parser_for(source)
+    for chunk in _chunks(source):
+        parser.feed(chunk)
+    return parser.close()
+
+
+def parse_quotes(source):
+    """
+    Parses a RateResponse into the form of {"shipping_code" : <Quote>}.
+    """
+    root = parse_document(source)
+    assert root.tag == "RateResponse"
+    assert root.findtext("Status") == "OK"
+
+    report = {}
+    for quote in root.iterfind("Order/Quotes/Quote"):
+        code = quote.attrib["method"]
+        cost = quote.find("Cost")
+        report[code] = Quote(SHIPPING[code], float(cost.text),
+                             cost.get("currency", "USD"), code)
+    return report
+
+
+def parse_order(source):
+    """
+    Parses a SubmitOrderResponse into a tuple of
+    (status_code, order_number, transaction_id).
+    """
+    root = parse_document(source)
+    assert root.tag == "SubmitOrderResponse"
+    order = root.find("OrderInformation/Order")
+    return order.attrib["status"], order.attrib["number"], order.attrib["id"]
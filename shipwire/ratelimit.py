@@ -0,0 +1,189 @@
+import json
+import sqlite3
+import threading
+import time
+
+
+DEFAULT_RATE = 5.0 # requests per second
+DEFAULT_BURST = 10
+DEFAULT_MAX_WAIT = 30.0 # seconds
+
+
+class RateLimited(IOError):
+    """
+    Raised when a request would have to wait longer than the limiter's
+    'max_wait' for its turn, and was rejected instead.
+    """
+    def __init__(self, key, wait):
+        IOError.__init__(self, "Rate limited for {0}: {1:.2f}s wait".format(
+            key, wait))
+        self.key = key
+        self.wait = wait
+
+
+class BaseRateLimiter(object):
+    """
+    Client-side token bucket limiter, with one bucket per key, eg. per
+    (account, endpoint) as used by ShipwireAPI.
+
+    Each bucket refills at 'rate' tokens per second, up to 'burst'
+    tokens, and every request takes one.  When a bucket is empty,
+    requests are queued: each one reserves the next token and sleeps
+    until it is due, so that they go out in order at the allowed rate
+    instead of running into the remote limit.  A request which would
+    have to wait longer than 'max_wait' seconds is rejected with
+    RateLimited, without taking a token.
+
+    'limits' optionally maps the last element of a key, eg. an
+    endpoint, to a (rate, burst) tuple of its own.
+
+    'stats' counts the requests let through ('acquired'), those among
+    them which had to wait ('queued') and for how long in total and at
+    most ('wait_time', 'max_wait_time', in seconds), and those which
+    were 'rejected'.  Stats are kept per process.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_wait=DEFAULT_MAX_WAIT, limits=None):
+        self.rate = rate
+        self.burst = burst
+        self.max_wait = max_wait
+        self.limits = limits or {}
+        self.stats = {
+            "acquired" : 0,
+            "queued" : 0,
+            "rejected" : 0,
+            "wait_time" : 0.0,
+            "max_wait_time" : 0.0,
+        }
+        self.__stats_lock = threading.Lock()
+
+    def limit_for(self, key):
+        """
+        Returns the (rate, burst) tuple that applies to 'key'.
+        """
+        if isinstance(key, tuple) and self.limits.has_key(key[-1]):
+            return self.limits[key[-1]]
+        return self.rate, self.burst
+
+    def acquire(self, key):
+        """
+        Blocks until a request for 'key' may be made, and returns how
+        long that took in seconds.  Raises RateLimited if the wait
+        would exceed max_wait.
+        """
+        rate, burst = self.limit_for(key)
+        wait = self._reserve(key, rate, burst, self.max_wait, time.time())
+        with self.__stats_lock:
+            if wait is None:
+                self.stats["rejected"] += 1
+            else:
+                self.stats["acquired"] += 1
+                if wait > 0:
+                    self.stats["queued"] += 1
+                    self.stats["wait_time"] += wait
+                    self.stats["max_wait_time"] = max(
+                        wait, self.stats["max_wait_time"])
+        if wait is None:
+            raise RateLimited(key, self.max_wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def _reserve(self, key, rate, burst, max_wait, now):
+        """
+        Takes the next token from the bucket for 'key', which may be
+        one that hasn't been refilled yet, and returns how many seconds
+        from 'now' it is due.  Returns None, without taking it, if that
+        is more than 'max_wait' seconds away.
+        """
+        raise NotImplementedError("Token reservation.")
+
+    @staticmethod
+    def refill(tokens, stamp, rate, burst, now):
+        """
+        Returns the tokens in a bucket which held 'tokens' at time
+        'stamp', at time 'now'.  A bucket with reservations against it
+        holds a negative number of tokens.
+        """
+        if tokens is None:
+            return float(burst)
+        return min(float(burst), tokens + max(0.0, now - stamp) * rate)
+
+
+class MemoryRateLimiter(BaseRateLimiter):
+    """
+    In-process token bucket limiter.  Safe to share between threads
+    and API instances, but each process has its own buckets.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_wait=DEFAULT_MAX_WAIT, limits=None):
+        BaseRateLimiter.__init__(self, rate, burst, max_wait, limits)
+        self.__buckets = {} # key : (tokens, stamp)
+        self.__lock = threading.Lock()
+
+    def _reserve(self, key, rate, burst, max_wait, now):
+        with self.__lock:
+            tokens, stamp = self.__buckets.get(key, (None, now))
+            tokens = self.refill(tokens, stamp, rate, burst, now)
+            wait = max(0.0, (1 - tokens) / rate)
+            if max_wait is not None and wait > max_wait:
+                return None
+            self.__buckets[key] = (tokens - 1, now)
+            return wait
+
+
+class SqliteRateLimiter(BaseRateLimiter):
+    """
+    Token bucket limiter stored in a sqlite database file, so that
+    every process on a host, eg. all of the workers of a web server,
+    draws from the same buckets.  Keys must be json serializable.
+    """
+
+    def __init__(self, path, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_wait=DEFAULT_MAX_WAIT, limits=None):
+        BaseRateLimiter.__init__(self, rate, burst, max_wait, limits)
+        self.path = path
+        self.__local = threading.local()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL,
+                stamp REAL
+            )""")
+
+    def _db(self):
+        """
+        Returns this thread's connection to the database.
+        """
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.__local.db = db
+        return db
+
+    def _reserve(self, key, rate, burst, max_wait, now):
+        key = json.dumps(key)
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT tokens, stamp FROM buckets WHERE key = ?",
+                (key,)).fetchone()
+            tokens = self.refill(row and row[0], row and row[1], rate,
+                                 burst, now)
+            wait = max(0.0, (1 - tokens) / rate)
+            if max_wait is not None and wait > max_wait:
+                wait = None
+            else:
+                db.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, stamp) "
+                    "VALUES (?, ?, ?)", (key, tokens - 1, now))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return wait
@@ -0,0 +1,342 @@
+"""
+Resilience layer for the HTTP transport: bounded retries with jittered
+exponential backoff, a circuit breaker per endpoint, and optional
+hedged requests for slow calls.
+
+ResilientTransport wraps an HTTPTransport and has the same interface,
+so it can be handed to ShipwireAPI in its place, and shared between
+several API instances so that they share their circuit breakers.
+"""
+from Queue import Queue, Empty
+import random
+import threading
+import time
+
+from requests.exceptions import ConnectTimeout, RequestException
+
+from shipwire.executor import IDLE_TIMEOUT, WorkerPool
+
+
+# Endpoints which can safely be called more than once for the same
+# request.  Orders are left out: retrying or hedging an order that did
+# reach Shipwire would place it twice.
+IDEMPOTENT_ENDPOINTS = ("InventoryServices.php", "RateServices.php")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class ServerError(IOError):
+    """
+    Raised when Shipwire answers with a 5xx status.
+    """
+    def __init__(self, status, uri):
+        IOError.__init__(self, "HTTP {0} from {1}".format(status, uri))
+        self.status = status
+        self.uri = uri
+
+
+class CircuitOpen(IOError):
+    """
+    Raised without making a request when an endpoint's circuit breaker
+    is open, ie. the endpoint is known to be failing.
+    """
+    def __init__(self, uri, retry_at):
+        IOError.__init__(self, "Circuit open for {0}".format(uri))
+        self.uri = uri
+        self.retry_at = retry_at
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the health of one endpoint.  After 'failure_threshold'
+    consecutive failures the circuit opens, and requests fail fast
+    with CircuitOpen for 'reset_timeout' seconds.  Then a single trial
+    request is let through (the circuit is half-open): if it succeeds
+    the circuit closes again, otherwise it re-opens for another
+    'reset_timeout' seconds.
+    """
+
+    def __init__(self, uri, failure_threshold=5, reset_timeout=30.0):
+        self.uri = uri
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    def allow(self):
+        """
+        Raises CircuitOpen if a request may not be made right now.
+        """
+        with self.__lock:
+            if self.state == CLOSED:
+                return
+            retry_at = self.opened_at + self.reset_timeout
+            if self.state == OPEN and time.time() >= retry_at:
+                self.state = HALF_OPEN
+                self.__trial = False
+            if self.state == HALF_OPEN and not self.__trial:
+                self.__trial = True
+                return
+            raise CircuitOpen(self.uri, retry_at)
+
+    def record_success(self):
+        with self.__lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.__trial = False
+
+    def release(self):
+        """
+        Gives up a trial request which failed through no fault of the
+        endpoint, eg. because its body couldn't be built, so that the
+        next request is let through as the trial instead.
+        """
+        with self.__lock:
+            self.__trial = False
+
+    def record_failure(self):
+        with self.__lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or \
+                    self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.time()
+                self.__trial = False
+
+
+class ReplayableBody(object):
+    """
+    Wraps an iterable request body, eg. from
+    builders.iter_inventory_request, so that it can be sent more than
+    once.  Pieces are kept as they are first read, and replayed to
+    later readers; several threads may read it at once.
+    """
+
+    def __init__(self, source):
+        self.__source = iter(source)
+        self.__pieces = []
+        self.__lock = threading.Lock()
+
+    def __iter__(self):
+        i = 0
+        while True:
+            with self.__lock:
+                if i == len(self.__pieces):
+                    try:
+                        self.__pieces.append(next(self.__source))
+                    except StopIteration:
+                        return
+                piece = self.__pieces[i]
+            i += 1
+            yield piece
+
+
+class ResilientTransport(object):
+    """
+    Wraps an HTTPTransport with retries, circuit breakers and hedging.
+
+    Failed requests (connection errors, timeouts and 5xx replies) are
+    retried up to 'retries' times, after a random delay of up to
+    'backoff' * 2 ** n seconds for the n-th retry, capped at
+    'max_backoff'.  No retry is started once 'retry_budget' seconds
+    have passed since the first attempt.  Only idempotent endpoints are
+    retried, apart from connection timeouts, where nothing was sent.
+
+    Each endpoint has its own CircuitBreaker, built with
+    'failure_threshold' and 'reset_timeout'.
+
+    If 'hedge_after' is set, an idempotent request which hasn't been
+    answered after that many seconds is sent a second time, and the
+    first reply to arrive is used.  Hedged requests are sent from a
+    pool of 'hedge_workers' threads.
+
+    Counters are kept in 'stats'.
+    """
+
+    def __init__(self, transport, retries=2, backoff=0.1, max_backoff=2.0,
+                 retry_budget=15.0, failure_threshold=5, reset_timeout=30.0,
+                 hedge_after=None, hedge_workers=10, seed=None):
+        self.transport = transport
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_budget = retry_budget
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge_after = hedge_after
+        self.hedge_workers = hedge_workers
+        self.idempotent = IDEMPOTENT_ENDPOINTS
+        self.stats = {
+            "requests" : 0,
+            "failures" : 0,
+            "retries" : 0,
+            "short_circuited" : 0,
+            "hedges" : 0,
+            "hedge_wins" : 0,
+        }
+        self.__random = random.Random(seed)
+        self.__local = threading.local()
+        self.__breakers = {}
+        self.__hedge_pool = None
+        self.__lock = threading.Lock()
+
+    @property
+    def closed(self):
+        return self.transport.closed
+
+    @property
+    def last_retries(self):
+        """
+        The number of retries made by the last call to post() from the
+        current thread.
+        """
+        return getattr(self.__local, "retries", 0)
+
+    def close(self):
+        """
+        Closes the wrapped transport and stops the hedging threads.
+        """
+        with self.__lock:
+            pool, self.__hedge_pool = self.__hedge_pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+        self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def breaker(self, uri):
+        """
+        Returns the CircuitBreaker for the given endpoint.
+        """
+        with self.__lock:
+            breaker = self.__breakers.get(uri)
+            if breaker is None:
+                breaker = self.__breakers[uri] = CircuitBreaker(
+                    uri, self.failure_threshold, self.reset_timeout)
+            return breaker
+
+    def delay(self, retry):
+        """
+        Returns how long to wait before the given retry, counting from
+        zero: a random time of up to backoff * 2 ** retry seconds.
+        """
+        with self.__lock:
+            jitter = self.__random.random()
+        return jitter * min(self.max_backoff, self.backoff * 2 ** retry)
+
+    def post(self, uri, data, headers=None, stream=False, throttle=None):
+        """
+        Posts like HTTPTransport.post, with retries, hedging and the
+        endpoint's circuit breaker.  Raises ServerError for 5xx
+        replies, and CircuitOpen if the endpoint is known to be down.
+        'throttle' is called before every request actually sent,
+        retries and hedges included, so that a rate limiter sees each
+        of them.
+        """
+        breaker = self.breaker(uri)
+        idempotent = uri.rsplit("/", 1)[-1] in self.idempotent
+        if not isinstance(data, basestring) and data is not None:
+            data = ReplayableBody(data)
+
+        def send():
+            if throttle is not None:
+                throttle()
+            self._count("requests")
+            response = self.transport.post(uri, data, headers, stream)
+            if response.status_code >= 500:
+                response.close()
+                raise ServerError(response.status_code, uri)
+            return response
+
+        start = time.time()
+        retry = self.__local.retries = 0
+        while True:
+            try:
+                breaker.allow()
+            except CircuitOpen:
+                self._count("short_circuited")
+                raise
+            try:
+                if idempotent and self.hedge_after is not None:
+                    response = self._hedged(send)
+                else:
+                    response = send()
+            except (RequestException, ServerError) as error:
+                self._count("failures")
+                breaker.record_failure()
+                if retry >= self.retries or not (
+                        idempotent or isinstance(error, ConnectTimeout)):
+                    raise
+                delay = self.delay(retry)
+                if self.retry_budget is not None and \
+                        time.time() + delay - start > self.retry_budget:
+                    raise
+                time.sleep(delay)
+                self._count("retries")
+                retry = self.__local.retries = retry + 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return response
+
+    def _hedged(self, send):
+        """
+        Calls send(), and calls it again if the first call hasn't
+        finished after hedge_after seconds.  Returns the result of the
+        first call to succeed, or raises the error of the last one to
+        fail.  The loser's response is closed once it arrives.
+        """
+        pool = self._pool()
+        done = Queue()
+        first = pool.submit(send)
+        first.add_done_callback(done.put)
+        futures = [first]
+        try:
+            winner = done.get(timeout=self.hedge_after)
+        except Empty:
+            self._count("hedges")
+            hedge = pool.submit(send)
+            hedge.add_done_callback(done.put)
+            futures.append(hedge)
+            winner = done.get()
+            if winner.exception() is not None:
+                # the other request may still succeed
+                winner = done.get()
+            if winner is hedge and winner.exception() is None:
+                self._count("hedge_wins")
+        for future in futures:
+            if future is not winner:
+                future.add_done_callback(_discard)
+        return winner.result()
+
+    def _pool(self):
+        with self.__lock:
+            if self.__hedge_pool is None:
+                self.__hedge_pool = WorkerPool(
+                    self.hedge_workers, name="shipwire-hedge",
+                    idle_timeout=IDLE_TIMEOUT)
+            return self.__hedge_pool
+
+    def _count(self, stat):
+        with self.__lock:
+            self.stats[stat] += 1
+
+
+def _discard(future):
+    """
+    Closes the response of a hedged request that lost the race.
+    """
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
@@ -1,41 +1,220 @@
 
-from StringIO import StringIO
-from threading import Thread
+import threading
 import time
 
-from lxml import etree
-import requests
-
+from shipwire.builders import iter_inventory_request, order_request, \
+    rate_request
 from shipwire.common import *
+from shipwire.executor import Cancelled, Timeout
+from shipwire.instrumentation import CallEvent
+from shipwire.parsing import iter_inventory, parse_order, parse_quotes
+from shipwire.ratelimit import RateLimited
+from shipwire.resilience import CircuitOpen, ResilientTransport, ServerError
+from shipwire.transport import HTTPTransport
+
+
+# Chunk failures which aren't worth retrying: the chunk ran out of
+# time and may still be in flight, the transport has already retried
+# it, or it would only be turned away again.
+FINAL_CHUNK_ERRORS = (Timeout, Cancelled, ServerError, CircuitOpen,
+                      RateLimited)
 
 
 class ShipwireAPI(ShipwireBaseAPI):
-    def __init__(self, account_email, password, server):
+    SERVERS = {
+        "production" : "https://api.shipwire.com/exec/",
+        "test" : "https://api.beta.shipwire.com/exec/",
+    }
+
+    def __init__(self, account_email, password, server, transport=None,
+                 endpoint=None, pool=None, request_timeout=60.0, cache=None,
+                 quote_cache=None, rate_limiter=None):
         """
         Arguments 'account_email' and 'password' correspond to the
         shipwire account.  Argument 'server' must be one of
         "production", or "test".  Both correspond to Shipwire's actual
         API.
+
+        Argument 'transport' is an optional HTTPTransport or
+        resilience.ResilientTransport instance, which may be shared
+        between several API instances.  If it is omitted, the API
+        creates and owns a ResilientTransport with the default retry
+        and circuit breaker settings, which is released by calling
+        close() or by using the API as a context manager.  Argument
+        'endpoint' overrides the base url for the chosen server, eg. to
+        point at a local stub.
+
+        Argument 'pool' is an optional, possibly shared, WorkerPool used
+        to fan requests out across warehouses.  Argument
+        'request_timeout' bounds how long, in seconds, a fan-out waits
+        for all of its requests before raising executor.Timeout; each
+        request on its own is bounded by the transport's connect and
+        read timeouts.
+        Arguments 'cache' and 'quote_cache' are optional
+        cache.BaseCache instances for inventory info and shipping
+        quotes.
+
+        Argument 'rate_limiter' is an optional
+        ratelimit.BaseRateLimiter, which every request waits on,
+        retries and hedges included, keyed by (account_email,
+        api_uri_part).  Use a SqliteRateLimiter to share an account's
+        request budget between processes.
         """
         self.__email = account_email
         self.__pass = password
         self.__server = server
         assert server in ["production", "test"]
-        ShipwireBaseAPI.__init__(self, account_email, password, server)
+        ShipwireBaseAPI.__init__(
+            self, account_email, password, server, pool, cache, quote_cache)
+
+        self.request_timeout = request_timeout
+        self.rate_limiter = rate_limiter
+        self.inventory_chunk_size = 500 # skus per request
+        self.inventory_chunk_retries = 2
+        self.inventory_retry_backoff = 0.1 # seconds, doubled each round
+        self.inventory_concurrency = None
+        self.stream_chunk_size = 64 * 1024 # bytes
+        self.endpoint = endpoint or self.SERVERS[server]
+        self.__local = threading.local() # the CallEvent being made
+        self.__owns_transport = transport is None
+        if transport is None:
+            transport = ResilientTransport(HTTPTransport())
+        self.transport = transport
+
+    def close(self):
+        """
+        Releases the pooled connections and worker threads owned by
+        this instance.
+        """
+        ShipwireBaseAPI.close(self)
+        if self.__owns_transport:
+            self.transport.close()
+
+    def _credentials(self):
+        return self.__email, self.__pass, self.__server
+
+    def _throttler(self, api_uri_part):
+        """
+        Returns a function which waits for rate_limiter to let a
+        request to the given endpoint through, or None if there is no
+        rate limiter.  It is handed to the transport, which calls it
+        before each request it sends, retries and hedges included.
+        Time spent waiting is recorded as throttle time of the
+        CallEvent being made by the current thread, if any.
+        """
+        if self.rate_limiter is None:
+            return None
+        key = (self.__email, api_uri_part)
+        event = getattr(self.__local, "event", None)
+
+        def throttle():
+            start = time.time()
+            try:
+                self.rate_limiter.acquire(key)
+            finally:
+                if event is not None:
+                    event.throttled(time.time() - start)
+        return throttle
+
+    def _recording(self, event):
+        """
+        Makes 'event' the CallEvent being made by the current thread,
+        and returns the one it replaces.
+        """
+        previous = getattr(self.__local, "event", None)
+        self.__local.event = event
+        return previous
 
     def post_and_fetch(self, post_xml, api_uri_part):
         """
         This function posts xml to the server and returns the reply.
-        Function is exposed for easy overloading for unit tests.
+        Function is exposed for easy overloading for unit tests: the
+        API's own calls stream through post_and_stream, but if a
+        subclass overrides this method they go through it instead,
+        with their requests and replies held in memory.
+        """
+
+        event = CallEvent(api_uri_part)
+        previous = self._recording(event)
+        start = time.time()
+        try:
+            uri = self.endpoint + api_uri_part
+            data = str(post_xml)
+            headers = {'content-type': 'application/xml'}
+            event.request_bytes = len(data)
+            event.serialize_time = time.time() - start
+            sent = time.time()
+            response = self.transport.post(
+                uri, data, headers, throttle=self._throttler(api_uri_part))
+            event.response_bytes = len(response.content)
+            event.network_time += time.time() - sent
+            return response.text
+        except Exception as error:
+            event.error = error
+            raise
+        finally:
+            self._recording(previous)
+            event.retries = getattr(self.transport, "last_retries", 0)
+            event.finish(time.time() - start)
+            self.instrumentation.on_call(event)
+
+    def post_and_stream(self, body, api_uri_part):
+        """
+        Like post_and_fetch, but neither the request nor the reply is
+        held in memory as a whole.  Argument 'body' is a byte string,
+        or an iterable of byte strings such as the one returned by
+        builders.iter_inventory_request, which is sent as it is
+        produced.  Returns an iterator over the raw bytes of the reply,
+        in chunks of up to stream_chunk_size bytes, which the parsers
+        in shipwire.parsing read directly.  The connection is released
+        once the iterator is exhausted or closed.
         """
 
-        uri = "https://api.shipwire.com/exec/" + api_uri_part
-        if self.__server == "test":
-            uri = "https://api.beta.shipwire.com/exec/" + api_uri_part,
-        data = str(post_xml)
+        uri = self.endpoint + api_uri_part
         headers = {'content-type': 'application/xml'}
-        response = requests.post(uri, data=data, headers=headers)
-        return response.text
+        response = self.transport.post(
+            uri, body, headers, stream=True,
+            throttle=self._throttler(api_uri_part))
+        return _iter_response(response, self.stream_chunk_size)
+
+    def _fetch_overridden(self):
+        """
+        Returns True if a subclass has overridden post_and_fetch.
+        """
+        return type(self).post_and_fetch.__func__ is not \
+            ShipwireAPI.post_and_fetch.__func__
+
+    def _call(self, api_uri_part, warehouse, build, parse):
+        """
+        Makes one call to the backend through post_and_stream, or
+        through post_and_fetch if a subclass has overridden it: the
+        request is made by calling build(), and the reply parsed by
+        calling parse() with it.  Returns what parse() returns.  The
+        call is reported to the instrumentation as a CallEvent.
+        """
+        event = CallEvent(api_uri_part, warehouse)
+        previous = self._recording(event)
+        start = time.time()
+        try:
+            body = event.meter_request(build())
+            event.serialize_time += time.time() - start
+            sent = time.time()
+            if self._fetch_overridden():
+                if not isinstance(body, basestring):
+                    body = "".join(body)
+                reply = self.post_and_fetch(body, api_uri_part)
+            else:
+                reply = self.post_and_stream(body, api_uri_part)
+            event.network_time += time.time() - sent
+            return parse(event.meter_response(reply))
+        except Exception as error:
+            event.error = error
+            raise
+        finally:
+            self._recording(previous)
+            event.retries = getattr(self.transport, "last_retries", 0)
+            event.finish(time.time() - start)
+            self.instrumentation.on_call(event)
 
     def _place_single_cart_order(self, order_num, ship_address, warehouse, cart, ship_method):
         """
@@ -43,87 +222,46 @@ class ShipwireAPI(ShipwireBaseAPI):
         better to call this indirectly via the "place_order" method.
         Returns (status_code, order_number, transaction_id).
         """
-        req_template = """
-<!DOCTYPE OrderList SYSTEM "http://www.shipwire.com/exec/download/OrderList.dtd">
-<OrderList>
- <Username>{0}</Username>
- <Password>{1}</Password>
- <Server>{2}</Server>
- <Order id="{3}">
-   <Warehouse>{4}</Warehouse>
-   <SameDay>NOT REQUESTED</SameDay>
-   {5}
-   <Shipping>{6}</Shipping>
-   {7}
- </Order>
-</OrderList>
-""".strip()
-        addr = ship_address.to_xml()
-        items = cart.to_xml()
-        request = req_template.format(
-            self.__email,
-            self.__pass,
-            self.__server,
-            order_num,
-            warehouse,
-            addr,
-            ship_method,
-            items)
-
-        response = self.post_and_fetch(request, "FulfillmentServices.php")
-        fileob = StringIO(str(response))
-        root = etree.parse(fileob).xpath("/SubmitOrderResponse")[0]
-        order = root.xpath("OrderInformation/Order")[0]
-        order_num = order.attrib["number"]
-        status = order.attrib["status"]
-        trans_id = order.attrib["id"]
-        return (status, order_num, trans_id)
+        def build():
+            return order_request(
+                self._credentials(), order_num, warehouse, ship_address,
+                ship_method, cart.items)
+
+        return self._call(
+            "FulfillmentServices.php", warehouse, build, parse_order)
 
     def _get_single_cart_quotes(self, ship_address, warehouse, cart):
         """
         Returns the shipping options in the form of:
-        {"shipping_code" : ("human_readable", quote)}.
-        """
-        req_template = """
-<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE RateRequest SYSTEM "http://www.shipwire.com/exec/download/RateRequest.dtd">
-<RateRequest>
- <Username>{0}</Username>
- <Password>{1}</Password>
- <Server>{2}</Server>
- <Order id="{3}">{4}</Order>
-</RateRequest>
-""".strip()
-        request = req_template.format(
-            self.__email,
-            self.__pass,
-            self.__server,
-            0,
-            ship_address.to_xml() + cart.to_xml())
-
-        response = self.post_and_fetch(
-            request, "RateServices.php")
-        fileob = StringIO(str(response))
-        root = etree.parse(fileob).xpath("/RateResponse")[0]
-        assert root.xpath("Status")[0].text == "OK"
-        
-        report = {}
-        quotes = root.xpath("Order/Quotes/Quote")
-        for quote in quotes:
-            code = quote.attrib["method"]
-            name = SHIPPING[code]
-            cost = float(quote.xpath("Cost")[0].text)
-            report[code] = (name, cost)
+        {"shipping_code" : <Quote>}.
+        """
+        def build():
+            return rate_request(self._credentials(), ship_address, cart.items)
 
-        return report
+        return self._call("RateServices.php", warehouse, build, parse_quotes)
 
 
-    def _inventory_lookup(self, sku_list):
+    def _inventory_lookup(self, sku_list, warehouses=None, progress=None):
         """
-        Returns inventory data for the given list of skus.  This may imply
-        multiple api calls to shipwire's api for each warehouse.  This can
-        probably be threaded, but that is outside of the scope of the common
-        api class.
+        Returns inventory data for the given list of skus.  This implies
+        one api call to shipwire's api for each warehouse and chunk of
+        at most inventory_chunk_size skus, which are made concurrently
+        on the worker pool, with at most inventory_concurrency of them
+        in flight.  Argument 'warehouses' limits the lookup to the given
+        warehouse codes.  If 'sku_list' is None, the whole catalog is
+        requested, in a single request per warehouse.
+
+        A chunk which fails is retried on its own, up to
+        inventory_chunk_retries times, after inventory_retry_backoff
+        seconds, doubled for each further round.  This is meant for
+        errors the transport can't retry, eg. a reply cut off while it
+        is being parsed: chunks which failed with one of
+        FINAL_CHUNK_ERRORS aren't retried.
+
+        Argument 'progress' (by default, the inventory_progress
+        attribute) is an optional function, which is called with the
+        number of requests finished so far and the total, each time
+        one of them finishes.
 
         This function should return a dict where each key is a
         warehouse code, and the value is a list of Inventory object
@@ -131,71 +269,88 @@ class ShipwireAPI(ShipwireBaseAPI):
 
         Like so:
         { "warehouse" : [<Inventory>, ...] }
+
+        If any of a warehouse's requests fails for good, or doesn't
+        finish within request_timeout seconds, PartialInventoryError is
+        raised with the results of the other warehouses.
         """
 
-        product_template = "<ProductCode>{0}</ProductCode>"
-        req_template = """
-<?xml version="1.0" encoding="UTF-8"?>
-<!DOCTYPE InventoryUpdateResponse SYSTEM "http://www.shipwire.com/exec/download/InventoryUpdateResponse.dtd">
-<InventoryUpdate>
-    <Username>{0}</Username>
-    <Password>{1}</Password>
-    <Server>{2}</Server>
-    <Warehouse>{3}</Warehouse>
-    {4}
-    <IncludeEmpty/>
-</InventoryUpdate>
-        """.strip()
-
-        def gen_req(warehouse, sku_list):
-            product_lines = "\n".join(
-                [product_template.format(sku) for sku in sku_list])
-            return req_template.format(
-                self.__email, 
-                self.__pass, 
-                self.__server, 
-                warehouse, 
-                product_lines)
-            
-        requests = []
-        for warehouse in WAREHOUSE_CODES:
-            requests.append(gen_req(warehouse, sku_list))
-
-        class ReqThread(Thread):
-            """
-            Performing the requests one after another is too slow.  This class
-            wraps the post_and_fetch call so that several can be ran
-            in parallel.
-            """
-            def __init__(self, api, request):
-                self.data = ""
-                self.req = request
-                self.api = api
-                Thread.__init__(self)
-            def run(self):
-                self.data = self.api.post_and_fetch(
-                    self.req, "InventoryServices.php")
-
-        start_time = time.time()
-        pool = [ReqThread(self, req) for req in requests]
-        for thread in pool:
-            thread.start()
-        for thread in pool:
-            thread.join()
-        total = time.time()-start_time
-        responses = [thread.data for thread in pool]
+        if warehouses is None:
+            warehouses = WAREHOUSE_CODES
+        if progress is None:
+            progress = self.inventory_progress
 
-        report = {}
-        for warehouse, raw in zip(WAREHOUSE_CODES, responses):
-            # note that lxml blows up when you pass it unicode
-            fileob = StringIO(str(raw))
-            root = etree.parse(fileob).xpath("/InventoryUpdateResponse")[0]
-            items = []
-            for entry in root.xpath("Product"):
-                inv = Inventory()
-                inv.code = entry.attrib["code"]
-                inv.quantity = int(entry.attrib["quantity"])
-                items.append(inv)
-            report[warehouse] = items
+        if sku_list is None:
+            # a request without product codes asks for the whole catalog
+            chunks = [()]
+        else:
+            sku_list = list(sku_list)
+            size = self.inventory_chunk_size or len(sku_list) or 1
+            chunks = [tuple(sku_list[i:i+size])
+                      for i in range(0, len(sku_list), size)]
+        tasks = [(warehouse, chunk)
+                 for warehouse in warehouses for chunk in chunks]
+        lock = threading.Lock()
+        done = [0]
 
+        def fetch(task):
+            warehouse, chunk = task
+            items = self._call(
+                "InventoryServices.php", warehouse,
+                lambda: iter_inventory_request(
+                    self._credentials(), warehouse, chunk),
+                lambda reply: list(iter_inventory(reply)))
+            if progress is not None:
+                with lock:
+                    done[0] += 1
+                    count = done[0]
+                progress(count, len(tasks))
+            return items
+
+        # Performing the requests one after another is too slow, so
+        # they are run in parallel on the worker pool, a few at a time.
+        # Chunks that fail are retried on their own, with a backoff,
+        # while the time allowed lasts.
+        deadline = time.time() + self.request_timeout
+        fetched, errors = self.pool.settle(
+            fetch, tasks, self.request_timeout, self.inventory_concurrency)
+        for attempt in range(self.inventory_chunk_retries):
+            retry = [task for task, error in errors.items()
+                     if not isinstance(error, FINAL_CHUNK_ERRORS)]
+            delay = self.inventory_retry_backoff * 2 ** attempt
+            if not retry or deadline - time.time() <= delay:
+                break
+            time.sleep(delay)
+            retried, failures = self.pool.settle(
+                fetch, retry, deadline - time.time(),
+                self.inventory_concurrency)
+            fetched.update(retried)
+            for task in retried.keys():
+                del errors[task]
+            errors.update(failures)
+
+        report = {}
+        failed = {}
+        for warehouse, chunk in tasks:
+            if errors.has_key((warehouse, chunk)):
+                failed.setdefault(warehouse, errors[(warehouse, chunk)])
+            elif not failed.has_key(warehouse):
+                report.setdefault(warehouse, []).extend(
+                    fetched[(warehouse, chunk)])
+        for warehouse in failed.keys():
+            report.pop(warehouse, None)
+        if failed:
+            raise PartialInventoryError(report, failed)
         return report
+
+
+def _iter_response(response, chunk_size):
+    """
+    Yields the body of a streamed requests.Response, and closes the
+    response afterwards.
+    """
+    try:
+        for chunk in response.iter_content(chunk_size):
+            yield chunk
+    finally:
+        response.close()
@@ -0,0 +1,256 @@
+"""
+Order splitting: choosing which warehouses should ship which part of
+a cart.
+
+A split is scored by its shipments, each domestic shipment counting
+as 1 and each international one as 'intl_weight'.  Among the splits
+that ship as many units as the combined stock allows, split_order
+returns the one with the lowest score.  A SKU's quantity may be split
+between several warehouses when no single one has enough.
+
+The search is a branch and bound over sets of warehouses, seeded with
+a greedy solution.  It is exact unless it runs out of its node budget,
+in which case the best split found so far is returned.  It works on
+the cart's columns of the stock, taken from a stock.StockMatrix or
+straight from a dict, so that each step of the search is a handful of
+vector operations over the cart's skus.
+
+When the score isn't the whole story, eg. when the splits are to be
+compared by their shipping rates, candidate_splits lists the
+alternatives instead.
+"""
+import numpy
+
+from shipwire.stock import StockMatrix
+
+
+INTL_SHIPMENT_WEIGHT = 10
+MAX_SEARCH_NODES = 20000
+
+
+def split_order(demand, stock, domestic=(), intl_weight=INTL_SHIPMENT_WEIGHT,
+                max_nodes=MAX_SEARCH_NODES):
+    """
+    Splits a cart between warehouses.
+
+    Argument 'demand' is the cart, in the form of {"sku" : quantity}.
+    Argument 'stock' is the inventory to draw from, either as a
+    StockMatrix or in the form of {"warehouse" : {"sku" : quantity}},
+    and 'domestic' is a collection of the warehouse codes that are in
+    the destination's country.
+
+    Returns a tuple of the split, in the form of
+    {"warehouse" : {"sku" : quantity}}, and the remainder that no
+    warehouse could ship, in the form of {"sku" : quantity}.
+    """
+    problem = _Problem(demand, stock, domestic, intl_weight)
+    chosen = _search(problem, max_nodes)
+    return problem.allocate(chosen)
+
+
+def candidate_splits(demand, stock, domestic=(),
+                     intl_weight=INTL_SHIPMENT_WEIGHT, max_splits=50,
+                     max_nodes=MAX_SEARCH_NODES):
+    """
+    Returns up to 'max_splits' alternative splits of a cart, as a list
+    of (split, remainder) tuples in the same form split_order returns,
+    ordered from the lowest score to the highest.  Every one of them
+    ships as much as the stock allows, and none uses a warehouse it
+    could do without.  Arguments are as for split_order.
+    """
+    problem = _Problem(demand, stock, domestic, intl_weight)
+    usable = problem.usable
+    goal = problem.goal
+    best = _search(problem, max_nodes)
+    found = [best]
+    state = {"nodes" : 0}
+    supply = numpy.zeros_like(goal)
+    chosen = []
+    count = len(problem.rows)
+
+    def visit(i):
+        if (supply >= goal).all():
+            # keep it if dropping any one warehouse would miss the goal
+            if all([((supply - usable[j]) < goal).any() for j in chosen]) \
+                    and set(chosen) != set(best):
+                found.append(list(chosen))
+            return
+        if i == count or state["nodes"] >= max_nodes \
+                or len(found) >= max_splits:
+            return
+        state["nodes"] += 1
+        supply[:] += usable[i]
+        chosen.append(i)
+        visit(i + 1)
+        chosen.pop()
+        supply[:] -= usable[i]
+        if (supply + problem.suffix_supply[i + 1] >= goal).all():
+            visit(i + 1)
+
+    visit(0)
+    found.sort(key=problem.cost)
+    return [problem.allocate(rows) for rows in found]
+
+
+def split_cost(split, domestic=(), intl_weight=INTL_SHIPMENT_WEIGHT):
+    """
+    Returns the score split_order gives a split.
+    """
+    cost = 0
+    for warehouse in split.keys():
+        cost += 1 if warehouse in domestic else intl_weight
+    return cost
+
+
+class _Problem(object):
+    """
+    The arrays a search works on.  Rows are the warehouses which stock
+    any of the demand, ordered cheapest first and then by how much of
+    it they can ship, and columns are the skus of the demand.
+    """
+
+    def __init__(self, demand, stock, domestic, intl_weight):
+        self.skus = sorted([sku for sku, qty in demand.items() if qty > 0])
+        self.demand = numpy.array(
+            [demand[sku] for sku in self.skus], dtype=numpy.int64)
+        if isinstance(stock, StockMatrix):
+            codes = stock.warehouses
+            block = stock.columns(self.skus)
+        else:
+            # only the cart's columns are needed, so there's no point
+            # in building a whole matrix:
+            codes = sorted(stock.keys())
+            block = numpy.array(
+                [[stock[code].get(sku, 0) for sku in self.skus]
+                 for code in codes], dtype=numpy.int64).reshape(
+                     len(codes), len(self.skus))
+        block = numpy.maximum(block, 0)
+        usable = numpy.minimum(block, self.demand)
+        units = usable.sum(axis=1).tolist()
+
+        weights = [1 if code in domestic else intl_weight for code in codes]
+        order = sorted([i for i in range(len(codes)) if units[i] > 0],
+                       key=lambda i: (weights[i], -units[i], codes[i]))
+        self.rows = [codes[i] for i in order]
+        self.stock = block[order]
+        self.usable = usable[order]
+        self.weights = numpy.array([weights[i] for i in order], dtype=float)
+
+        # the units of each sku that can be shipped at all:
+        self.goal = numpy.minimum(self.demand, self.usable.sum(axis=0))
+
+        # the stock left in the rows from index i onwards, and the
+        # lightest of their weights:
+        count = len(self.rows)
+        self.suffix_supply = numpy.zeros(
+            (count + 1, len(self.skus)), dtype=numpy.int64)
+        self.suffix_supply[:count] = self.usable[::-1].cumsum(axis=0)[::-1]
+        self.suffix_weight = numpy.append(
+            numpy.minimum.accumulate(self.weights[::-1])[::-1], numpy.inf)
+
+    def cost(self, rows):
+        return sum([self.weights[i] for i in rows])
+
+    def allocate(self, rows):
+        """
+        Draws the demand from the given rows, domestic ones and the
+        ones with the most of each sku first.  Returns (split,
+        remainder) as split_order does.
+        """
+        rows = sorted(rows)
+        stock = self.stock[rows]
+        if len(rows) == 1:
+            drawn = numpy.minimum(stock, self.demand)
+        elif rows:
+            # each column's sources are ordered by weight, then most
+            # stock, then code:
+            codes = numpy.argsort(numpy.argsort(
+                [self.rows[i] for i in rows]))
+            key = (self.weights[rows][:, None] * (stock.max() + 1) - stock) \
+                * len(rows) + codes[:, None]
+            order = numpy.argsort(key, axis=0, kind="mergesort")
+            ordered = numpy.take_along_axis(stock, order, axis=0)
+            before = ordered.cumsum(axis=0) - ordered
+            take = numpy.clip(
+                numpy.minimum(ordered, self.demand - before), 0, None)
+            drawn = numpy.zeros_like(stock)
+            numpy.put_along_axis(drawn, order, take, axis=0)
+        else:
+            drawn = stock
+
+        split = {}
+        for i, taken in zip(rows, drawn.tolist()):
+            items = dict([(sku, quantity) for sku, quantity
+                          in zip(self.skus, taken) if quantity > 0])
+            if items:
+                split[self.rows[i]] = items
+        short = (self.demand - drawn.sum(axis=0)).tolist()
+        remainder = dict([(sku, quantity) for sku, quantity
+                          in zip(self.skus, short) if quantity > 0])
+        return split, remainder
+
+
+def _greedy(problem):
+    """
+    Repeatedly picks the row which adds the most units per unit of
+    weight, until the goal is met.  Returns the chosen rows.
+    """
+    goal = problem.goal
+    supply = numpy.zeros_like(goal)
+    remaining = numpy.ones(len(problem.rows), dtype=bool)
+    chosen = []
+    while (supply < goal).any():
+        gains = numpy.minimum(problem.usable, goal - supply).sum(axis=1)
+        ratios = numpy.where(remaining, gains / problem.weights, -1)
+        best = int(numpy.argmax(ratios))
+        remaining[best] = False
+        chosen.append(best)
+        supply += numpy.minimum(problem.usable[best], goal - supply)
+    return chosen
+
+
+def _search(problem, max_nodes):
+    """
+    Finds the cheapest set of rows whose combined stock meets the
+    goal, visiting at most 'max_nodes' nodes of the search tree.
+    """
+    best = _greedy(problem)
+    state = {
+        "best" : best,
+        "cost" : problem.cost(best),
+        "nodes" : 0,
+    }
+    goal = problem.goal
+    usable = problem.usable
+    count = len(problem.rows)
+    supply = numpy.zeros_like(goal)
+    chosen = []
+
+    def visit(i, short, cost):
+        if short == 0:
+            if cost < state["cost"]:
+                state["best"] = list(chosen)
+                state["cost"] = cost
+            return
+        if i == count or state["nodes"] >= max_nodes:
+            return
+        if cost + problem.suffix_weight[i] >= state["cost"]:
+            return
+        state["nodes"] += 1
+
+        # with this row, unless it adds nothing the others haven't:
+        added = numpy.minimum(goal - supply, usable[i])
+        gained = added.sum()
+        if gained:
+            supply[:] += added
+            chosen.append(i)
+            visit(i + 1, short - gained, cost + problem.weights[i])
+            chosen.pop()
+            supply[:] -= added
+
+        # without it, if the others can still meet the goal:
+        if (supply + problem.suffix_supply[i + 1] >= goal).all():
+            visit(i + 1, short, cost)
+
+    visit(0, goal.sum(), 0)
+    return state["best"]
@@ -0,0 +1,92 @@
+import numpy
+
+
+class StockMatrix(object):
+    """
+    An inventory snapshot as a dense warehouse by sku matrix of
+    quantities.  Row i is the stock of warehouses[i] and column j the
+    stock of skus[j]; 'warehouse_index' and 'sku_index' map codes back
+    to rows and columns.
+    """
+
+    def __init__(self, warehouses, skus, quantities=None):
+        self.warehouses = list(warehouses)
+        self.skus = list(skus)
+        self.warehouse_index = dict(
+            [(code, i) for i, code in enumerate(self.warehouses)])
+        self.sku_index = dict([(sku, j) for j, sku in enumerate(self.skus)])
+        if quantities is None:
+            quantities = numpy.zeros(
+                (len(self.warehouses), len(self.skus)), dtype=numpy.int64)
+        self.quantities = quantities
+
+    @classmethod
+    def from_stock(cls, stock, skus=None):
+        """
+        Builds a matrix from a dict in the form of
+        {"warehouse" : {"sku" : quantity}}.  If 'skus' is given, only
+        those columns are kept.
+        """
+        if skus is None:
+            skus = set()
+            for levels in stock.values():
+                skus.update(levels.keys())
+        matrix = cls(sorted(stock.keys()), sorted(skus))
+        for code, levels in stock.items():
+            row = matrix.quantities[matrix.warehouse_index[code]]
+            for sku, quantity in levels.items():
+                j = matrix.sku_index.get(sku)
+                if j is not None:
+                    row[j] = quantity
+        return matrix
+
+    @classmethod
+    def from_inventory(cls, query):
+        """
+        Builds a matrix from the results of inventory_lookup, in the
+        form of {"sku" : {"warehouse" : <Inventory>}}.
+        """
+        warehouses = set()
+        for data in query.values():
+            warehouses.update(data.keys())
+        matrix = cls(sorted(warehouses), sorted(query.keys()))
+        for sku, data in query.items():
+            j = matrix.sku_index[sku]
+            for code, inventory in data.items():
+                matrix.quantities[matrix.warehouse_index[code], j] = \
+                    max(inventory.quantity, 0)
+        return matrix
+
+    def columns(self, skus):
+        """
+        Returns the stock of the given skus as a warehouse by sku
+        array, with zeros for skus missing from the matrix.
+        """
+        block = numpy.zeros((len(self.warehouses), len(skus)),
+                            dtype=numpy.int64)
+        for k, sku in enumerate(skus):
+            j = self.sku_index.get(sku)
+            if j is not None:
+                block[:, k] = self.quantities[:, j]
+        return block
+
+    def take(self, split):
+        """
+        Removes the stock allocated by a split, in the form of
+        {"warehouse" : {"sku" : quantity}}.
+        """
+        for code, items in split.items():
+            i = self.warehouse_index[code]
+            for sku, quantity in items.items():
+                self.quantities[i, self.sku_index[sku]] -= quantity
+
+    def __getitem__(self, key):
+        """
+        Returns the quantity of a (warehouse, sku) pair.
+        """
+        code, sku = key
+        i = self.warehouse_index.get(code)
+        j = self.sku_index.get(sku)
+        if i is None or j is None:
+            return 0
+        return int(self.quantities[i, j])
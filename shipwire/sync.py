@@ -0,0 +1,236 @@
+import logging
+import sqlite3
+import threading
+import time
+
+from shipwire.common import Inventory, NOT_LISTED, PartialInventoryError, \
+    WAREHOUSE_CODES
+
+
+log = logging.getLogger(__name__)
+
+SYNC_INTERVAL = 60*60 # seconds
+# a store that has missed this many syncs is no longer trusted:
+DEFAULT_MAX_AGE = 3 * SYNC_INTERVAL
+
+
+class InventoryStore(object):
+    """
+    Local copy of the whole Shipwire stock picture, kept in a sqlite
+    database file by InventorySync.  It holds the quantity of every
+    sku at every warehouse, along with when each warehouse was last
+    fetched, and can be shared by every process on a host.
+
+    Warehouses last fetched more than 'max_age' seconds ago are
+    treated as unknown by lookup(), so that lookups go back to the
+    backend when syncing stops.  The default allows for a few missed
+    runs of an InventorySync at its default interval; scale it with
+    the interval, or pass None to accept any age.
+    """
+
+    def __init__(self, path, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.__local = threading.local()
+        db = self._db()
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS inventory (
+                sku TEXT,
+                warehouse TEXT,
+                quantity INTEGER,
+                fetched REAL,
+                PRIMARY KEY (sku, warehouse)
+            )""")
+        db.execute("CREATE INDEX IF NOT EXISTS inventory_warehouse "
+                   "ON inventory (warehouse)")
+        db.execute("""
+            CREATE TABLE IF NOT EXISTS warehouses (
+                warehouse TEXT PRIMARY KEY,
+                fetched REAL
+            )""")
+
+    def _db(self):
+        """
+        Returns this thread's connection to the database.
+        """
+        db = getattr(self.__local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.__local.db = db
+        return db
+
+    def fetched_at(self, warehouse):
+        """
+        Returns when the given warehouse was last fetched, or None if
+        it never was.
+        """
+        row = self._db().execute(
+            "SELECT fetched FROM warehouses WHERE warehouse = ?",
+            (warehouse,)).fetchone()
+        return row and row[0]
+
+    def quantities(self, warehouse):
+        """
+        Returns the stored stock of a warehouse, in the form of
+        {"sku" : quantity}.
+        """
+        return dict(self._db().execute(
+            "SELECT sku, quantity FROM inventory WHERE warehouse = ?",
+            (warehouse,)).fetchall())
+
+    def apply(self, warehouse, inventory, fetched=None):
+        """
+        Replaces the stored stock of a warehouse with the given list of
+        Inventory instances, writing only the quantities that changed.
+        Skus missing from the list are removed, and every row of the
+        warehouse is stamped with 'fetched'.  Returns the number of
+        skus that were added, changed and removed, in a dict.
+        """
+        if fetched is None:
+            fetched = time.time()
+        stored = self.quantities(warehouse)
+        latest = {}
+        for entry in inventory:
+            latest[entry.code] = entry.quantity
+
+        added = [sku for sku in latest.keys() if not stored.has_key(sku)]
+        changed = [sku for sku, quantity in latest.items()
+                   if stored.has_key(sku) and stored[sku] != quantity]
+        removed = [sku for sku in stored.keys() if not latest.has_key(sku)]
+
+        db = self._db()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany(
+                "INSERT OR REPLACE INTO inventory "
+                "(sku, warehouse, quantity, fetched) VALUES (?, ?, ?, ?)",
+                [(sku, warehouse, latest[sku], fetched)
+                 for sku in added + changed])
+            db.executemany(
+                "DELETE FROM inventory WHERE sku = ? AND warehouse = ?",
+                [(sku, warehouse) for sku in removed])
+            db.execute(
+                "UPDATE inventory SET fetched = ? WHERE warehouse = ?",
+                (fetched, warehouse))
+            db.execute(
+                "INSERT OR REPLACE INTO warehouses (warehouse, fetched) "
+                "VALUES (?, ?)", (warehouse, fetched))
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+        return {
+            "added" : len(added),
+            "changed" : len(changed),
+            "removed" : len(removed),
+        }
+
+    def lookup(self, keys):
+        """
+        Looks up the given (sku, warehouse) pairs.  Returns
+        {("sku", "warehouse") : <Inventory> or NOT_LISTED} for the
+        pairs whose warehouse has been fetched recently enough, and
+        leaves the others out.
+        """
+        now = time.time()
+        known = {}
+        for warehouse in set([key[1] for key in keys]):
+            fetched = self.fetched_at(warehouse)
+            if fetched is not None and (self.max_age is None or
+                                        now - fetched <= self.max_age):
+                known[warehouse] = fetched
+
+        skus = list(set([sku for sku, warehouse in keys
+                         if known.has_key(warehouse)]))
+        rows = {}
+        db = self._db()
+        # stay under sqlite's limit on query parameters:
+        for i in range(0, len(skus), 500):
+            chunk = skus[i:i+500]
+            query = "SELECT sku, warehouse, quantity FROM inventory " \
+                "WHERE sku IN ({0})".format(", ".join(["?"] * len(chunk)))
+            for sku, warehouse, quantity in db.execute(query, chunk):
+                rows[(sku, warehouse)] = quantity
+
+        found = {}
+        for key in keys:
+            if not known.has_key(key[1]):
+                continue
+            if rows.has_key(key):
+                found[key] = Inventory(key[0], rows[key])
+            else:
+                found[key] = NOT_LISTED
+        return found
+
+
+class InventorySync(object):
+    """
+    Pulls the whole catalog's inventory from an API's backend into an
+    InventoryStore, either on demand with run() or every 'interval'
+    seconds in a background thread with start().
+    """
+
+    def __init__(self, api, store, interval=SYNC_INTERVAL, warehouses=None):
+        self.api = api
+        self.store = store
+        self.interval = interval
+        self.warehouses = warehouses or WAREHOUSE_CODES
+        self.last_run = None
+        self.last_changes = {}
+        self.last_errors = {}
+        self.__thread = None
+        self.__stop = threading.Event()
+
+    def run(self):
+        """
+        Fetches every warehouse's full inventory and applies the
+        differences to the store.  Warehouses which fail to answer keep
+        their previous contents.  Returns a dict of the changes made to
+        each warehouse, as returned by InventoryStore.apply, and keeps
+        the exceptions for the warehouses that failed in 'last_errors'.
+        """
+        errors = {}
+        try:
+            report = self.api._inventory_lookup(None, self.warehouses)
+        except PartialInventoryError as partial:
+            report = partial.report
+            errors = partial.errors
+        fetched = time.time()
+
+        changes = {}
+        for warehouse, inventory in report.items():
+            changes[warehouse] = self.store.apply(warehouse, inventory, fetched)
+        for warehouse, error in errors.items():
+            log.warning("Inventory sync failed for %s: %s", warehouse, error)
+        self.last_run = fetched
+        self.last_changes = changes
+        self.last_errors = errors
+        return changes
+
+    def start(self):
+        """
+        Starts a daemon thread which calls run() every 'interval'
+        seconds, starting right away, until stop() is called.
+        """
+        def loop():
+            while True:
+                try:
+                    self.run()
+                except Exception:
+                    log.exception("Inventory sync failed.")
+                if self.__stop.wait(self.interval):
+                    return
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=loop, name="shipwire-sync")
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        """
+        Stops the background thread, waiting for a run in progress.
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
@@ -1,4 +1,5 @@
 
+from shipwire.async_api import AsyncShipwireBaseAPI
 from shipwire.common import *
 
 
@@ -51,14 +52,16 @@ class LoremIpsumAPI(ShipwireBaseAPI):
     used for testing purposes, without ever touching the shipwire backend.
     """
 
-    def __init__(self, account_email, password, server):
+    def __init__(self, account_email, password, server, pool=None,
+                 cache=None, quote_cache=None):
         """
         Arguments 'account_email' and 'password' correspond to the
         shipwire account.  Argument 'server' must be one of
         "production", or "test".  Both correspond to Shipwire's actual
         API.
         """
-        ShipwireBaseAPI.__init__(self, account_email, password, server)
+        ShipwireBaseAPI.__init__(
+            self, account_email, password, server, pool, cache, quote_cache)
 
         if server not in ["test", "production"]:
             raise ValueError("Bad target server.")
@@ -68,7 +71,7 @@ class LoremIpsumAPI(ShipwireBaseAPI):
                 and server == "test"):
             raise NotImplementedError("Fake failure for fake auth.")
 
-    def _inventory_lookup(self, sku_set):
+    def _inventory_lookup(self, sku_set, warehouses=None, progress=None):
         """
         Don't call this method directly; use
         inventory_lookup(product_skus, caching) instead!
@@ -77,21 +80,26 @@ class LoremIpsumAPI(ShipwireBaseAPI):
         """
 
         def fake_stock_info(warehouse, sku):
-            item = Inventory()
-            item.quantity = 0
-            item.code = sku
-
+            quantity = 0
             if BS_PRODUCT_DATABASE.has_key(sku):
                 record = BS_PRODUCT_DATABASE[sku]
                 try:
-                    item.quantity = record["stock_info"][warehouse]
+                    quantity = record["stock_info"][warehouse]
                 except KeyError:
                     pass
-            return item
+            return Inventory(sku, quantity)
         
+        if sku_set is None:
+            sku_set = BS_PRODUCT_DATABASE.keys()
+        if warehouses is None:
+            warehouses = WAREHOUSE_CODES
+        if progress is None:
+            progress = self.inventory_progress
         report = {}
-        for code in WAREHOUSE_CODES:
+        for i, code in enumerate(warehouses):
             report[code] = [fake_stock_info(code, sku) for sku in sku_set]
+            if progress is not None:
+                progress(i + 1, len(warehouses))
         return report
 
     def _place_single_cart_order(self, order_number, ship_address, warehouse, cart, ship_method):
@@ -119,5 +127,16 @@ class LoremIpsumAPI(ShipwireBaseAPI):
             rate_set = INTL_SHIPPING
         options = {}
         for code in rate_set:
-            options[code] = SHIPPING[code], TEST_RATES[code] * len(cart.sku_list)
+            options[code] = Quote(
+                SHIPPING[code], TEST_RATES[code] * cart.total_quantity,
+                "USD", code)
         return options
+
+
+class AsyncLoremIpsumAPI(AsyncShipwireBaseAPI):
+    """
+    Non-blocking counterpart to LoremIpsumAPI, for testing code that
+    uses AsyncShipwireAPI.
+    """
+
+    api_class = LoremIpsumAPI
@@ -1,3 +1,5 @@
+import pickle
+
 
 
 from shipwire.common import *
@@ -59,3 +61,85 @@ def test_is_domestic():
     assert not is_domestic(addr, "TOR")
     assert not is_domestic(addr, "VAN")
     assert not is_domestic(addr, "UK")
+
+
+def test_country_index():
+    """
+    The country index should agree with a linear scan of COUNTRIES for
+    every spelling of every country.
+    """
+    def linear_iso_for_country(country):
+        for line in COUNTRIES:
+            if [i.upper() for i in line].count(country.upper().replace("_", " ")):
+                return line[-1]
+        return None
+
+    for line in COUNTRIES:
+        for alias in line:
+            for spelling in [alias, alias.lower(), alias.replace(" ", "_")]:
+                assert iso_for_country(spelling) == linear_iso_for_country(spelling)
+    assert iso_for_country("Hutzselvania") is None
+    assert WAREHOUSE_COUNTRIES["PHL"] == "USA"
+    assert is_eu("gb")
+    assert not is_eu("usa")
+
+
+def test_cart_items():
+    """
+    Carts should keep one count per sku, however many units are added,
+    while still offering the expanded sku list.
+    """
+    cart = CartItems(["sku_0001", "sku_0002", "sku_0001"])
+    assert cart.items == {"sku_0001" : 2, "sku_0002" : 1}
+    cart.add_item("sku_0003", 5000)
+    assert cart.quantity("sku_0003") == 5000
+    assert cart.total_quantity == 5003
+    cart.remove_item("sku_0003", 4999)
+    cart.remove_item("sku_0002", 3)
+    assert cart.items == {"sku_0001" : 2, "sku_0003" : 1}
+    assert sorted(cart.sku_list) == ["sku_0001", "sku_0001", "sku_0003"]
+    assert CartItems({"sku_0001" : 2}).items == {"sku_0001" : 2}
+    assert cart.to_xml().count("<Item ") == 2
+
+
+def test_value_types():
+    """
+    Inventory, AddressInfo and Quote should be compact, immutable
+    tuples that survive pickling, and quotes should still index like
+    (name, cost) pairs.
+    """
+    def assert_frozen(value, attr):
+        try:
+            setattr(value, attr, None)
+        except AttributeError:
+            pass
+        else:
+            assert False, "{0} was mutable".format(type(value).__name__)
+
+    inv = Inventory("sku_0001", 3)
+    assert Inventory() == (None, 0)
+    assert_frozen(inv, "quantity")
+    assert_frozen(inv, "extra")
+    assert inv._replace(quantity=4) == Inventory("sku_0001", 4)
+    assert pickle.loads(pickle.dumps(inv, 2)) == inv
+
+    addr = AddressInfo("Some Body", "12345 S Someplace Rd", "", "Duster",
+                       "IN", "United States", "47999", "123-4567", "")
+    assert_frozen(addr, "zipcode")
+    assert addr._replace(zipcode="47998").zipcode == "47998"
+    assert pickle.loads(pickle.dumps(addr, 2)) == addr
+
+    quote = Quote(SHIPPING["GD"], 12.5, "USD", "GD")
+    name, cost = quote
+    assert (name, cost) == (SHIPPING["GD"], 12.5)
+    assert quote[0] == SHIPPING["GD"] and quote[1] == 12.5
+    assert quote.cost == 12.5 and quote.currency == "USD"
+    assert_frozen(quote, "cost")
+    assert_frozen(quote, "currency")
+    assert_frozen(quote, "extra")
+    for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+        copy = pickle.loads(pickle.dumps(quote, protocol))
+        assert type(copy) == Quote
+        assert copy == quote and (copy.currency, copy.code) == ("USD", "GD")
+    assert quote._replace(cost=10.0) == \
+        Quote(SHIPPING["GD"], 10.0, "USD", "GD")
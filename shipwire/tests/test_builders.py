@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+
+from lxml import etree
+
+from shipwire.builders import *
+from shipwire.common import *
+
+
+def test_escaping():
+    """
+    Markup characters in names, addresses and skus should be escaped,
+    and unicode should come out as utf-8.
+    """
+    addr = AddressInfo(
+        u"Ren\xe9e & <Sons>",
+        "12345 S \"Someplace\" Rd",
+        "",
+        "Duster",
+        "IN",
+        "United States",
+        "47999",
+        "123-4567",
+        "nobody@donotreply.pleasedonotregisterthistld",
+    )
+    items = {"sku<1>&2" : 3}
+    request = order_request(
+        ("user&co", "p<ss", "Production"), 'order"1', "CHI", addr, "GD", items)
+    assert type(request) == str
+
+    root = etree.fromstring(request)
+    assert root.findtext("Username") == "user&co"
+    assert root.findtext("Password") == "p<ss"
+    order = root.find("Order")
+    assert order.attrib["id"] == 'order"1'
+    assert order.findtext("AddressInfo/Name/Full") == u"Ren\xe9e & <Sons>"
+    assert order.findtext("AddressInfo/Address1") == "12345 S \"Someplace\" Rd"
+    assert order.findtext("Item/Code") == "sku<1>&2"
+    assert order.findtext("Item/Quantity") == "3"
+
+
+def test_inventory_request():
+    """
+    Streamed and joined inventory requests should match, and list one
+    product code per sku.
+    """
+    credentials = ("user", "pass", "Test")
+    skus = ["sku_{0}".format(i) for i in range(100)] + ["a&b"]
+    parts = list(iter_inventory_request(credentials, "UK", skus))
+    request = inventory_request(credentials, "UK", skus)
+    assert "".join(parts) == request
+
+    root = etree.fromstring(request)
+    assert root.findtext("Warehouse") == "UK"
+    assert [code.text for code in root.iterfind("ProductCode")] == skus
+    assert root.find("IncludeEmpty") is not None
+
+
+def test_mixed_encodings():
+    """
+    Carts mixing unicode skus with utf-8 encoded ones should render
+    both as utf-8.
+    """
+    items = {u"caf\xe9" : 1, "caf\xc3\xa9x" : 2}
+    root = etree.fromstring("<Items>{0}</Items>".format(items_xml(items)))
+    codes = dict([(item.findtext("Code"), item.findtext("Quantity"))
+                  for item in root.iterfind("Item")])
+    assert codes == {u"caf\xe9" : "1", u"caf\xe9x" : "2"}
+    assert CartItems(items).to_xml() == items_xml(items)
+
+    skus = [u"caf\xe9", "caf\xc3\xa9x", "a&b"]
+    root = etree.fromstring(inventory_request(("u", "p", "Test"), "UK", skus))
+    assert [code.text for code in root.iterfind("ProductCode")] == \
+        [u"caf\xe9", u"caf\xe9x", "a&b"]
+
+
+def test_nul_rejected():
+    """
+    Values holding NUL, which can't appear in xml, should be rejected
+    rather than shift the values joined after them.
+    """
+    for items in [{"a\0b" : 1, "c" : 2}, {u"a\0b" : 1, "caf\xc3\xa9" : 2}]:
+        try:
+            items_xml(items)
+        except ValueError:
+            pass
+        else:
+            assert False, "NUL was let through"
+    try:
+        inventory_request(("u", "p", "Test"), "UK", ["a", "b\0", "c"])
+    except ValueError:
+        pass
+    else:
+        assert False, "NUL was let through"
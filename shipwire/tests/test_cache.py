@@ -0,0 +1,363 @@
+
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from shipwire.cache import *
+from shipwire.common import *
+from shipwire.test_api import *
+
+
+def check_cache(cache):
+    """
+    Exercises LRU eviction and expiry on a cache with room for three
+    entries.
+    """
+    for sku in ["sku_0001", "sku_0002", "sku_0003"]:
+        cache.set(sku, {"CHI" : sku})
+    assert cache.get("sku_0001") == {"CHI" : "sku_0001"}
+    # sku_0002 is now the least recently used, so it goes first
+    cache.set("sku_0004", {})
+    assert len(cache) == 3
+    assert cache.get("sku_0002") is None
+    assert cache.get("sku_0001") is not None
+
+    cache.delete("sku_0001")
+    assert cache.get("sku_0001") is None
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    assert cache.peek("sku_0003", max_stale=60)[1]
+    assert cache.peek("sku_0003", max_stale=0) is None
+    assert cache.sweep() == 2
+    assert len(cache) == 0
+
+
+def test_memory_cache():
+    """
+    Tests the in-process cache backend.
+    """
+    check_cache(MemoryCache(max_entries=3))
+
+
+def test_sqlite_cache():
+    """
+    Tests the sqlite cache backend.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        check_cache(SqliteCache(os.path.join(tmpdir, "cache.db"), max_entries=3))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_sqlite_batch_writes():
+    """
+    Batched writes should land together, and trimming the cache should
+    evict expired entries before the least recently used ones.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cache = SqliteCache(os.path.join(tmpdir, "cache.db"), max_entries=200)
+        cache.set_many([("old_{0}".format(i), i, 0) for i in range(20)])
+        cache.set("kept", "kept")
+        time.sleep(0.01)
+        cache.set_many([("sku_{0:04d}".format(i), {"CHI" : i}, None)
+                        for i in range(190)])
+        assert len(cache) == 191
+        assert cache.get("kept") == "kept"
+        assert cache.get("sku_0189") == {"CHI" : 189}
+
+        # 20 expired entries go first, then 11 of the batch, which was
+        # used least recently:
+        cache.set_many([("new_{0}".format(i), i, None) for i in range(20)])
+        assert len(cache) == 200
+        assert cache.get("kept") == "kept"
+        assert cache.get("sku_0189") == {"CHI" : 189}
+        assert cache.get("new_0") == 0
+        skus = [cache.get("sku_{0:04d}".format(i)) for i in range(190)]
+        assert skus.count(None) == 11
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def fill_shared_cache(path):
+    cache = SqliteCache(path)
+    inventory = Inventory("sku_0001", 7)
+    cache.set("sku_0001", {"CHI" : inventory})
+
+
+def test_sqlite_cache_between_processes():
+    """
+    Entries written by one process should be visible to another.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "cache.db")
+        cache = SqliteCache(path)
+        worker = multiprocessing.Process(target=fill_shared_cache, args=(path,))
+        worker.start()
+        worker.join()
+        assert worker.exitcode == 0
+        assert cache.get("sku_0001")["CHI"].quantity == 7
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_background_sweep():
+    """
+    The sweeper thread should drop expired entries that are never
+    read again.
+    """
+    cache = MemoryCache(ttl=0.01)
+    cache.set("sku_0001", {})
+    cache.start_sweeper(0.01)
+    try:
+        deadline = time.time() + 5
+        while len(cache) and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(cache) == 0
+    finally:
+        cache.close()
+
+
+def test_api_cache_settings():
+    """
+    The API should accept a cache backend, and cache_expire should
+    configure its TTL.
+    """
+    with LoremIpsumAPI("test_account", "test_password", "test") as api:
+        # room for DEFAULT_MAX_ENTRIES skus in every warehouse:
+        assert api.cache.max_entries == \
+            DEFAULT_MAX_ENTRIES * len(WAREHOUSE_CODES)
+
+    cache = MemoryCache(ttl=30, max_entries=2)
+    api = LoremIpsumAPI("test_account", "test_password", "test", cache=cache)
+    assert api.cache_expire == 30
+    api.cache_expire = 60
+    assert cache.ttl == 60
+
+    api.inventory_lookup(["sku_0001", "sku_0002", "sku_0003"])
+    assert len(cache) == 2
+    api.close()
+
+
+class CountingLoremIpsumAPI(LoremIpsumAPI):
+    """
+    LoremIpsumAPI with a slow backend that records every lookup.
+    """
+    def __init__(self, *args, **kargs):
+        LoremIpsumAPI.__init__(self, *args, **kargs)
+        self.lookups = []
+
+    def _inventory_lookup(self, sku_set, warehouses=None):
+        self.lookups.append(sorted(sku_set))
+        time.sleep(0.2)
+        return LoremIpsumAPI._inventory_lookup(self, sku_set, warehouses)
+
+
+def test_coalesced_lookups():
+    """
+    Concurrent cache misses for overlapping SKUs should share one
+    backend request.
+    """
+    api = CountingLoremIpsumAPI("test_account", "test_password", "test")
+    results = []
+    def lookup(sku_list):
+        results.append(api.inventory_lookup(sku_list, True))
+
+    first = threading.Thread(target=lookup, args=(["sku_0001", "sku_0002"],))
+    first.start()
+    time.sleep(0.05)
+    others = [threading.Thread(target=lookup, args=(skus,)) for skus in [
+        ["sku_0001"], ["sku_0002", "sku_0001"], ["sku_0002", "sku_0003"]]]
+    for thread in others:
+        thread.start()
+    for thread in [first] + others:
+        thread.join()
+
+    assert api.lookups == [["sku_0001", "sku_0002"], ["sku_0003"]]
+    assert api.stats["coalesced"] == 3
+    assert len(results) == 4
+    for result in results:
+        for sku, data in result.items():
+            assert data["UK"].code == sku
+    api.close()
+
+
+def test_stale_while_revalidate():
+    """
+    Expired entries should be served immediately and refreshed in the
+    background.
+    """
+    api = CountingLoremIpsumAPI("test_account", "test_password", "test")
+    api.stale_while_revalidate = True
+    db = BS_PRODUCT_DATABASE
+    sku = "sku_0001"
+
+    api.inventory_lookup(sku, True)
+    api.cache_expire = 0
+    try:
+        db[sku]["stock_info"]["CHI"] = 4
+        start = time.time()
+        stale = api.inventory_lookup(sku, True)[sku]["CHI"].quantity
+        assert time.time() - start < 0.1
+        assert stale == 10
+        assert api.stats["stale_served"] == 1
+
+        deadline = time.time() + 5
+        while not api.stats["refreshed"] and time.time() < deadline:
+            time.sleep(0.01)
+        assert api.stats["refreshed"] == 1
+        assert api.cache.peek((sku, "CHI"))[0].quantity == 4
+    finally:
+        db[sku]["stock_info"]["CHI"] = 10
+        api.close()
+
+
+class FlakyLoremIpsumAPI(CountingLoremIpsumAPI):
+    """
+    LoremIpsumAPI which, like Shipwire, leaves unknown SKUs out of its
+    replies, and whose UK warehouse can be made to fail.
+    """
+    uk_down = False
+
+    def _inventory_lookup(self, sku_set, warehouses=None):
+        self.lookups.append((sorted(sku_set), warehouses))
+        report = LoremIpsumAPI._inventory_lookup(self, sku_set, warehouses)
+        for warehouse, inv_list in report.items():
+            report[warehouse] = [inv for inv in inv_list
+                                 if BS_PRODUCT_DATABASE.has_key(inv.code)]
+        if self.uk_down and report.has_key("UK"):
+            del report["UK"]
+            raise PartialInventoryError(report, {"UK" : IOError("timeout")})
+        return report
+
+
+def test_max_stale():
+    """
+    Failed background refreshes should be counted, and entries which
+    expired more than max_stale seconds ago should not be served.
+    """
+    api = FlakyLoremIpsumAPI("test_account", "test_password", "test")
+    api.stale_while_revalidate = True
+    sku = "sku_0001"
+
+    api.inventory_lookup(sku, True)
+    api.cache_expire = 0
+    try:
+        api.uk_down = True
+        api.inventory_lookup(sku, True)
+        assert api.stats["stale_served"] == 1
+
+        deadline = time.time() + 5
+        while not api.stats["refresh_failed"] and time.time() < deadline:
+            time.sleep(0.01)
+        assert api.stats["refresh_failed"] == 1
+        assert api.stats["refreshed"] == 0
+
+        api.uk_down = False
+        api.max_stale = 0
+        time.sleep(0.01)
+        del api.lookups[:]
+        api.inventory_lookup(sku, True)
+        assert api.stats["stale_served"] == 1
+        assert [skus for skus, warehouses in api.lookups] == [[sku]]
+    finally:
+        api.close()
+
+
+def test_negative_caching():
+    """
+    SKUs which no warehouse lists should be cached as such, with their
+    own expiry.
+    """
+    api = FlakyLoremIpsumAPI("test_account", "test_password", "test")
+    api.negative_cache_expire = 0.2
+    assert api.inventory_lookup(["retired_sku", "sku_0001"], True).keys() \
+        == ["sku_0001"]
+    assert api.inventory_lookup(["retired_sku", "sku_0001"], True).keys() \
+        == ["sku_0001"]
+    assert api.get_availability("retired_sku") == ()
+    assert len(api.lookups) == 1
+
+    time.sleep(0.25)
+    api.inventory_lookup(["retired_sku", "sku_0001"], True)
+    assert api.lookups[-1] == (["retired_sku"], tuple(sorted(WAREHOUSE_CODES)))
+    api.close()
+
+
+def test_partial_failure_caching():
+    """
+    When one warehouse fails, the others' answers should be kept, and
+    only the failed warehouse asked again.
+    """
+    api = FlakyLoremIpsumAPI("test_account", "test_password", "test")
+    api.uk_down = True
+    try:
+        api.inventory_lookup(["sku_0001"], True)
+    except PartialInventoryError as error:
+        assert error.errors.keys() == ["UK"]
+        assert error.report["CHI"][0].quantity == 10
+    else:
+        assert False, "partial failure was swallowed"
+
+    api.uk_down = False
+    result = api.inventory_lookup(["sku_0001"], True)
+    assert api.lookups[-1] == (["sku_0001"], ("UK",))
+    assert result["sku_0001"]["UK"].quantity == 1
+    assert result["sku_0001"]["CHI"].quantity == 10
+    api.close()
+
+
+def test_quote_cache():
+    """
+    Repeated quotes for the same cart, warehouse and destination should
+    be served from the quote cache, however the destination is spelled,
+    within the cache's TTL and size bounds.
+    """
+    quoted = []
+    class QuotedLoremIpsumAPI(LoremIpsumAPI):
+        def _get_single_cart_quotes(self, ship_address, warehouse, cart):
+            quoted.append(warehouse)
+            return LoremIpsumAPI._get_single_cart_quotes(
+                self, ship_address, warehouse, cart)
+
+    cache = MemoryCache(ttl=30, max_entries=2)
+    api = QuotedLoremIpsumAPI(
+        "test_account", "test_password", "test", quote_cache=cache)
+    addr = AddressInfo("Some Body", "12345 S Someplace Rd", "", "Duster",
+                       "IN", "United States", "47999", "123-4567", "")
+    split_cart = SplitCart()
+    split_cart.add_cart("CHI", CartItems({"sku_0001" : 2}))
+
+    first = api.get_shipping_options(addr, split_cart)
+    again = api.get_shipping_options(addr._replace(
+        name="Another Body", state=" in", country="usa", zipcode="47999-1234"),
+        split_cart)
+    assert quoted == ["CHI"]
+    assert again == first
+    assert api.stats["quote_hits"] == 1
+    assert api.stats["quote_misses"] == 1
+
+    # a different quantity or postcode is a different quote:
+    split_cart.add_cart("CHI", CartItems({"sku_0001" : 3}))
+    api.get_shipping_options(addr, split_cart)
+    api.get_shipping_options(addr._replace(zipcode="47998"), split_cart)
+    assert quoted == ["CHI"] * 3
+    assert len(cache) == 2
+
+    cache.ttl = 0
+    time.sleep(0.01)
+    api.get_shipping_options(addr, split_cart)
+    assert quoted == ["CHI"] * 4
+
+    api.cache_quotes = False
+    api.get_shipping_options(addr, split_cart)
+    assert quoted == ["CHI"] * 5
+    assert api.stats["quote_misses"] == 4
+    api.close()
@@ -0,0 +1,137 @@
+
+
+import threading
+import time
+
+from shipwire.executor import *
+
+
+def test_submit_result():
+    """
+    Results and exceptions raised by submitted calls should reach the
+    caller through the Future.
+    """
+    with WorkerPool(2) as pool:
+        assert pool.submit(lambda x, y: x + y, 2, y=3).result() == 5
+
+        def explode():
+            raise KeyError("sku_0001")
+        future = pool.submit(explode)
+        try:
+            future.result()
+        except KeyError:
+            pass
+        else:
+            assert False, "exception was swallowed"
+        assert type(future.exception()) == KeyError
+
+
+def test_timeout_and_cancel():
+    """
+    Timing out while waiting shouldn't disturb the call, and queued
+    calls can be cancelled before they start.
+    """
+    gate = threading.Event()
+    ran = []
+    with WorkerPool(1) as pool:
+        blocker = pool.submit(gate.wait)
+        queued = pool.submit(ran.append, "queued")
+
+        try:
+            blocker.result(timeout=0.01)
+        except Timeout:
+            pass
+        else:
+            assert False, "result() did not time out"
+        assert not blocker.done()
+
+        assert queued.cancel()
+        try:
+            queued.result()
+        except Cancelled:
+            pass
+        else:
+            assert False, "cancelled future returned a result"
+
+        gate.set()
+        blocker.result(timeout=5)
+    assert ran == []
+
+
+def test_map_and_stats():
+    """
+    WorkerPool.map should preserve order, surface exceptions, and keep
+    its metrics up to date.
+    """
+    with WorkerPool(3) as pool:
+        assert pool.map(lambda x: x * 2, range(10)) == range(0, 20, 2)
+
+        # the failure comes last, so that no call is cancelled behind it
+        def check(x):
+            if x == 5:
+                raise ValueError(x)
+            return x
+        try:
+            pool.map(check, range(6))
+        except ValueError:
+            pass
+        else:
+            assert False, "exception was swallowed"
+
+    # the pool has shut down, so every call has been counted
+    stats = pool.stats()
+    assert stats["workers"] == 3
+    assert stats["in_flight"] == 0
+    assert stats["queue_depth"] == 0
+    assert stats["failed"] == 1
+    assert stats["completed"] == 15
+
+
+def test_map_from_worker():
+    """
+    Calling map from inside one of the pool's workers shouldn't
+    deadlock, even when the pool has a single thread.
+    """
+    with WorkerPool(1) as pool:
+        nested = pool.submit(pool.map, lambda x: x + 1, [1, 2, 3])
+        assert nested.result(timeout=5) == [2, 3, 4]
+
+
+def test_map_timeout():
+    """
+    Calls that don't start before the deadline should be cancelled.
+    """
+    gate = threading.Event()
+    ran = []
+    def work(x):
+        if x == 0:
+            gate.wait()
+        else:
+            ran.append(x)
+    pool = WorkerPool(1)
+    try:
+        pool.map(work, [0, 1, 2], timeout=0.05)
+    except Timeout:
+        pass
+    else:
+        assert False, "map did not time out"
+    gate.set()
+    pool.shutdown()
+    assert ran == []
+
+
+def test_idle_workers_exit():
+    """
+    With an idle_timeout, workers should exit once there is nothing to
+    do, and be started again when work arrives.
+    """
+    pool = WorkerPool(3, idle_timeout=0.05)
+    assert pool.map(lambda x: x * 2, range(6)) == range(0, 12, 2)
+    deadline = time.time() + 5
+    while pool.stats()["workers"] and time.time() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()["workers"] == 0
+
+    assert pool.submit(lambda: "again").result(timeout=5) == "again"
+    pool.shutdown()
+    assert pool.stats()["completed"] == 7
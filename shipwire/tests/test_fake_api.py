@@ -1,43 +1,126 @@
 
 
+import copy
+import threading
 import time
 
+import pytest
+
 from shipwire.test_api import *
 from shipwire.common import *
+from shipwire.executor import Timeout
+
+
+class BlockingAsyncLoremIpsumAPI(object):
+    """
+    Sync facade over AsyncLoremIpsumAPI, which waits on the Future
+    returned by each of its public methods, so that the tests in this
+    module run against both the sync and async APIs.  Like the async
+    API, it keeps the wrapped LoremIpsumAPI as its 'api' attribute.
+    """
+
+    def __init__(self, *args, **kargs):
+        self.async_api = AsyncLoremIpsumAPI(*args, **kargs)
+        self.api = self.async_api.api
+
+    def close(self):
+        self.async_api.close()
+
+    def _wait(self, future):
+        return future.result(timeout=10)
+
+    def get_availability(self, *args, **kargs):
+        return self._wait(self.async_api.get_availability(*args, **kargs))
+
+    def inventory_lookup(self, *args, **kargs):
+        return self._wait(self.async_api.inventory_lookup(*args, **kargs))
+
+    def optimal_order_splitting(self, *args, **kargs):
+        return self._wait(
+            self.async_api.optimal_order_splitting(*args, **kargs))
+
+    def cost_order_splitting(self, *args, **kargs):
+        return self._wait(self.async_api.cost_order_splitting(*args, **kargs))
+
+    def batch_order_splitting(self, *args, **kargs):
+        return self._wait(
+            self.async_api.batch_order_splitting(*args, **kargs))
+
+    def get_shipping_options(self, *args, **kargs):
+        return self._wait(self.async_api.get_shipping_options(*args, **kargs))
+
+    def place_order(self, *args, **kargs):
+        return self._wait(self.async_api.place_order(*args, **kargs))
+
+    @property
+    def cache_expire(self):
+        return self.api.cache_expire
+
+    @cache_expire.setter
+    def cache_expire(self, value):
+        self.api.cache_expire = value
+
+
+@pytest.fixture(params=[LoremIpsumAPI, BlockingAsyncLoremIpsumAPI])
+def api_class(request):
+    """
+    Makes instances of the API class under test, which are closed
+    after each test.
+    """
+    apis = []
+    def make(*args, **kargs):
+        api = request.param(*args, **kargs)
+        apis.append(api)
+        return api
+    yield make
+    for api in apis:
+        api.close()
+
+
+@pytest.fixture(autouse=True)
+def product_database():
+    """
+    Restores the fake product database, which some tests edit, after
+    each test.
+    """
+    saved = copy.deepcopy(BS_PRODUCT_DATABASE)
+    yield BS_PRODUCT_DATABASE
+    BS_PRODUCT_DATABASE.clear()
+    BS_PRODUCT_DATABASE.update(saved)
 
 
-def test_fake_api_auth():
+def test_fake_api_auth(api_class):
     """
     Test to be sure LoremIpsumAPI implements fake auth of some kind.
     """
     # should pass
-    LoremIpsumAPI("test_account", "test_password", "test")
+    api_class("test_account", "test_password", "test")
     fails = 0
     try:
         # should fail
-        LoremIpsumAPI("OEUHNOETCHU", "test_password", "test")
+        api_class("OEUHNOETCHU", "test_password", "test")
     except:
         fails += 1
     try:
         # should fail
-        LoremIpsumAPI("test_account", "OEUHNOETCHU", "test")
+        api_class("test_account", "OEUHNOETCHU", "test")
     except:
         fails += 1
     try:
         # should fail
-        LoremIpsumAPI("test_account", "test_password", "OEUHNOETCHU")
+        api_class("test_account", "test_password", "OEUHNOETCHU")
     except:
         fails += 1
     assert fails == 3
 
 
-def test_bs_inventory_lookup():
+def test_bs_inventory_lookup(api_class):
     """
     Tests the inventory_for_warehouse call by calling
     inventory_lookup.
     """
     
-    api = LoremIpsumAPI("test_account", "test_password", "test")
+    api = api_class("test_account", "test_password", "test")
     db = BS_PRODUCT_DATABASE
 
     sku_list = db.keys() + ["fake_sku"]
@@ -65,12 +148,12 @@ def test_bs_inventory_lookup():
                     assert entry.quantity == 0
 
 
-def test_get_availability():
+def test_get_availability(api_class):
     """
     Tests country availability wrapper function.
     """
 
-    api = LoremIpsumAPI("test_account", "test_password", "test")
+    api = api_class("test_account", "test_password", "test")
     db = BS_PRODUCT_DATABASE
 
     avail = api.get_availability("sku_0001")
@@ -79,12 +162,12 @@ def test_get_availability():
     assert len(avail) == 2
     
 
-def test_cache_invalidation():
+def test_cache_invalidation(api_class):
     """
     Tests caching for inventory lookups.
     """
     
-    api = LoremIpsumAPI("test_account", "test_password", "test")
+    api = api_class("test_account", "test_password", "test")
     db = BS_PRODUCT_DATABASE
     sku = "sku_0001"
     db_record = db[sku]
@@ -107,11 +190,11 @@ def test_cache_invalidation():
     assert fourth == 3
     
 
-def test_get_shipping_options():
+def test_get_shipping_options(api_class):
     """
     Test the get_shipping_options method.
     """
-    api = LoremIpsumAPI("test_account", "test_password", "test")
+    api = api_class("test_account", "test_password", "test")
     cart = CartItems(["sku_0002", "sku_0002", "sku_0003"])
     addr = AddressInfo(
         "Some Body",
@@ -141,14 +224,89 @@ def test_get_shipping_options():
         for value in split_opt.values():
             assert type(value[0]) == str
             assert type(value[1]) == float
+            name, cost = value
+            assert (name, cost) == (value.name, value.cost)
     
 
-def test_place_order():
+def test_partial_shipping_options(api_class):
+    """
+    Warehouses should be quoted concurrently, and a failed or late
+    warehouse shouldn't spoil the quotes for the others.
+    """
+    api = api_class("test_account", "test_password", "test")
+    backend = getattr(api, "api", api)
+    cart = CartItems(["sku_0001"])
+    addr = AddressInfo(
+        "Some Body",
+        "12345 S Someplace Rd",
+        "",
+        "Duster",
+        "IN",
+        "United States",
+        "47999",
+        "123-4567",
+        "nobody@donotreply.pleasedonotregisterthistld",
+    )
+
+    # CHI, LAX and PHL each hold on until all three are in flight, so
+    # they only come back if they were quoted concurrently, while TOR
+    # holds on until after the deadline.
+    lock = threading.Lock()
+    calls = {"in_flight" : 0, "peak" : 0}
+    all_in_flight = threading.Event()
+    tor_released = threading.Event()
+
+    def gated_quotes(ship_address, warehouse, cart):
+        if warehouse == "UK":
+            raise IOError("connection reset")
+        elif warehouse == "TOR":
+            tor_released.wait(10)
+        else:
+            with lock:
+                calls["in_flight"] += 1
+                calls["peak"] = max(calls["peak"], calls["in_flight"])
+                if calls["in_flight"] == 3:
+                    all_in_flight.set()
+            all_in_flight.wait(10)
+            with lock:
+                calls["in_flight"] -= 1
+        return LoremIpsumAPI._get_single_cart_quotes(
+            backend, ship_address, warehouse, cart)
+    backend._get_single_cart_quotes = gated_quotes
+
+    split_cart = SplitCart()
+    for warehouse in ["CHI", "LAX", "PHL", "TOR", "UK"]:
+        split_cart.add_cart(warehouse, cart)
+
+    try:
+        opts = api.get_shipping_options(addr, split_cart, 1.0)
+    finally:
+        tor_released.set()
+    assert calls["peak"] == 3
+    assert sorted(opts.keys()) == ["CHI", "LAX", "PHL"]
+    assert sorted(opts.errors.keys()) == ["TOR", "UK"]
+    assert type(opts.errors["UK"]) == IOError
+    assert type(opts.errors["TOR"]) == Timeout
+
+    # with one request at a time, they never overlap (the quotes from
+    # above are cached, so start afresh)
+    backend.quote_cache.clear()
+    calls["peak"] = 0
+    split_cart = SplitCart()
+    for warehouse in ["CHI", "LAX", "PHL"]:
+        split_cart.add_cart(warehouse, cart)
+    opts = api.get_shipping_options(addr, split_cart, 10, 1)
+    assert calls["peak"] == 1
+    assert sorted(opts.keys()) == ["CHI", "LAX", "PHL"]
+    assert not opts.errors
+
+
+def test_place_order(api_class):
     """
     Test the mechanism for placing fake orders.
     """
 
-    api = LoremIpsumAPI("test_account", "test_password", "test")
+    api = api_class("test_account", "test_password", "test")
     db = BS_PRODUCT_DATABASE
     cart = CartItems(["sku_0002", "sku_0002", "sku_0003"])
     warehouse = "PHL"
@@ -168,12 +326,77 @@ def test_place_order():
     acknowledgement = api.place_order(addr, split_cart, {warehouse:"GD"})
 
 
-def test_order_splitting():
+def test_place_split_order(api_class):
+    """
+    Each warehouse's order should be placed concurrently, under its
+    own correlated id, with failures reported per warehouse.
+    """
+    api = api_class("test_account", "test_password", "test")
+    backend = getattr(api, "api", api)
+    addr = AddressInfo(
+        "Some Body",
+        "12345 S Someplace Rd",
+        "",
+        "Duster",
+        "IN",
+        "United States",
+        "47999",
+        "123-4567",
+        "nobody@donotreply.pleasedonotregisterthistld",
+    )
+
+    # each order waits for the other two to arrive before going ahead,
+    # which only happens if they are placed concurrently
+    arrived = threading.Condition()
+    waiting = ["CHI", "PHL", "UK"]
+
+    def place(order_number, ship_address, warehouse, cart, ship_method):
+        with arrived:
+            waiting.remove(warehouse)
+            arrived.notify_all()
+            deadline = time.time() + 10
+            while waiting and time.time() < deadline:
+                arrived.wait(deadline - time.time())
+            if waiting:
+                raise AssertionError("orders weren't placed concurrently")
+        time.sleep(0.2)
+        if warehouse == "UK":
+            raise IOError("connection reset")
+        return LoremIpsumAPI._place_single_cart_order(
+            backend, order_number, ship_address, warehouse, cart,
+            ship_method)
+    backend._place_single_cart_order = place
+
+    split_cart = SplitCart()
+    split_cart.add_cart("CHI", CartItems(["sku_0001"]))
+    split_cart.add_cart("PHL", CartItems(["sku_0002", "sku_0003"]))
+    split_cart.add_cart("UK", CartItems(["sku_0003"]))
+    methods = {"CHI" : "GD", "PHL" : "GD", "UK" : "INTL"}
+
+    results = api.place_order(addr, split_cart, methods, "order-1234")
+    assert not waiting
+
+    assert sorted(results.keys()) == ["CHI", "PHL", "UK"]
+    for warehouse in ["CHI", "PHL"]:
+        result = results[warehouse]
+        assert result.ok
+        assert result.warehouse == warehouse
+        assert result.order_id == "order-1234-" + warehouse
+        assert result.order_number == result.order_id
+        assert result.status == "accepted"
+        assert result.transaction_id == "fake_transaction_id"
+        assert result.latency >= 0.2
+    assert not results["UK"].ok
+    assert type(results["UK"].error) == IOError
+    assert results["UK"].status is None
+
+
+def test_order_splitting(api_class):
     """
     Test the mechanism for splitting a cart into separate orders.
     """
 
-    api = LoremIpsumAPI("test_account", "test_password", "test")
+    api = api_class("test_account", "test_password", "test")
     db = BS_PRODUCT_DATABASE
 
     addr = AddressInfo(
@@ -199,13 +422,13 @@ def test_order_splitting():
     assert split.has_key("UK") == False
 
 
-def test_ugly_order_splitting():
+def test_ugly_order_splitting(api_class):
     """
     Test splitting when a quantity of an item can be filled by two
     warehouses, but not by any individual warehouse.
     """
 
-    api = LoremIpsumAPI("test_account", "test_password", "test")
+    api = api_class("test_account", "test_password", "test")
     db = BS_PRODUCT_DATABASE
 
     addr = AddressInfo(
@@ -241,3 +464,86 @@ def test_ugly_order_splitting():
     assert len(split.keys()) == 2
     assert split.has_key("PHL")
     assert split.has_key("UK")
+
+
+def test_cost_order_splitting(api_class):
+    """
+    Cost-aware splitting should pick the split with the cheapest
+    quotes, even when it has more shipments, and count its quotes.
+    """
+    api = api_class("test_account", "test_password", "test")
+    backend = getattr(api, "api", api)
+    # make a single UK shipment the best split by shipment count:
+    backend.intl_shipment_weight = 1
+    addr = AddressInfo(
+        "Some Body",
+        "12345 S Someplace Rd",
+        "",
+        "Duster",
+        "IN",
+        "United States",
+        "47999",
+        "123-4567",
+        "nobody@donotreply.pleasedonotregisterthistld",
+    )
+    cart = CartItems(["sku_0001", "sku_0002", "sku_0003"])
+
+    split_cart, remainder = api.optimal_order_splitting(addr, cart)
+    assert split_cart.order_split.keys() == ["UK"]
+
+    costed = api.cost_order_splitting(addr, cart, "express")
+    assert sorted(costed.split_cart.order_split.keys()) == ["CHI", "PHL"]
+    assert costed.remainder == {}
+    assert costed.methods == {"CHI" : "1D", "PHL" : "1D"}
+    assert costed.costs == {"CHI" : 30.0, "PHL" : 60.0}
+    assert costed.total == 90.0
+    assert costed.quote_calls == 3
+
+
+def test_batch_order_splitting(api_class):
+    """
+    Carts split in a batch should share one inventory lookup, and
+    shouldn't be promised the same stock twice.
+    """
+    api = api_class("test_account", "test_password", "test")
+    backend = getattr(api, "api", api)
+    lookups = []
+    def counting_lookup(sku_set, warehouses=None):
+        lookups.append(sorted(sku_set))
+        return LoremIpsumAPI._inventory_lookup(backend, sku_set, warehouses)
+    backend._inventory_lookup = counting_lookup
+
+    orders = []
+    for name in ["First", "Second", "Third"]:
+        addr = AddressInfo(
+            name,
+            "12345 S Someplace Rd",
+            "",
+            "Duster",
+            "IN",
+            "United States",
+            "47999",
+            "123-4567",
+            "nobody@donotreply.pleasedonotregisterthistld",
+        )
+        cart = CartItems()
+        cart.add_item("sku_0002", 2)
+        orders.append((addr, cart))
+    orders[2][1].add_item("sku_0004", 1)
+
+    # sku_0002 is stocked as "PHL" : 2, "UK" : 1
+    results = api.batch_order_splitting(orders)
+    assert lookups == [["sku_0002", "sku_0004"]]
+    assert results[0][0].order_split.keys() == ["PHL"]
+    assert results[0][1] == {}
+    assert results[1][0].order_split.keys() == ["UK"]
+    assert results[1][1] == {"sku_0002" : 1}
+    assert results[2][0].order_split.keys() == ["TOR"]
+    assert results[2][1] == {"sku_0002" : 2}
+
+    # with the third order served first, the second one gets nothing:
+    results = api.batch_order_splitting(
+        orders, lambda order: order[0].name != "Third")
+    assert sorted(results[2][0].order_split.keys()) == ["PHL", "TOR"]
+    assert results[0][1] == {"sku_0002" : 1}
+    assert results[1][1] == {"sku_0002" : 2}
@@ -0,0 +1,124 @@
+from shipwire.instrumentation import *
+from shipwire.ratelimit import MemoryRateLimiter
+from shipwire.shipwire_api import *
+from benchmarks.stub_server import StubServer
+
+
+RATE_RESPONSE = """
+<RateResponse>
+  <Status>OK</Status>
+  <Order><Quotes>
+    <Quote method="GD"><Cost currency="USD">12.50</Cost></Quote>
+  </Quotes></Order>
+</RateResponse>
+""".strip()
+
+
+def test_histogram():
+    """
+    Histograms should count observations into cumulative buckets.
+    """
+    histogram = Histogram((1, 5))
+    for value in [0.5, 1, 3, 10]:
+        histogram.observe(value)
+    assert histogram.cumulative() == [(1, 2), (5, 3), ("+Inf", 4)]
+    assert histogram.sum == 14.5
+    assert histogram.count == 4
+
+
+def test_call_instrumentation():
+    """
+    Calls through ShipwireAPI should be reported with their sizes,
+    timings, retries and cache lookups.
+    """
+    replies = []
+    def inventory(api_uri_part, body):
+        replies.append(body)
+        if len(replies) == 1:
+            return 503, "Service Unavailable"
+        return '<InventoryUpdateResponse><Product code="sku_0001" ' \
+            'quantity="4"/></InventoryUpdateResponse>'
+
+    events = []
+    class Recorder(HistogramCollector):
+        def on_call(self, event):
+            events.append(event)
+            HistogramCollector.on_call(self, event)
+
+    collector = Recorder()
+    responses = {"InventoryServices.php" : inventory,
+                 "RateServices.php" : RATE_RESPONSE}
+    with StubServer(responses) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url) as api:
+            api.instrumentation = collector
+            api.transport.backoff = 0.01
+            api.inventory_lookup(["sku_0001"], estimate_ok=True)
+
+            addr = AddressInfo("Some Body", "12345 S Someplace Rd", "",
+                               "Duster", "IN", "United States", "47999",
+                               "123-4567", "")
+            split_cart = SplitCart()
+            split_cart.add_cart("CHI", CartItems({"sku_0001" : 1}))
+            for i in range(2):
+                api.get_shipping_options(addr, split_cart)
+
+    assert len(events) == len(WAREHOUSE_CODES) + 1
+    for event in events:
+        assert event.ok
+        assert event.request_bytes > 0 and event.response_bytes > 0
+        assert event.network_time > 0
+        assert event.total_time >= event.network_time
+    assert sum([event.retries for event in events]) == 1
+    assert sorted([event.warehouse for event in events]) == \
+        sorted(WAREHOUSE_CODES + ("CHI",))
+    assert events[-1].response_bytes == len(RATE_RESPONSE)
+
+    network = collector.histogram(
+        "shipwire_call_duration_seconds", endpoint="RateServices.php",
+        warehouse="CHI", phase="network")
+    assert network.count == 1
+    assert collector.counter("shipwire_calls_total",
+                             endpoint="InventoryServices.php",
+                             outcome="ok") == len(WAREHOUSE_CODES)
+    assert collector.counter("shipwire_call_retries_total",
+                             endpoint="InventoryServices.php") == 1
+    assert collector.counter("shipwire_cache_lookups_total",
+                             cache="inventory", result="miss") == \
+        len(WAREHOUSE_CODES)
+    assert collector.counter("shipwire_cache_lookups_total",
+                             cache="quote", result="hit") == 1
+
+    text = collector.render()
+    assert "# TYPE shipwire_call_duration_seconds histogram" in text
+    assert 'shipwire_calls_total{endpoint="RateServices.php",' \
+        'outcome="ok"} 1' in text
+    assert 'phase="network",warehouse="CHI",le="+Inf"} 1' in text
+
+
+def test_throttle_time():
+    """
+    Time spent waiting for the rate limiter should be reported as
+    throttle time, not blamed on the network.
+    """
+    events = []
+    class Recorder(Instrumentation):
+        def on_call(self, event):
+            events.append(event)
+
+    limiter = MemoryRateLimiter(rate=10, burst=1)
+    responses = {"RateServices.php" : RATE_RESPONSE}
+    with StubServer(responses) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url, rate_limiter=limiter) as api:
+            api.instrumentation = Recorder()
+            for i in range(2):
+                api.post_and_fetch("<RateRequest/>", "RateServices.php")
+                api._call("RateServices.php", "CHI",
+                          lambda: "<RateRequest/>", lambda reply: None)
+
+    assert len(events) == 4
+    for event in events[1:]:
+        assert event.throttle_time >= 0.08
+        assert event.network_time < 0.05
+        assert event.total_time >= event.throttle_time + event.network_time
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+
+from shipwire.parsing import *
+
+
+INVENTORY_REPLY = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE InventoryUpdateResponse SYSTEM "http://www.shipwire.com/exec/download/InventoryUpdateResponse.dtd">
+<InventoryUpdateResponse>
+  <Status>0</Status>
+  <Product code="fake_sku_0001" quantity="2" pending="0" good="2"/>
+  <Product code="fake_sku_0002" quantity="7" pending="0" good="7"/>
+  <Product code="caf\xc3\xa9_sku" quantity="0" pending="0" good="0"/>
+  <TotalProducts>3</TotalProducts>
+</InventoryUpdateResponse>
+"""
+
+
+def test_iter_inventory():
+    """
+    Products should be parsed the same however the reply arrives.
+    """
+    expected = [("fake_sku_0001", 2), ("fake_sku_0002", 7),
+                (u"caf\xe9_sku", 0)]
+    pieces = [INVENTORY_REPLY[i:i+7] for i in range(0, len(INVENTORY_REPLY), 7)]
+    for source in [INVENTORY_REPLY, INVENTORY_REPLY.decode("utf-8"), pieces]:
+        parsed = [(inv.code, inv.quantity) for inv in iter_inventory(source)]
+        assert parsed == expected
+
+
+def test_iter_inventory_errors():
+    """
+    Replies which aren't inventory, or are cut short, should raise.
+    """
+    try:
+        list(iter_inventory("<RateResponse><Status>OK</Status></RateResponse>"))
+    except ValueError:
+        pass
+    else:
+        assert False, "wrong reply was accepted"
+
+    try:
+        list(iter_inventory(INVENTORY_REPLY[:300]))
+    except etree.XMLSyntaxError:
+        pass
+    else:
+        assert False, "truncated reply was accepted"
@@ -0,0 +1,127 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from shipwire.ratelimit import *
+from shipwire.shipwire_api import *
+from benchmarks.stub_server import StubServer
+
+
+def check_limiter(limiter):
+    """
+    Exercises a limiter allowing 20 requests per second, in bursts of
+    up to two, which rejects waits longer than 0.2 seconds.
+    """
+    key = ("account", "RateServices.php")
+    start = time.time()
+    assert limiter.acquire(key) == 0
+    assert limiter.acquire(key) == 0
+    # the bucket is empty, so these queue for the next tokens:
+    limiter.acquire(key)
+    limiter.acquire(key)
+    assert 0.08 < time.time() - start < 0.2
+    assert limiter.stats["queued"] == 2
+
+    # other keys have buckets of their own:
+    assert limiter.acquire(("account", "InventoryServices.php")) == 0
+
+    # a burst of concurrent requests queues up to the max wait, and
+    # the rest are rejected:
+    time.sleep(0.1)
+    rejected = []
+    def request():
+        try:
+            limiter.acquire(key)
+        except RateLimited:
+            rejected.append(True)
+    threads = [threading.Thread(target=request) for i in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 2 <= len(rejected) <= 4
+    assert limiter.stats["rejected"] == len(rejected)
+    assert limiter.stats["max_wait_time"] <= 0.2
+
+
+def test_memory_limiter():
+    check_limiter(MemoryRateLimiter(rate=20, burst=2, max_wait=0.2))
+
+
+def test_sqlite_limiter():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        check_limiter(SqliteRateLimiter(
+            os.path.join(tmpdir, "limits.db"), rate=20, burst=2,
+            max_wait=0.2))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def drain_bucket(path):
+    limiter = SqliteRateLimiter(path, rate=2, burst=3)
+    for i in range(3):
+        limiter.acquire(("account", "RateServices.php"))
+
+
+def test_sqlite_limiter_between_processes():
+    """
+    Tokens taken by one process should be gone for another.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "limits.db")
+        worker = multiprocessing.Process(target=drain_bucket, args=(path,))
+        worker.start()
+        worker.join()
+        limiter = SqliteRateLimiter(path, rate=2, burst=3, max_wait=0.1)
+        try:
+            limiter.acquire(("account", "RateServices.php"))
+        except RateLimited:
+            pass
+        else:
+            assert False, "bucket wasn't shared"
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_api_rate_limit():
+    """
+    ShipwireAPI should queue its requests on the rate limiter, per
+    account and endpoint.
+    """
+    def echo(api_uri_part, body):
+        return "<InventoryUpdateResponse/>"
+    limiter = MemoryRateLimiter(
+        limits={"InventoryServices.php" : (10, 1)})
+    with StubServer({"InventoryServices.php" : echo}) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url, rate_limiter=limiter) as api:
+            start = time.time()
+            api._inventory_lookup(["sku_0001"], ("CHI", "LAX", "PHL"))
+            assert time.time() - start >= 0.18
+    assert limiter.stats["acquired"] == 3
+    assert limiter.stats["queued"] == 2
+
+
+def test_retries_are_rate_limited():
+    """
+    Requests the transport retries should take tokens of their own.
+    """
+    replies = []
+    def flaky(api_uri_part, body):
+        replies.append(body)
+        if len(replies) == 1:
+            return 503, "Service Unavailable"
+        return "<InventoryUpdateResponse/>"
+    limiter = MemoryRateLimiter(rate=100, burst=10)
+    with StubServer({"InventoryServices.php" : flaky}) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url, rate_limiter=limiter) as api:
+            api.transport.backoff = 0.01
+            api._inventory_lookup(["sku_0001"], ("CHI",))
+    assert server.stats["requests"] == 2
+    assert limiter.stats["acquired"] == 2
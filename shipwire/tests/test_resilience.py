@@ -0,0 +1,155 @@
+import threading
+import time
+
+from shipwire.resilience import *
+from shipwire.shipwire_api import *
+from benchmarks.stub_server import StubServer
+from shipwire.transport import HTTPTransport
+
+
+def test_retry_with_backoff():
+    """
+    Failed requests to idempotent endpoints should be retried, with
+    streamed bodies sent again in full, while orders are sent once.
+    """
+    bodies = []
+    def flaky(api_uri_part, body):
+        bodies.append(body)
+        if len(bodies) < 3:
+            return 503, "Service Unavailable"
+        return "<RateResponse/>"
+
+    responses = {"RateServices.php" : flaky,
+                 "FulfillmentServices.php" : lambda *args: (500, "Oops")}
+    with StubServer(responses) as server:
+        with ResilientTransport(HTTPTransport(), retries=2, backoff=0.01,
+                                seed=1) as transport:
+            body = iter(["<Rate", "Request/>"])
+            response = transport.post(server.url + "RateServices.php", body)
+            assert response.text == "<RateResponse/>"
+            assert bodies == ["<RateRequest/>"] * 3
+            assert transport.stats["retries"] == 2
+
+            try:
+                transport.post(server.url + "FulfillmentServices.php", "<x/>")
+            except ServerError as error:
+                assert error.status == 500
+            else:
+                assert False, "server error was swallowed"
+            assert server.stats["requests"] == 4
+
+
+def test_circuit_breaker():
+    """
+    An endpoint that keeps failing should be short-circuited without
+    being called, until a trial request after the reset timeout gets
+    through.
+    """
+    with StubServer({"RateServices.php" : "<RateResponse/>"},
+                    error_rate=1.0) as server:
+        uri = server.url + "RateServices.php"
+        with ResilientTransport(HTTPTransport(), retries=0,
+                                failure_threshold=3,
+                                reset_timeout=0.2) as transport:
+            for i in range(3):
+                try:
+                    transport.post(uri, "<RateRequest/>")
+                except ServerError:
+                    pass
+            start = time.time()
+            try:
+                transport.post(uri, "<RateRequest/>")
+            except CircuitOpen:
+                pass
+            else:
+                assert False, "circuit didn't open"
+            assert time.time() - start < 0.1
+            assert server.stats["requests"] == 3
+            assert transport.breaker(uri).state == "open"
+            other = server.url + "InventoryServices.php"
+            assert transport.breaker(other).state == "closed"
+
+            time.sleep(0.25)
+            server.error_rate = 0.0
+            response = transport.post(uri, "<RateRequest/>")
+            assert response.text == "<RateResponse/>"
+            assert transport.breaker(uri).state == "closed"
+            assert transport.stats["short_circuited"] == 1
+
+
+def test_hedged_requests():
+    """
+    A slow request to an idempotent endpoint should be hedged by a
+    second one, and the quicker reply used.
+    """
+    calls = []
+    lock = threading.Lock()
+    def slow_first(api_uri_part):
+        with lock:
+            calls.append(api_uri_part)
+            return 2.0 if len(calls) == 1 else 0.0
+
+    with StubServer({"RateServices.php" : "<RateResponse/>"},
+                    latency=slow_first) as server:
+        with ResilientTransport(HTTPTransport(),
+                                hedge_after=0.1) as transport:
+            start = time.time()
+            response = transport.post(
+                server.url + "RateServices.php", "<RateRequest/>")
+            assert response.text == "<RateResponse/>"
+            assert time.time() - start < 1.0
+            assert transport.stats["hedges"] == 1
+            assert transport.stats["hedge_wins"] == 1
+
+
+def test_api_fails_fast():
+    """
+    ShipwireAPI should use a resilient transport by default, so that
+    an outage fails inventory lookups quickly.
+    """
+    with StubServer({}, error_rate=1.0) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url) as api:
+            api.transport.backoff = 0.01
+            api.inventory_concurrency = 1
+            try:
+                api._inventory_lookup(["sku_0001"], ("CHI", "UK"))
+            except PartialInventoryError as error:
+                assert sorted(error.errors.keys()) == ["CHI", "UK"]
+            else:
+                assert False, "outage was swallowed"
+            # five failures open the circuit, the rest fail fast
+            assert server.stats["requests"] == 5
+            assert api.transport.stats["short_circuited"] > 0
+
+
+def test_trial_released_on_other_errors():
+    """
+    A half-open trial which fails for reasons other than the endpoint,
+    eg. a broken request body, shouldn't leave the circuit stuck open.
+    """
+    def broken_body():
+        yield "<Rate"
+        raise ValueError("can't build the rest")
+
+    with StubServer({"RateServices.php" : "<RateResponse/>"},
+                    error_rate=1.0) as server:
+        uri = server.url + "RateServices.php"
+        with ResilientTransport(HTTPTransport(), retries=0,
+                                failure_threshold=1,
+                                reset_timeout=0.1) as transport:
+            try:
+                transport.post(uri, "<RateRequest/>")
+            except ServerError:
+                pass
+            time.sleep(0.15)
+            try:
+                transport.post(uri, broken_body())
+            except ValueError:
+                pass
+            else:
+                assert False, "body error was swallowed"
+            server.error_rate = 0.0
+            response = transport.post(uri, "<RateRequest/>")
+            assert response.text == "<RateResponse/>"
+            assert transport.breaker(uri).state == "closed"
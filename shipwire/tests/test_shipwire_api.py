@@ -133,6 +133,109 @@ def test_inventory_lookup():
         for inventory in stock:
             assert inventory.code in sku_set
             assert inventory.quantity == 2
+    api.close()
+
+
+def test_inventory_lookup_failure():
+    """
+    A failed warehouse request in ShipwireAPI._inventory_lookup should
+    reach the caller instead of being parsed as an empty reply, along
+    with the replies from the other warehouses.
+    """
+    api = MutedShipwireAPI(
+        "nobody@donotreply.pleasedonotregisterthistld",
+        "123456", 
+        "production")
+
+    def request_check(api, post_xml, api_uri_part):
+        if "<Warehouse>UK</Warehouse>" in post_xml:
+            raise IOError("connection reset")
+    api.test_hook = request_check
+    for warehouse in WAREHOUSE_CODES:
+        api._add_response("<InventoryUpdateResponse/>")
+
+    try:
+        api._inventory_lookup(["fake_sku_0001"])
+    except PartialInventoryError as error:
+        assert error.errors.keys() == ["UK"]
+        assert type(error.errors["UK"]) == IOError
+        assert len(error.report.keys()) == len(WAREHOUSE_CODES) - 1
+    else:
+        assert False, "request failure was swallowed"
+    api.close()
+
+
+class EchoShipwireAPI(MutedShipwireAPI):
+    """
+    Answers inventory requests with a quantity of 1 for each product
+    code requested, failing the requests for which 'fail' returns
+    True.
+    """
+    def __init__(self, *args, **kargs):
+        MutedShipwireAPI.__init__(self, *args, **kargs)
+        self.requests = []
+        self.fail = lambda warehouse, codes: False
+
+    def post_and_fetch(self, post_xml, api_uri_part):
+        root = etree.parse(StringIO(post_xml)).xpath("/InventoryUpdate")[0]
+        warehouse = root.xpath("Warehouse")[0].text
+        codes = [code.text for code in root.xpath("ProductCode")]
+        self.requests.append((warehouse, codes))
+        if self.fail(warehouse, codes):
+            raise IOError("connection reset")
+        products = "".join(['<Product code="{0}" quantity="1"/>'.format(code)
+                            for code in codes])
+        return "<InventoryUpdateResponse>{0}</InventoryUpdateResponse>".format(
+            products)
+
+
+def test_chunked_inventory_lookup():
+    """
+    Long SKU lists should be requested in chunks, with a failed chunk
+    retried on its own and progress reported as chunks finish.
+    """
+    api = EchoShipwireAPI(
+        "nobody@donotreply.pleasedonotregisterthistld",
+        "123456", 
+        "production")
+    api.inventory_chunk_size = 2
+    sku_list = ["sku_{0}".format(i) for i in range(5)]
+    failures = []
+    def fail_once(warehouse, codes):
+        if warehouse == "UK" and codes == ["sku_4"] and not failures:
+            failures.append(codes)
+            return True
+        return False
+    api.fail = fail_once
+    progress = []
+    report = api._inventory_lookup(
+        sku_list, ("CHI", "UK"), lambda done, total: progress.append(
+            (done, total)))
+
+    assert len(api.requests) == 7
+    assert api.requests.count(("UK", ["sku_4"])) == 2
+    assert sorted(progress) == [(i, 6) for i in range(1, 7)]
+    for warehouse in ["CHI", "UK"]:
+        assert [inv.code for inv in report[warehouse]] == sku_list
+
+    # a chunk which keeps failing spoils its whole warehouse:
+    api.requests = []
+    api.fail = lambda warehouse, codes: warehouse == "UK" and "sku_0" in codes
+    try:
+        api._inventory_lookup(sku_list, ("CHI", "UK"))
+    except PartialInventoryError as error:
+        assert error.errors.keys() == ["UK"]
+        assert error.report.keys() == ["CHI"]
+        assert len(error.report["CHI"]) == 5
+    else:
+        assert False, "chunk failure was swallowed"
+    assert api.requests.count(("UK", ["sku_0", "sku_1"])) == 3
+
+    # the whole catalog is asked for without any product codes:
+    api.requests = []
+    api._inventory_lookup(None, ("CHI",))
+    assert api.requests == [("CHI", [])]
+    api.close()
 
 
 def test_shipping_query():
@@ -288,6 +391,9 @@ RateResponse SYSTEM "http://www.shipwire.com/exec/download/RateResponse.dtd">
         assert SHIPPING.has_key(code)
         assert SHIPPING[code] == data[0]
         assert data[1] > 0
+        assert data.code == code
+        assert data.currency == "USD"
+    api.close()
 
 
 def test_order_placement():
@@ -365,4 +471,27 @@ def test_order_placement():
     assert status_code == "accepted"
     assert order_number == "testorder-14900" # hard coded in the response
     assert transaction_id == "1399577016-732240-1"
+    api.close()
+
+
 
+def test_final_chunk_errors():
+    """
+    Chunks which the transport already retried, or which ran out of
+    time, shouldn't be retried again.
+    """
+    api = EchoShipwireAPI(
+        "nobody@donotreply.pleasedonotregisterthistld",
+        "123456",
+        "production")
+    def fail(warehouse, codes):
+        raise ServerError(503, "InventoryServices.php")
+    api.fail = fail
+    try:
+        api._inventory_lookup(["sku_0"], ("CHI",))
+    except PartialInventoryError as error:
+        assert isinstance(error.errors["CHI"], ServerError)
+    else:
+        assert False, "chunk failure was swallowed"
+    assert len(api.requests) == 1
+    api.close()
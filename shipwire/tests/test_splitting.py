@@ -0,0 +1,127 @@
+
+
+import random
+
+from shipwire.splitting import *
+from shipwire.stock import StockMatrix
+
+
+def test_split_quantities():
+    """
+    A sku's quantity should be split between warehouses when none of
+    them has enough on its own, preferring domestic stock.
+    """
+    stock = {
+        "CHI" : {"sku_0001" : 2},
+        "PHL" : {"sku_0001" : 3},
+        "UK" : {"sku_0001" : 10},
+    }
+    split, remainder = split_order({"sku_0001" : 5}, stock, ["CHI", "PHL"])
+    assert split == {"CHI" : {"sku_0001" : 2}, "PHL" : {"sku_0001" : 3}}
+    assert remainder == {}
+
+    split, remainder = split_order({"sku_0001" : 16}, stock, ["CHI", "PHL"])
+    assert sorted(split.keys()) == ["CHI", "PHL", "UK"]
+    assert remainder == {"sku_0001" : 1}
+
+
+def test_split_beats_greedy():
+    """
+    Picking the warehouse which covers the most skus first would take
+    three shipments here, while two are enough.
+    """
+    stock = {
+        "CHI" : {"a" : 1, "b" : 1, "c" : 1, "d" : 1},
+        "LAX" : {"a" : 1, "b" : 1, "e" : 1},
+        "PHL" : {"c" : 1, "d" : 1, "f" : 1},
+    }
+    demand = dict.fromkeys("abcdef", 1)
+    domestic = stock.keys()
+    split, remainder = split_order(demand, stock, domestic)
+    assert sorted(split.keys()) == ["LAX", "PHL"]
+    assert remainder == {}
+    assert split_cost(split, domestic) == 2
+
+    # without any search budget, the greedy seed is all there is:
+    split, remainder = split_order(demand, stock, domestic, max_nodes=0)
+    assert len(split) == 3
+    assert remainder == {}
+
+
+def test_split_domestic_weight():
+    """
+    One international shipment should be preferred over more domestic
+    ones only when it's cheaper by the given weight.
+    """
+    stock = {
+        "CHI" : {"a" : 1},
+        "PHL" : {"b" : 1},
+        "UK" : {"a" : 1, "b" : 1},
+    }
+    demand = {"a" : 1, "b" : 1}
+    split, remainder = split_order(demand, stock, ["CHI", "PHL"])
+    assert sorted(split.keys()) == ["CHI", "PHL"]
+    split, remainder = split_order(demand, stock, ["CHI", "PHL"], intl_weight=1.5)
+    assert split.keys() == ["UK"]
+
+
+def test_candidate_splits():
+    """
+    Alternative splits should be listed best score first, without any
+    that have a warehouse to spare.
+    """
+    stock = {
+        "CHI" : {"a" : 1},
+        "PHL" : {"b" : 1},
+        "UK" : {"a" : 1, "b" : 1},
+    }
+    demand = {"a" : 1, "b" : 1}
+    splits = candidate_splits(demand, stock, ["CHI", "PHL"])
+    # CHI and UK together would ship the cart too, but UK can do it
+    # on its own:
+    assert [sorted(split.keys()) for split, remainder in splits] == [
+        ["CHI", "PHL"], ["UK"]]
+    assert splits[1] == ({"UK" : {"a" : 1, "b" : 1}}, {})
+
+
+def test_stock_matrix():
+    """
+    Stock matrices should hold the dict form's quantities, and be
+    drawn down by splits.
+    """
+    stock = {
+        "CHI" : {"a" : 2, "b" : 1},
+        "UK" : {"a" : 5},
+    }
+    matrix = StockMatrix.from_stock(stock)
+    assert matrix["CHI", "a"] == 2
+    assert matrix["UK", "b"] == 0
+    assert matrix["UK", "c"] == 0
+
+    split, remainder = split_order({"a" : 4, "b" : 1}, matrix, ["CHI"])
+    assert split == {"CHI" : {"a" : 2, "b" : 1}, "UK" : {"a" : 2}}
+    matrix.take(split)
+    assert matrix["CHI", "a"] == 0
+    assert matrix["CHI", "b"] == 0
+    assert matrix["UK", "a"] == 3
+    assert split_order({"a" : 4, "b" : 1}, matrix, ["CHI"]) == \
+        ({"UK" : {"a" : 3}}, {"a" : 1, "b" : 1})
+
+
+def test_dict_and_matrix_stock_agree():
+    """
+    Stock given as a dict or as a StockMatrix should give the same
+    splits, whatever order the warehouses come in.
+    """
+    rand = random.Random(0)
+    for i in range(20):
+        demand = dict([("sku_{0}".format(j), rand.randint(1, 4))
+                       for j in range(rand.randint(1, 12))])
+        stock = dict([(code, dict([(sku, rand.randint(-1, 6))
+                                   for sku in demand.keys()]))
+                      for code in ("TOR", "CHI", "UK", "PHL")])
+        matrix = StockMatrix.from_stock(stock)
+        assert split_order(demand, stock, ["CHI", "PHL"]) == \
+            split_order(demand, matrix, ["CHI", "PHL"])
+        assert candidate_splits(demand, stock, ["CHI", "PHL"]) == \
+            candidate_splits(demand, matrix, ["CHI", "PHL"])
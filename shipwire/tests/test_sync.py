@@ -0,0 +1,97 @@
+
+
+import os
+import shutil
+import tempfile
+
+from shipwire.common import *
+from shipwire.sync import *
+from shipwire.test_api import *
+
+
+def test_inventory_sync():
+    """
+    Syncing should store the whole catalog, then only apply what
+    changed, and keep a warehouse's old stock when it fails to answer.
+    """
+    tmpdir = tempfile.mkdtemp()
+    db = BS_PRODUCT_DATABASE
+    api = LoremIpsumAPI("test_account", "test_password", "test")
+    try:
+        store = InventoryStore(os.path.join(tmpdir, "inventory.db"))
+        sync = InventorySync(api, store)
+
+        changes = sync.run()
+        assert sorted(changes.keys()) == sorted(WAREHOUSE_CODES)
+        assert changes["CHI"] == {"added" : 4, "changed" : 0, "removed" : 0}
+        assert store.quantities("UK")["sku_0003"] == 2
+        first = store.fetched_at("CHI")
+
+        db["sku_0001"]["stock_info"]["CHI"] = 4
+        changes = sync.run()
+        assert changes["CHI"] == {"added" : 0, "changed" : 1, "removed" : 0}
+        assert changes["UK"] == {"added" : 0, "changed" : 0, "removed" : 0}
+        assert store.quantities("CHI")["sku_0001"] == 4
+        assert store.fetched_at("CHI") > first
+        # unchanged rows were fetched again too:
+        assert store._db().execute(
+            "SELECT MIN(fetched) FROM inventory WHERE warehouse = 'UK'"
+        ).fetchone()[0] == store.fetched_at("UK")
+        assert store.max_age == 3 * sync.interval
+
+        def uk_down(sku_list, warehouses=None):
+            report = LoremIpsumAPI._inventory_lookup(api, sku_list, warehouses)
+            del report["UK"]
+            raise PartialInventoryError(report, {"UK" : IOError("timeout")})
+        api._inventory_lookup = uk_down
+        db["sku_0003"]["stock_info"]["UK"] = 0
+        changes = sync.run()
+        assert "UK" not in changes
+        assert sync.last_errors.keys() == ["UK"]
+        assert store.quantities("UK")["sku_0003"] == 2
+    finally:
+        db["sku_0001"]["stock_info"]["CHI"] = 10
+        db["sku_0003"]["stock_info"]["UK"] = 2
+        api.close()
+        shutil.rmtree(tmpdir)
+
+
+def test_lookup_from_store():
+    """
+    Estimated lookups should be answered from a synced store without
+    asking the backend.
+    """
+    tmpdir = tempfile.mkdtemp()
+    api = LoremIpsumAPI("test_account", "test_password", "test")
+    try:
+        store = InventoryStore(os.path.join(tmpdir, "inventory.db"))
+        InventorySync(api, store).run()
+
+        def offline(sku_list, warehouses=None):
+            raise IOError("no network")
+        api._inventory_lookup = offline
+        api.inventory_store = store
+
+        result = api.inventory_lookup(["sku_0001", "retired_sku"], True)
+        assert result.keys() == ["sku_0001"]
+        assert result["sku_0001"]["CHI"].quantity == 10
+        assert result["sku_0001"]["PHL"].quantity == 0
+        assert api.get_availability("sku_0004") == ("CAN",)
+        try:
+            api.inventory_lookup(["sku_0001"], False)
+        except IOError:
+            pass
+        else:
+            assert False, "exact lookup was answered from the store"
+
+        # too old to be trusted:
+        store.max_age = 0
+        try:
+            api.inventory_lookup(["sku_0002"], True)
+        except IOError:
+            pass
+        else:
+            assert False, "stale store was used"
+    finally:
+        api.close()
+        shutil.rmtree(tmpdir)
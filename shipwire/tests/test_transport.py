@@ -0,0 +1,120 @@
+import re
+
+from shipwire.shipwire_api import *
+from benchmarks.stub_server import StubServer, emulated_responses
+from shipwire.transport import *
+
+
+def test_connection_reuse():
+    """
+    Consecutive requests through one transport should share a single
+    keep-alive connection.
+    """
+    responses = {"RateServices.php" : "<RateResponse/>"}
+    with StubServer(responses) as server:
+        with HTTPTransport(pool_size=2) as transport:
+            for i in range(5):
+                response = transport.post(
+                    server.url + "RateServices.php", "<RateRequest/>")
+                assert response.text == "<RateResponse/>"
+        assert server.stats["requests"] == 5
+        assert server.stats["connections"] == 1
+
+
+def test_api_owns_transport():
+    """
+    ShipwireAPI should route post_and_fetch through its transport and
+    close it when used as a context manager.
+    """
+    responses = {"RateServices.php" : "<RateResponse/>"}
+    with StubServer(responses) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url) as api:
+            reply = api.post_and_fetch("<RateRequest/>", "RateServices.php")
+            assert reply == "<RateResponse/>"
+        assert api.transport.closed
+
+        try:
+            api.post_and_fetch("<RateRequest/>", "RateServices.php")
+        except TransportClosed:
+            pass
+        else:
+            assert False, "closed transport accepted a request"
+
+
+def test_shared_transport():
+    """
+    An API instance should not close a transport that it was handed.
+    """
+    transport = HTTPTransport()
+    api = ShipwireAPI("test_account", "test_password", "test",
+                      transport=transport)
+    api.close()
+    assert not transport.closed
+    transport.close()
+    assert transport.closed
+
+
+def test_server_endpoints():
+    """
+    Both servers should map to their Shipwire base urls.
+    """
+    prod = ShipwireAPI("test_account", "test_password", "production")
+    beta = ShipwireAPI("test_account", "test_password", "test")
+    assert prod.endpoint == "https://api.shipwire.com/exec/"
+    assert beta.endpoint == "https://api.beta.shipwire.com/exec/"
+    prod.close()
+    beta.close()
+
+
+def test_streamed_inventory_lookup():
+    """
+    Inventory requests should be sent as a chunked stream, and their
+    replies parsed as they arrive.
+    """
+    def echo(api_uri_part, body):
+        codes = re.findall("<ProductCode>(.*?)</ProductCode>", body)
+        products = "".join(['<Product code="{0}" quantity="3"/>'.format(code)
+                            for code in codes])
+        return "<InventoryUpdateResponse>{0}</InventoryUpdateResponse>".format(
+            products)
+
+    sku_list = ["sku_{0}".format(i) for i in range(2500)]
+    with StubServer({"InventoryServices.php" : echo}) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url) as api:
+            api.inventory_chunk_size = None
+            api.stream_chunk_size = 1024
+            report = api._inventory_lookup(sku_list, ("CHI",))
+        assert server.stats["chunked"] == 1
+    assert [inv.code for inv in report["CHI"]] == sku_list
+    assert set([inv.quantity for inv in report["CHI"]]) == set([3])
+
+
+def test_emulated_endpoints():
+    """
+    The emulating stub should answer inventory lookups, quotes and
+    orders the way Shipwire does, so that whole flows can run locally.
+    """
+    addr = AddressInfo("Some Body", "12345 S Someplace Rd", "", "Duster",
+                       "IN", "United States", "47999", "123-4567", "")
+    with StubServer(emulated_responses(padding=100)) as server:
+        with ShipwireAPI("test_account", "test_password", "test",
+                         endpoint=server.url) as api:
+            skus = ["sku_000001", "sku_000002", "sku_000003"]
+            stock = api.inventory_lookup(skus)
+            assert sorted(stock.keys()) == skus
+            assert stock == api.inventory_lookup(skus)
+
+            split_cart, remainder = api.optimal_order_splitting(
+                addr, CartItems({"sku_000001" : 1}))
+            assert not remainder
+            warehouse = split_cart.order_split.keys()[0]
+            method = "GD" if is_domestic(addr, warehouse) else "INTL"
+
+            options = api.get_shipping_options(addr, split_cart)
+            assert options[warehouse][method].cost > 0
+            results = api.place_order(addr, split_cart, {warehouse : method},
+                                      order_id="o1")
+            assert results[warehouse].ok
+            assert results[warehouse].order_number.startswith("o1-")
@@ -0,0 +1,85 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TransportClosed(Exception):
+    """
+    Raised when a request is made through a transport that has
+    already been closed.
+    """
+    pass
+
+
+class HTTPTransport(object):
+    """
+    Keep-alive HTTP transport used by ShipwireAPI.
+
+    Wraps a requests.Session with a bounded connection pool per host,
+    so that consecutive calls to api.shipwire.com (or
+    api.beta.shipwire.com) reuse warm connections rather than paying
+    for a fresh TCP and TLS handshake every time.
+    """
+
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=30.0,
+                 block=True):
+        """
+        Argument 'pool_size' is the maximum number of connections kept
+        open to any one host.  When 'block' is True, callers wait for a
+        free connection instead of opening extra ones beyond that
+        limit.  Arguments 'connect_timeout' and 'read_timeout' are in
+        seconds; either may be None to wait forever.
+        """
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.closed = False
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2,  # production and beta
+            pool_maxsize=pool_size,
+            pool_block=block)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    @property
+    def timeout(self):
+        """
+        The (connect, read) timeout tuple passed to requests.
+        """
+        return (self.connect_timeout, self.read_timeout)
+
+    def post(self, uri, data, headers=None, stream=False, throttle=None):
+        """
+        Posts 'data' to 'uri' over a pooled connection and returns the
+        requests.Response object.  'data' may be a byte string, or an
+        iterable of byte strings which is sent with chunked transfer
+        encoding as it is produced.  If 'stream' is True, the reply's
+        body is left unread; the response must then be read through
+        and closed to release its connection.  If 'throttle' is given,
+        it is called before the request is sent, eg. to wait for a
+        rate limiter.
+        """
+        if self.closed:
+            raise TransportClosed("Transport has been closed.")
+        if throttle is not None:
+            throttle()
+        return self.session.post(
+            uri, data=data, headers=headers, timeout=self.timeout,
+            stream=stream)
+
+    def close(self):
+        """
+        Closes all pooled connections.  Further requests will raise
+        TransportClosed.
+        """
+        if not self.closed:
+            self.closed = True
+            self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False